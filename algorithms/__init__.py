@@ -2,12 +2,15 @@ from .content_based import ContentBasedRecommender
 from .decision_tree_recommender import DecisionTreeRecommender
 from .large_model_recommender import LargeModelRecommender
 from .apriori_recommender import AprioriRecommender
-from .collaborative_filtering import CollaborativeFiltering
+from .collaborative_filtering import CollaborativeFiltering, ItemBasedCollaborativeFiltering
+from .als_recommender import ALSRecommender
 
 __all__ = [
     'ContentBasedRecommender',
     'DecisionTreeRecommender',
     'LargeModelRecommender',
     'AprioriRecommender',
-    'CollaborativeFiltering'
+    'CollaborativeFiltering',
+    'ItemBasedCollaborativeFiltering',
+    'ALSRecommender'
 ]
\ No newline at end of file
@@ -0,0 +1,265 @@
+try:
+    from .database_utils import DatabaseManager
+    from .collaborative_filtering import build_rating_matrix, DEFAULT_BATCH_BLOCK_SIZE
+    from .ranking import select_top_n
+    from .model_refresh import BackgroundRefreshModel
+except ImportError:
+    from database_utils import DatabaseManager
+    from collaborative_filtering import build_rating_matrix, DEFAULT_BATCH_BLOCK_SIZE
+    from ranking import select_top_n
+    from model_refresh import BackgroundRefreshModel
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+# 隐因子维度
+DEFAULT_FACTORS = 32
+# 交替最小二乘的迭代轮数
+DEFAULT_ITERATIONS = 15
+# 正则化系数（显式评分时按每个用户/产品的评分数加权）
+DEFAULT_REGULARIZATION = 0.1
+# 隐式反馈的置信度系数：置信度 = 1 + alpha × 购买次数
+DEFAULT_ALPHA = 10.0
+# 每个求解块中 评分数×因子数² 的上限（约64MB的float32），限制外积张量的内存；
+# 固定侧 行数×因子数² 不超过它时预先计算外积表
+ALS_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+
+def build_purchase_matrix(db, chunksize=None):
+    """构建用户-产品购买次数矩阵（隐式反馈），返回 (CSR矩阵, 有序用户ID数组, 有序产品ID数组)"""
+    columns = ['user_id', 'product_id']
+    where = "behavior_type = 'purchase'"
+    if chunksize is None:
+        behavior_df = db.get_user_behavior(columns=columns + ['behavior_type'], compact=True)
+        parts = [behavior_df[behavior_df['behavior_type'] == 'purchase']]
+    else:
+        parts = list(db.iter_user_behavior(chunksize=chunksize, columns=columns, where=where))
+    user_col = np.concatenate([part['user_id'].to_numpy() for part in parts]) if parts else np.array([], int)
+    product_col = np.concatenate([part['product_id'].to_numpy() for part in parts]) if parts else np.array([], int)
+
+    user_ids, user_idx = np.unique(user_col, return_inverse=True)
+    product_ids, product_idx = np.unique(product_col, return_inverse=True)
+    counts = sparse.coo_matrix((np.ones(len(user_col)), (user_idx, product_idx)),
+                               shape=(len(user_ids), len(product_ids))).tocsr()
+    counts.sum_duplicates()
+    return counts, user_ids, product_ids
+
+
+def solve_factor_block(matrix, fixed, rows, regularization, implicit, alpha, gram=None, outer_table=None):
+    """固定一侧因子，为 matrix 中 rows 这些行求解最小二乘，返回 (行数×因子数) 的float32因子
+
+    同一块内所有行的正规方程先组装好，再用批量 np.linalg.solve 一次求解。
+    各行的 YᵀWY 按以下方式计算，大部分时间都在释放GIL的BLAS/LAPACK和稀疏乘法中：
+    - 提供了 outer_table（固定侧每个因子向量的外积表）时，用 加权评分子矩阵 @ 外积表 一次得到；
+    - 否则评分数少于因子数的短行用逐项外积加稀疏求和，长行逐行做矩阵乘法。
+    """
+    num_factors = fixed.shape[1]
+    result = np.zeros((len(rows), num_factors), dtype=np.float32)
+    sub = matrix[rows]
+    counts = np.diff(sub.indptr)
+    nonempty = np.flatnonzero(counts)
+    if len(nonempty) == 0:
+        return result
+
+    data = sub.data.astype(np.float32)
+    if implicit:
+        # 隐式反馈：A = YᵀY + Yᵀ(Cu - I)Y + λI，b = YᵀCu·1
+        confidence = 1 + alpha * data
+        gram_weights, rhs_weights = confidence - 1, confidence
+        base = gram + regularization * np.eye(num_factors, dtype=np.float32)
+    else:
+        # 显式评分：只在已评分的项上拟合，A = YᵀY + λ·n·I，b = Yᵀr
+        gram_weights, rhs_weights = np.ones_like(data), data
+        base = (regularization * counts).astype(np.float32)[:, None, None] * np.eye(num_factors, dtype=np.float32)
+
+    def weighted(weights):
+        return sparse.csr_matrix((weights, sub.indices, sub.indptr), shape=sub.shape)
+
+    b = weighted(rhs_weights) @ fixed
+    if outer_table is not None:
+        A = (weighted(gram_weights) @ outer_table).reshape(-1, num_factors, num_factors)
+    else:
+        A = np.zeros((len(rows), num_factors, num_factors), dtype=np.float32)
+        short = counts < num_factors
+        # 短行：逐项外积，再用 行×评分项 的稀疏求和矩阵按行累加
+        entry_rows = np.repeat(short, counts)
+        Y = fixed[sub.indices[entry_rows]]
+        outer = (gram_weights[entry_rows][:, None, None] * Y[:, :, None] * Y[:, None, :]).reshape(len(Y), num_factors * num_factors)
+        short_indptr = np.concatenate([[0], np.cumsum(np.where(short, counts, 0))])
+        segments = sparse.csr_matrix((np.ones(len(Y), dtype=np.float32), np.arange(len(Y)), short_indptr),
+                                     shape=(len(rows), len(Y)))
+        A += (segments @ outer).reshape(-1, num_factors, num_factors)
+        # 长行：逐行 YᵀWY
+        for row in np.flatnonzero(~short):
+            entries = slice(sub.indptr[row], sub.indptr[row + 1])
+            Y = fixed[sub.indices[entries]]
+            A[row] = (Y * gram_weights[entries][:, None]).T @ Y
+    A = A + base
+    result[nonempty] = np.linalg.solve(A[nonempty], b[nonempty][:, :, None])[:, :, 0]
+    return result
+
+
+def _row_blocks(indptr, max_entries):
+    """把行按评分数切块，每块的评分数不超过 max_entries（单行超过时独占一块）"""
+    num_rows = len(indptr) - 1
+    start = 0
+    while start < num_rows:
+        end = int(np.searchsorted(indptr, indptr[start] + max_entries, side='right')) - 1
+        end = min(max(end, start + 1), num_rows)
+        yield start, end
+        start = end
+
+
+class ALSRecommender(BackgroundRefreshModel):
+    """矩阵分解推荐：用交替最小二乘(ALS)训练用户、产品隐因子
+
+    signal='rating' 时拟合行为表中的显式评分；signal='purchase' 时把购买次数作为隐式反馈。
+    训练时每一轮的用户/产品求解按块分发到线程池并行，因子矩阵使用float32；
+    推荐时只需 用户因子·产品因子 的点积再选Top-N。
+    """
+
+    def __init__(self, factors=DEFAULT_FACTORS, iterations=DEFAULT_ITERATIONS,
+                 regularization=DEFAULT_REGULARIZATION, signal='rating', alpha=DEFAULT_ALPHA,
+                 n_threads=None, chunksize=None, auto_refit=True, random_state=42):
+        if signal not in ('rating', 'purchase'):
+            raise ValueError(f"未知的训练信号: {signal}")
+        super().__init__(DatabaseManager(), auto_refit=auto_refit)
+        self.factors = factors
+        self.iterations = iterations
+        self.regularization = regularization
+        self.signal = signal
+        self.alpha = alpha
+        self.n_threads = n_threads or os.cpu_count() or 1
+        # 设置后按批流式读取行为数据，否则一次性读取（走内存快照）
+        self.chunksize = chunksize
+        self.random_state = random_state
+
+    def _solve(self, executor, matrix, fixed):
+        """并行求解 matrix 每一行的因子"""
+        implicit = self.signal == 'purchase'
+        gram = (fixed.T @ fixed) if implicit else None
+        # 固定侧较小（通常是产品侧）时预先算好每个因子向量的外积，组装时只需一次稀疏乘法
+        outer_table = None
+        if len(fixed) * self.factors * self.factors <= ALS_BLOCK_ELEMENTS:
+            outer_table = (fixed[:, :, None] * fixed[:, None, :]).reshape(len(fixed), -1)
+        max_entries = max(1, ALS_BLOCK_ELEMENTS // (self.factors * self.factors))
+        blocks = list(_row_blocks(matrix.indptr, max_entries))
+        factors = np.zeros((matrix.shape[0], self.factors), dtype=np.float32)
+        futures = [(start, end, executor.submit(solve_factor_block, matrix, fixed, np.arange(start, end),
+                                                self.regularization, implicit, self.alpha, gram, outer_table))
+                   for start, end in blocks]
+        for start, end, future in futures:
+            factors[start:end] = future.result()
+        return factors
+
+    def fit(self):
+        """训练：交替固定产品因子求用户因子、固定用户因子求产品因子"""
+        start = time.time()
+        # 先记录数据版本再读取数据，读取期间如有新数据，下次请求会触发重新训练
+        version = self.db.table_version('user_behavior')
+        if self.signal == 'purchase':
+            matrix, user_ids, product_ids = build_purchase_matrix(self.db, self.chunksize)
+        else:
+            matrix, user_ids, product_ids = build_rating_matrix(self.db, self.chunksize)
+        matrix = matrix.astype(np.float32)
+        matrix_t = matrix.T.tocsr()
+
+        rng = np.random.default_rng(self.random_state)
+        user_factors = np.zeros((len(user_ids), self.factors), dtype=np.float32)
+        item_factors = (rng.standard_normal((len(product_ids), self.factors)) * 0.01).astype(np.float32)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for _ in range(self.iterations):
+                user_factors = self._solve(executor, matrix, item_factors)
+                item_factors = self._solve(executor, matrix_t, user_factors)
+
+        # 训练误差只在已观测的项上计算
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        predicted = np.einsum('ij,ij->i', user_factors[rows], item_factors[matrix.indices])
+        target = matrix.data if self.signal == 'rating' else np.ones_like(matrix.data)
+        rmse = float(np.sqrt(np.mean((predicted - target) ** 2))) if len(target) else 0.0
+
+        self.model = {
+            'version': version,
+            'matrix': matrix,
+            'user_ids': user_ids,
+            'product_ids': product_ids,
+            'user_factors': user_factors,
+            'item_factors': item_factors,
+        }
+        summary = {
+            'users': len(user_ids),
+            'products': len(product_ids),
+            'observations': int(matrix.nnz),
+            'factors': self.factors,
+            'iterations': self.iterations,
+            'train_rmse': round(rmse, 4),
+            'fit_seconds': round(time.time() - start, 3),
+        }
+        print(f"ALS矩阵分解模型训练完成: {summary}")
+        return summary
+
+    def _format(self, product_ids, product_names, selected, scores):
+        """把选中的产品下标转换为推荐结果"""
+        score_key = 'predicted_rating' if self.signal == 'rating' else 'score'
+        return [{
+            'product_id': int(product_ids[idx]),
+            'product_name': product_names[idx],
+            score_key: float(scores[idx])
+        } for idx in selected if not pd.isna(product_names[idx])]
+
+    def recommend_for_user(self, target_user_id, top_n=5):
+        """为目标用户生成推荐"""
+        model = self.ensure_model()
+        user_ids, product_ids = model['user_ids'], model['product_ids']
+        pos = np.searchsorted(user_ids, target_user_id)
+        if pos >= len(user_ids) or user_ids[pos] != target_user_id:
+            return []  # 新用户，没有训练数据
+
+        # 按float64累加，单个用户和批量推荐的打分结果一致
+        scores = model['item_factors'] @ model['user_factors'][pos].astype(np.float64)
+        candidates = np.ones(len(product_ids), dtype=bool)
+        candidates[model['matrix'][pos].indices] = False  # 排除已评分/已购买的产品
+        selected = select_top_n(scores, candidates, top_n)
+
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids).to_numpy()
+        return self._format(product_ids, product_names, selected, scores)
+
+    def recommend_for_users(self, user_ids, top_n=5, block_size=DEFAULT_BATCH_BLOCK_SIZE):
+        """批量为多个用户生成推荐，返回 {用户ID: 推荐列表}，每块用户的打分为一次矩阵乘法"""
+        model = self.ensure_model()
+        model_user_ids, product_ids, matrix = model['user_ids'], model['product_ids'], model['matrix']
+
+        user_ids = list(user_ids)
+        positions = np.searchsorted(model_user_ids, user_ids)
+        positions = np.clip(positions, 0, max(len(model_user_ids) - 1, 0))
+        known = np.flatnonzero(model_user_ids[positions] == np.asarray(user_ids)) if len(model_user_ids) else []
+        known_positions = positions[known]
+
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids).to_numpy()
+
+        results = {user_id: [] for user_id in user_ids}
+        for start in range(0, len(known_positions), block_size):
+            block = known_positions[start:start + block_size]
+            scores = model['user_factors'][block].astype(np.float64) @ model['item_factors'].T
+            candidates = matrix[block].toarray() == 0
+            for offset, i in enumerate(known[start:start + block_size]):
+                selected = select_top_n(scores[offset], candidates[offset], top_n)
+                results[user_ids[i]] = self._format(product_ids, product_names, selected, scores[offset])
+        return results
+
+
+# 测试代码
+if __name__ == "__main__":
+    als = ALSRecommender()
+    user_id = 2
+    recommendations = als.recommend_for_user(user_id)
+
+    print(f"\n为用户 {user_id} 的矩阵分解推荐结果:")
+    for i, rec in enumerate(recommendations, 1):
+        print(f"{i}. {rec['product_name']} (预测评分: {rec['predicted_rating']:.2f})")
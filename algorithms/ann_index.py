@@ -0,0 +1,162 @@
+# ann_index.py
+# 近似最近邻索引：基于随机投影的局部敏感哈希(LSH)，用于在大规模用户中快速查找余弦相似的近邻
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+# 自动选择哈希位数时，每个桶期望包含的向量数
+DEFAULT_BUCKET_SIZE = 64
+DEFAULT_TABLES = 16
+DEFAULT_PROBES = 8
+# 计算投影时每块的行数
+PROJECTION_BLOCK_ROWS = 65536
+
+
+class RandomProjectionLSH:
+    """随机投影LSH（SimHash）索引，近似查找余弦相似度最高的向量
+
+    每张哈希表用 n_bits 个随机超平面把向量编码为 n_bits 位的签名，余弦相似度越高的两个向量
+    签名相同的概率越大。查询时取出各表中同桶（以及多探测的相邻桶）的向量作为候选，
+    再用精确的余弦相似度重排。调节召回率/延迟的参数：
+    - n_tables：哈希表数量，越多召回越高、候选越多；
+    - n_bits：签名位数，越多桶越小、候选越少、召回越低，None 时按 DEFAULT_BUCKET_SIZE 自动选择；
+    - n_probes：每张表探测的桶数，除自身的桶外依次翻转投影值最接近0的位，越多召回越高。
+    """
+
+    def __init__(self, n_tables=DEFAULT_TABLES, n_bits=None, n_probes=DEFAULT_PROBES, random_state=42):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.random_state = random_state
+        self.vectors = None
+
+    def fit(self, vectors):
+        """为向量矩阵（行向量，稀疏或稠密）建立索引，向量会先做L2归一化"""
+        start = time.time()
+        self.vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float64), norm='l2', axis=1)
+        num_rows, dim = self.vectors.shape
+        if self.n_bits is None:
+            self.n_bits_ = int(np.clip(np.ceil(np.log2(max(num_rows / DEFAULT_BUCKET_SIZE, 2))), 1, 62))
+        else:
+            self.n_bits_ = int(self.n_bits)
+        rng = np.random.default_rng(self.random_state)
+        self.planes = rng.standard_normal((dim, self.n_tables * self.n_bits_)).astype(np.float32)
+        # 非负的评分向量都落在同一象限，超平面经过均值点而不是原点，桶的大小更均匀
+        self.offset = np.asarray(self.vectors.mean(axis=0)).ravel() @ self.planes
+        self._weights = np.left_shift(np.int64(1), np.arange(self.n_bits_, dtype=np.int64))
+
+        # 每张表保存按签名排序后的向量下标，同一个桶是排序数组中连续的一段
+        codes = np.empty((self.n_tables, num_rows), dtype=np.int64)
+        for block_start in range(0, num_rows, PROJECTION_BLOCK_ROWS):
+            block = slice(block_start, min(block_start + PROJECTION_BLOCK_ROWS, num_rows))
+            projections = np.asarray(self.vectors[block] @ self.planes) - self.offset
+            codes[:, block] = self._codes(projections).T
+        self.order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+        self.sorted_codes = np.take_along_axis(codes, self.order.astype(np.int64), axis=1)
+        self.build_seconds = time.time() - start
+        return self
+
+    def _codes(self, projections):
+        """把投影值转换为每张表的签名，返回 (行数×表数) 的int64数组"""
+        bits = (projections > 0).reshape(len(projections), self.n_tables, self.n_bits_)
+        return bits.astype(np.int64) @ self._weights
+
+    def _probe_codes(self, projections):
+        """返回 (行数×表数×探测数) 的签名：自身的桶，以及依次翻转投影值最接近0的位得到的相邻桶"""
+        projections = projections.reshape(len(projections), self.n_tables, self.n_bits_)
+        base = ((projections > 0).astype(np.int64) @ self._weights)[:, :, None]
+        n_flips = min(self.n_probes, self.n_bits_ + 1) - 1
+        if n_flips <= 0:
+            return base
+        uncertain = np.argsort(np.abs(projections), axis=2)[:, :, :n_flips]
+        return np.concatenate([base, base ^ self._weights[uncertain]], axis=2)
+
+    def _candidate_pairs(self, rows_projection):
+        """批量取出候选：返回 (查询行号数组, 候选下标数组)，已去重"""
+        probes = self._probe_codes(rows_projection)
+        num_queries, _, num_probes = probes.shape
+        query_parts, candidate_parts = [], []
+        for table in range(self.n_tables):
+            codes = probes[:, table, :].ravel()
+            lo = np.searchsorted(self.sorted_codes[table], codes, side='left')
+            hi = np.searchsorted(self.sorted_codes[table], codes, side='right')
+            sizes = hi - lo
+            total = int(sizes.sum())
+            if total == 0:
+                continue
+            # 把每个桶在排序数组中的区间 [lo, hi) 展开成连续的位置
+            offsets = np.repeat(lo - np.cumsum(sizes) + sizes, sizes) + np.arange(total)
+            query_parts.append(np.repeat(np.arange(len(codes)) // num_probes, sizes))
+            candidate_parts.append(self.order[table, offsets])
+        if not query_parts:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        num_rows = self.vectors.shape[0]
+        pairs = np.concatenate(query_parts).astype(np.int64) * num_rows + np.concatenate(candidate_parts)
+        pairs.sort()
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        return pairs // num_rows, pairs % num_rows
+
+    def candidates(self, vector):
+        """返回与查询向量落在相同（或探测到的）桶中的候选下标"""
+        projection = (np.asarray(vector @ self.planes) - self.offset).reshape(1, -1)
+        return self._candidate_pairs(projection)[1]
+
+    def _pair_similarities(self, query_vectors, candidates):
+        """逐对计算 query_vectors 第i行与第 candidates[i] 个向量的余弦相似度"""
+        return np.asarray(query_vectors.multiply(self.vectors[candidates]).sum(axis=1)).ravel()
+
+    def query(self, vector, k, exclude=None):
+        """查询与 vector 最相似的k个向量，返回 (下标数组, 余弦相似度数组)，按相似度降序
+
+        vector 为1×维度的行向量（需已L2归一化）；exclude 为需要排除的下标（如查询用户自己）。
+        """
+        candidates = self.candidates(vector)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if len(candidates) == 0 or k <= 0:
+            return np.array([], dtype=np.int32), np.array([])
+        vector = sparse.csr_matrix(vector, dtype=np.float64)
+        similarities = self._pair_similarities(vector[np.zeros(len(candidates), dtype=np.int64)], candidates)
+        k = min(k, len(candidates))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        # 相似度降序，相同时下标小的在前
+        order = np.lexsort((candidates[top], -similarities[top]))
+        top = top[order]
+        return candidates[top], similarities[top]
+
+    def query_row(self, row, k):
+        """查询索引中第row个向量的k个近邻（排除自己）"""
+        return self.query(self.vectors[row], k, exclude=row)
+
+    def all_neighbours(self, k, block_rows=1024):
+        """为索引中每个向量查询k个近邻，返回与 top_k_neighbours 相同格式的 (下标矩阵, 相似度矩阵)
+
+        按块批量处理：一次取出整块查询的 (查询, 候选) 对，逐对计算相似度后按查询分组取Top-K。
+        候选不足k个时，剩余位置的下标为-1、相似度为0，使用方需按 下标>=0 过滤。
+        """
+        num_rows = self.vectors.shape[0]
+        k = max(min(k, num_rows - 1), 0)
+        neighbour_idx = np.full((num_rows, k), -1, dtype=np.int32)
+        neighbour_sim = np.zeros((num_rows, k), dtype=np.float64)
+        if k == 0:
+            return neighbour_idx, neighbour_sim
+
+        for start in range(0, num_rows, block_rows):
+            end = min(start + block_rows, num_rows)
+            projections = np.asarray(self.vectors[start:end] @ self.planes) - self.offset
+            queries, candidates = self._candidate_pairs(projections)
+            keep = candidates != queries + start  # 排除自己
+            queries, candidates = queries[keep], candidates[keep]
+            similarities = self._pair_similarities(self.vectors[queries + start], candidates)
+
+            # 按 (查询, 相似度降序, 下标) 排序，每个查询取前k个
+            order = np.lexsort((candidates, -similarities, queries))
+            queries, candidates, similarities = queries[order], candidates[order], similarities[order]
+            group_start = np.searchsorted(queries, np.arange(end - start))
+            rank = np.arange(len(queries)) - group_start[queries]
+            top = rank < k
+            neighbour_idx[start + queries[top], rank[top]] = candidates[top]
+            neighbour_sim[start + queries[top], rank[top]] = similarities[top]
+        return neighbour_idx, neighbour_sim
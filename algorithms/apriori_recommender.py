@@ -1,86 +1,388 @@
 try:
     from .database_utils import DatabaseManager
+    from .fp_growth import fp_growth, association_rules, negative_border, update_border
+    from .bitset_index import VerticalBitsets
+    from .rule_store import RuleStore, LOOKUP_BATCH_SIZE
+    from .son_mining import son_frequent_itemsets, DEFAULT_PARTITION_CHUNK_SIZE
+    from .model_refresh import BackgroundRefreshModel
 except ImportError:
     from database_utils import DatabaseManager
-import pandas as pd
+    from fp_growth import fp_growth, association_rules, negative_border, update_border
+    from bitset_index import VerticalBitsets
+    from rule_store import RuleStore, LOOKUP_BATCH_SIZE
+    from son_mining import son_frequent_itemsets, DEFAULT_PARTITION_CHUNK_SIZE
+    from model_refresh import BackgroundRefreshModel
+import sys
+import math
+import time
+import numpy as np
 from itertools import combinations
 
-class AprioriRecommender:
-    def __init__(self, min_support=0.2, min_confidence=0.5):
+class AprioriRecommender(BackgroundRefreshModel):
+    def __init__(self, min_support=0.2, min_confidence=0.5, chunksize=None, max_len=None, miner='fpgrowth',
+                 use_rule_table=True, n_workers=None, n_partitions=None, auto_refit=True):
+        # 购买数据变化后在后台线程增量更新模型，推荐请求继续使用当前模型
+        super().__init__(DatabaseManager(), auto_refit=auto_refit)
         self.min_support = min_support
         self.min_confidence = min_confidence
-        self.db = DatabaseManager()
+        # 频繁项集的最大长度，None表示不限制
+        self.max_len = max_len
+        # fpgrowth: FP树挖掘；eclat: 在垂直位图上按位与+popcount挖掘，事务数很大时内存更小；
+        # son: 按用户区间分区，在多个进程中两阶段并行挖掘（进程数默认等于CPU核数）
+        if miner not in ('fpgrowth', 'eclat', 'son'):
+            raise ValueError(f"未知的频繁项集挖掘方法: {miner}")
+        self.miner = miner
+        self.n_workers = n_workers
+        self.n_partitions = n_partitions
+        # 设置后按批流式读取购买记录，否则一次性读取（走内存快照）
+        self.chunksize = chunksize
+        # 规则表由 build_rule_table 离线构建；存在时推荐直接查表，不再在线挖掘
+        self.use_rule_table = use_rule_table
+        self.rule_store = RuleStore(self.db)
+    
+    def prepare_purchase_pairs(self, max_rowid=None, return_version=False):
+        """读取购买记录，返回 (用户ID数组, 产品ID数组)
+
+        max_rowid 给定时只读取该rowid（含）之前的记录，否则读取到当前指纹中的最大rowid为止；
+        return_version 为True时（不指定 max_rowid）最后再返回读入的行对应的行为表指纹，其最大rowid可直接作为水位线。
+        """
+        columns = ['user_id', 'product_id']
+        if self.chunksize is None:
+            behavior_df, version = self.db.load_table('user_behavior', columns + ['behavior_type'],
+                                                      compact=True, with_version=True)
+            if max_rowid is None or (version[1] or 0) <= max_rowid:
+                # 只考虑购买行为
+                purchase_df = behavior_df[behavior_df['behavior_type'] == 'purchase']
+                pairs = purchase_df['user_id'].to_numpy(), purchase_df['product_id'].to_numpy()
+                return pairs + (version,) if return_version else pairs
+            # 快照中已有水位线之后的行，无法按rowid截断，退回到分批读取
+        
+        if max_rowid is None:
+            version = self.db.table_version('user_behavior')
+            max_rowid = version[1] or 0
+        # 流式读取：购买过滤和rowid截断下推到SQL，逐批收集
+        user_parts, product_parts = [], []
+        for chunk in self.db.iter_user_behavior(chunksize=self.chunksize or DEFAULT_PARTITION_CHUNK_SIZE,
+                                                columns=columns, where="behavior_type = 'purchase' AND rowid <= ?",
+                                                params=(max_rowid,)):
+            user_parts.append(chunk['user_id'].to_numpy())
+            product_parts.append(chunk['product_id'].to_numpy())
+        if not user_parts:
+            pairs = np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        else:
+            pairs = np.concatenate(user_parts), np.concatenate(product_parts)
+        return pairs + (version,) if return_version else pairs
     
     def prepare_transaction_data(self):
         """准备交易数据：每个用户的购买记录作为一个事务"""
-        behavior_df = self.db.get_user_behavior()
-        # 只考虑购买行为
-        purchase_df = behavior_df[behavior_df['behavior_type'] == 'purchase']
-        
-        # 按用户分组，收集购买的产品ID
-        transactions = purchase_df.groupby('user_id')['product_id'].apply(list).tolist()
-        return transactions
+        user_col, product_col = self.prepare_purchase_pairs()
+        # 按用户分组，收集购买的产品ID（按用户ID排序，组内保持原始顺序）
+        order = np.argsort(user_col, kind='stable')
+        users, starts = np.unique(user_col[order], return_index=True)
+        return [group.tolist() for group in np.split(product_col[order], starts[1:])] if len(users) else []
+    
+    def build_bitsets(self, max_rowid=None, return_version=False):
+        """构建垂直位图：每个产品对应一个按事务（用户）打包的位数组
+
+        max_rowid、return_version 的含义同 prepare_purchase_pairs，return_version 为True时返回 (位图, 指纹)。
+        """
+        pairs = self.prepare_purchase_pairs(max_rowid, return_version)
+        user_col, product_col = pairs[:2]
+        users, transaction_idx = np.unique(user_col, return_inverse=True)
+        bitsets = VerticalBitsets.from_pairs(transaction_idx, product_col, len(users))
+        return (bitsets, pairs[2]) if return_version else bitsets
     
     def find_frequent_itemsets(self, transactions):
-        """实现Apriori算法找频繁项集"""
-        # 这里先实现一个简化版本，你可以后续完善
-        itemsets = {}
+        """挖掘频繁项集（包含多项集），返回 {frozenset(项集): 支持度}
+
+        transactions 可以是事务列表（FP-Growth）或 VerticalBitsets（Eclat）。
+        """
+        if isinstance(transactions, VerticalBitsets):
+            frequent_itemsets = transactions.eclat(self.min_support, self.max_len)
+        else:
+            frequent_itemsets = fp_growth(transactions, self.min_support, self.max_len)
+        print(f"找到 {len(frequent_itemsets)} 个频繁项集")
+        return frequent_itemsets
+    
+    def generate_rules(self, frequent_itemsets):
+        """由频繁项集生成满足最小置信度的关联规则（含支持度、置信度、提升度）"""
+        rules = association_rules(frequent_itemsets, self.min_confidence)
+        print(f"生成 {len(rules)} 条关联规则")
+        return rules
+    
+    def fit(self):
+        """训练：挖掘频繁项集和关联规则，并按前件建立索引"""
+        start = time.time()
+        # 版本和水位线取自实际读入的行，之后的每次读取（含SON各分区）都按同一水位线截断，
+        # 读取期间追加的购买不在模型中，下次更新时只作为增量应用一次
+        bitsets, version = self.build_bitsets(return_version=True)
+        watermark = version[1] or 0
+        if self.miner == 'son':
+            frequent_itemsets = son_frequent_itemsets(
+                self.db.db_path, self.min_support, self.max_len, n_partitions=self.n_partitions,
+                max_workers=self.n_workers, chunksize=self.chunksize or DEFAULT_PARTITION_CHUNK_SIZE,
+                max_rowid=watermark)
+        else:
+            # FP-Growth的事务列表直接由位图还原，不再第二次读取购买记录
+            transactions = bitsets if self.miner == 'eclat' else bitsets.transactions()
+            frequent_itemsets = self.find_frequent_itemsets(transactions)
         
-        # 计算单项支持度
-        for transaction in transactions:
-            for item in transaction:
-                itemsets[frozenset([item])] = itemsets.get(frozenset([item]), 0) + 1
+        # 保存频繁项集及其负边界的支持数，新增购买时只需更新这些计数（FUP增量维护）
+        num_transactions = bitsets.num_transactions
+        frequent_counts = {itemset: int(round(support * num_transactions))
+                           for itemset, support in frequent_itemsets.items()}
+        border = list(negative_border(frequent_itemsets, bitsets.items.tolist(), self.max_len))
+        border_counts = dict(zip(border, bitsets.support_counts(border)))
+        self.model = self._build_model(version, watermark, num_transactions, frequent_counts, border_counts,
+                                       bitsets)
+        summary = {
+            'transactions': num_transactions,
+            'frequent_itemsets': len(frequent_itemsets),
+            'negative_border': len(border_counts),
+            'rules': len(self.model['rules']),
+            'bitset_bytes': bitsets.memory_bytes(),
+            'fit_seconds': round(time.time() - start, 3),
+        }
+        print(f"关联规则模型训练完成: {summary}")
+        return summary
+    
+    def _build_model(self, version, watermark, num_transactions, frequent_counts, border_counts, bitsets=None):
+        """由频繁项集和负边界的支持数生成规则及索引，组装成模型
+
+        bitsets 为None表示位图已过期（增量更新后），itemset_support 会按需重建。
+        """
+        frequent_itemsets = {itemset: count / num_transactions for itemset, count in frequent_counts.items()}
+        rules = self.generate_rules(frequent_itemsets)
+        rules_by_antecedent = {}
+        for rule in rules:
+            rules_by_antecedent.setdefault(rule['antecedent'], []).append(rule)
+        # 所有出现过的产品都是频繁的单项或在负边界中，规则不足时按购买频率补充推荐
+        item_support = {next(iter(itemset)): count / num_transactions
+                        for counts in (frequent_counts, border_counts)
+                        for itemset, count in counts.items() if len(itemset) == 1}
+        return {
+            'version': version,
+            'watermark': watermark,
+            'num_transactions': num_transactions,
+            'bitsets': bitsets,
+            'frequent_itemsets': frequent_itemsets,
+            'frequent_counts': frequent_counts,
+            'border_counts': border_counts,
+            'rules': rules,
+            'rules_by_antecedent': rules_by_antecedent,
+            'item_support': item_support,
+        }
+    
+    def _read_baskets(self, user_ids, max_rowid):
+        """读取指定用户在水位线（含）之前的购买记录，返回 {用户ID: 产品ID集合}"""
+        baskets = {user_id: set() for user_id in user_ids}
+        for start in range(0, len(user_ids), LOOKUP_BATCH_SIZE):
+            batch = user_ids[start:start + LOOKUP_BATCH_SIZE]
+            where = (f"behavior_type = 'purchase' AND rowid <= ? "
+                     f"AND user_id IN ({', '.join('?' * len(batch))})")
+            for chunk in self.db.iter_user_behavior(columns=['user_id', 'product_id'], where=where,
+                                                    params=(max_rowid, *batch)):
+                for user_id, product_id in zip(chunk['user_id'].tolist(), chunk['product_id'].tolist()):
+                    baskets[user_id].add(product_id)
+        return baskets
+    
+    def update_incremental(self):
+        """FUP增量维护：只读取水位线之后新增的购买，更新频繁项集和负边界的支持数
+
+        每个用户是一个事务，新增购买会改变已有用户的事务：先减去这些用户旧事务的计数，再加上新事务的计数。
+        频繁项集跌出阈值时直接移入负边界；只有负边界中的项集变为频繁（边界向外移动）时，
+        才需要重建位图、在全量数据上统计新出现的候选项集。返回是否扫描了全量数据。
+        """
+        model = self.model
+        version = self.db.table_version('user_behavior')
+        new_df, watermark = self.db.get_new_behavior(since=model['watermark'],
+                                                     columns=['user_id', 'product_id', 'behavior_type'])
+        new_df = new_df[new_df['behavior_type'] == 'purchase']
+        if new_df.empty:
+            self.model = dict(model, version=version, watermark=watermark)
+            return False
         
-        # 过滤支持度
-        num_transactions = len(transactions)
-        frequent_itemsets = {}
-        for itemset, count in itemsets.items():
-            support = count / num_transactions
-            if support >= self.min_support:
-                frequent_itemsets[itemset] = support
+        start = time.time()
+        old_baskets = self._read_baskets(sorted(set(new_df['user_id'].tolist())), model['watermark'])
+        new_baskets = {user_id: set(basket) for user_id, basket in old_baskets.items()}
+        for user_id, product_id in zip(new_df['user_id'].tolist(), new_df['product_id'].tolist()):
+            new_baskets[user_id].add(product_id)
         
-        print(f"找到 {len(frequent_itemsets)} 个频繁项集")
-        return frequent_itemsets
+        # 只在受影响的用户上统计跟踪的项集：支持数的变化 = 新事务中的计数 - 旧事务中的计数
+        frequent_counts, border_counts = dict(model['frequent_counts']), dict(model['border_counts'])
+        for item in set().union(*new_baskets.values()):
+            # 从未出现过的新产品，旧支持数为0
+            if frozenset([item]) not in frequent_counts:
+                border_counts.setdefault(frozenset([item]), 0)
+        tracked = list(frequent_counts) + list(border_counts)
+        old_counts = VerticalBitsets.from_transactions(list(old_baskets.values())).support_counts(tracked)
+        new_counts = VerticalBitsets.from_transactions(list(new_baskets.values())).support_counts(tracked)
+        for itemset, old_count, new_count in zip(tracked, old_counts, new_counts):
+            counts = frequent_counts if itemset in frequent_counts else border_counts
+            counts[itemset] += new_count - old_count
+        num_transactions = model['num_transactions'] + sum(1 for basket in old_baskets.values() if not basket)
+        
+        min_count = max(1, math.ceil(self.min_support * num_transactions - 1e-9))
+        bitsets = []
+        
+        def count_itemsets(itemsets):
+            # 边界向外移动时才读取全量购买记录，同一次更新中只构建一次位图
+            if not bitsets:
+                bitsets.append(self.build_bitsets(max_rowid=watermark))
+            return bitsets[0].support_counts(itemsets)
+        
+        frequent_counts, border_counts, scanned = update_border(
+            frequent_counts, border_counts, min_count, count_itemsets, self.max_len)
+        self.model = self._build_model(version, watermark, num_transactions, frequent_counts, border_counts,
+                                       bitsets[0] if bitsets else None)
+        print(f"关联规则模型增量应用了 {len(new_df)} 条新购买（{len(new_baskets)} 个用户），"
+              f"{'边界变化，统计了新候选，' if scanned else ''}耗时 {time.time() - start:.3f}s")
+        return scanned
     
-    def recommend_for_user(self, user_id, top_n=3):
-        """为用户生成推荐"""
-        transactions = self.prepare_transaction_data()
-        frequent_itemsets = self.find_frequent_itemsets(transactions)
+    def load_state(self):
+        """从规则表中恢复保存的支持数（参数一致时），之后可直接继续增量维护，返回是否恢复成功"""
+        meta = self.rule_store.meta()
+        state = self.rule_store.load_itemset_counts()
+        if (meta is None or state is None or 'watermark' not in meta
+                or (meta['min_support'], meta['max_len']) != (self.min_support, self.max_len)):
+            return False
+        frequent_counts, border_counts = state
+        self.model = self._build_model(tuple(meta['behavior_version']), meta['watermark'],
+                                       meta['num_transactions'], frequent_counts, border_counts)
+        return True
+    
+    def build_rule_table(self):
+        """离线构建：挖掘规则并整体写入SQLite规则表，返回构建信息"""
+        summary = self.fit()
+        meta = self.save_rule_table()
+        return dict(summary, built_at=meta['built_at'])
+    
+    def refresh_rule_table(self):
+        """定期刷新规则表（如每几分钟执行一次）：优先从保存的支持数出发增量更新，必要时才全量挖掘"""
+        with self._fit_lock:
+            if self.model is None and not self.load_state():
+                self.fit()
+            self._update_model()
+            return self.save_rule_table()
+    
+    def save_rule_table(self):
+        """把当前模型的规则、产品支持度和增量维护所需的支持数写入规则表"""
+        model = self.model
+        return self.rule_store.save(model['rules'], model['item_support'], {
+            'behavior_version': list(model['version']),
+            'watermark': model['watermark'],
+            'num_transactions': model['num_transactions'],
+            'min_support': self.min_support,
+            'min_confidence': self.min_confidence,
+            'max_len': self.max_len,
+        }, itemset_counts=(model['frequent_counts'], model['border_counts']))
+    
+    def _update_model(self):
+        """购买数据变化时更新模型：只追加了新行为时增量维护，否则（有删除或修改）全量重新挖掘"""
+        version = self.db.table_version('user_behavior')
+        if version == self.model['version']:
+            return
+        if DatabaseManager._is_append(self.model['version'], version):
+            self.update_incremental()
+        else:
+            self.fit()
+    
+    def itemset_support(self, itemset):
+        """任意产品组合的支持度（不要求是频繁项集），基于位图按位与+popcount"""
+        model = self.ensure_model()
+        if model['bitsets'] is None:
+            # 增量更新后位图已过期，按需重建
+            model['bitsets'] = self.build_bitsets(max_rowid=model['watermark'])
+        return model['bitsets'].support(itemset)
+    
+    @staticmethod
+    def best_rules(purchased, rules):
+        """对后件中的每个未购买产品，保留置信度（其次提升度）最高的一条规则
+
+        并列时取前件更短、产品ID更小的规则，结果与规则的遍历顺序无关。
+        """
+        def rank(rule):
+            return (-rule['confidence'], -rule['lift'], len(rule['antecedent']), sorted(rule['antecedent']))
         
+        best = {}
+        for rule in rules:
+            for product_id in rule['consequent'] - purchased:
+                current = best.get(product_id)
+                if current is None or rank(rule) < rank(current):
+                    best[product_id] = rule
+        return best
+    
+    def match_rules(self, purchased, rules_by_antecedent):
+        """找出前件被用户购买记录覆盖的规则，按后件中的每个未购买产品保留最好的一条"""
+        max_size = max((len(antecedent) for antecedent in rules_by_antecedent), default=0)
+        # 枚举用户购买记录的子集作为前件查表，而不是遍历全部规则
+        matched = (rule
+                   for size in range(1, min(max_size, len(purchased)) + 1)
+                   for antecedent in combinations(sorted(purchased), size)
+                   for rule in rules_by_antecedent.get(frozenset(antecedent), []))
+        return self.best_rules(purchased, matched)
+    
+    def recommend_for_user(self, user_id, top_n=3):
+        """为用户生成推荐：优先使用关联规则，规则不足时按购买频率补充
+
+        规则表已构建时只按用户已购产品查表，耗时与总交易数无关；否则在内存中挖掘规则。
+        """
         # 获取用户历史购买记录
-        user_behavior = self.db.get_user_behavior()
-        user_purchases = user_behavior[
-            (user_behavior['user_id'] == user_id) & 
-            (user_behavior['behavior_type'] == 'purchase')
-        ]['product_id'].tolist()
-        
+        user_purchases = self.db.get_user_purchases(user_id)
+        purchased = set(user_purchases)
         print(f"用户 {user_id} 的历史购买: {user_purchases}")
         
-        # 简化推荐逻辑：推荐其他用户常买但该用户没买的产品
-        all_products_df = self.db.get_all_products()
-        recommendations = []
+        meta = self.rule_store.meta() if self.use_rule_table else None
+        if meta is not None:
+            matched = self.best_rules(purchased, self.rule_store.lookup(purchased, meta['max_antecedent_size']))
+            # 补充推荐最多跳过已购和已推荐的产品
+            popular = self.rule_store.popular_items(limit=len(purchased) + len(matched) + top_n)
+        else:
+            model = self.ensure_model()
+            matched = self.match_rules(purchased, model['rules_by_antecedent'])
+            popular = sorted(model['item_support'].items(), key=lambda x: (-x[1], x[0]))
         
-        for product_id in all_products_df['product_id']:
-            if product_id not in user_purchases:
-                # 计算该产品的购买频率作为推荐分数
-                product_count = sum(1 for transaction in transactions if product_id in transaction)
-                score = product_count / len(transactions)
-                if score > 0:  # 至少有一个用户购买过
-                    product_info = all_products_df[all_products_df['product_id'] == product_id].iloc[0]
-                    recommendations.append({
-                        'product_id': product_id,
-                        'product_name': product_info['product_name'],
-                        'score': score,
-                        'reason': f'购买频率: {score:.2%}'
-                    })
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        recommendations = []
+        ranked = sorted(matched.items(), key=lambda x: (-x[1]['confidence'], -x[1]['lift'], x[0]))
+        for product_id, rule in ranked:
+            if product_id not in products.index:
+                continue
+            antecedent = '、'.join(str(item) for item in sorted(rule['antecedent']))
+            recommendations.append({
+                'product_id': product_id,
+                'product_name': products.at[product_id, 'product_name'],
+                'score': rule['confidence'],
+                'lift': rule['lift'],
+                'reason': f'购买了产品 {antecedent} 的用户中 {rule["confidence"]:.0%} 也购买了该产品 (提升度 {rule["lift"]:.2f})'
+            })
+            if len(recommendations) >= top_n:
+                return recommendations
         
-        # 按分数排序，返回前top_n个推荐
-        recommendations.sort(key=lambda x: x['score'], reverse=True)
-        return recommendations[:top_n]
+        # 规则不足时，推荐其他用户常买但该用户没买的产品
+        chosen = purchased | {rec['product_id'] for rec in recommendations}
+        for product_id, support in popular:
+            if product_id in chosen or product_id not in products.index:
+                continue
+            recommendations.append({
+                'product_id': product_id,
+                'product_name': products.at[product_id, 'product_name'],
+                'score': support,
+                'reason': f'购买频率: {support:.2%}'
+            })
+            if len(recommendations) >= top_n:
+                break
+        return recommendations
 
 # 测试代码
 if __name__ == "__main__":
     recommender = AprioriRecommender()
+    if '--build-rules' in sys.argv:
+        # 离线构建规则表：python algorithms/apriori_recommender.py --build-rules
+        print(recommender.build_rule_table())
+    elif '--refresh-rules' in sys.argv:
+        # 增量刷新规则表，可由定时任务每几分钟执行一次
+        print(recommender.refresh_rule_table())
     user_id = 1  # 测试用户ID
     recommendations = recommender.recommend_for_user(user_id)
     
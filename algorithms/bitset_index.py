@@ -0,0 +1,161 @@
+# bitset_index.py
+# 垂直位图表示的事务数据（Eclat风格）：每个产品对应一个按事务打包的位数组，
+# 项集的支持数 = 各产品位数组按位与后的 1 的个数
+import math
+
+import numpy as np
+
+# 每个字节中1的个数，旧版NumPy没有 np.bitwise_count 时使用
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits, axis=-1):
+    """统计打包位数组中1的个数（沿 axis 求和）"""
+    if hasattr(np, 'bitwise_count'):
+        counts = np.bitwise_count(bits)
+    else:
+        counts = _POPCOUNT_TABLE[bits]
+    return counts.sum(axis=axis, dtype=np.int64)
+
+
+class VerticalBitsets:
+    """事务的垂直位图索引
+
+    bits 为 (产品数 × ceil(事务数/8)) 的uint8矩阵，第i行第t位表示第t个事务是否包含第i个产品。
+    100万个事务时每个产品只占约122KB，支持度计算是整行的按位与加popcount。
+    """
+
+    def __init__(self, items, bits, num_transactions):
+        self.items = np.asarray(items)
+        self.bits = bits
+        self.num_transactions = num_transactions
+        self.item_index = {item: i for i, item in enumerate(self.items.tolist())}
+
+    @classmethod
+    def from_pairs(cls, transaction_idx, items, num_transactions=None):
+        """由 (事务下标, 产品) 对构建，事务下标从0开始；同一事务内的重复产品只计一次"""
+        transaction_idx = np.asarray(transaction_idx, dtype=np.int64)
+        if num_transactions is None:
+            num_transactions = int(transaction_idx.max()) + 1 if len(transaction_idx) else 0
+        item_values, item_idx = np.unique(np.asarray(items), return_inverse=True)
+        bits = np.zeros((len(item_values), (num_transactions + 7) // 8), dtype=np.uint8)
+        # 与 np.packbits 相同的高位在前顺序
+        np.bitwise_or.at(bits, (item_idx, transaction_idx >> 3),
+                         np.left_shift(1, 7 - (transaction_idx & 7)).astype(np.uint8))
+        return cls(item_values, bits, num_transactions)
+
+    @classmethod
+    def from_transactions(cls, transactions):
+        """由事务列表（每个事务为产品的可迭代对象）构建"""
+        lengths = [len(t) for t in transactions]
+        items = [item for t in transactions for item in t]
+        return cls.from_pairs(np.repeat(np.arange(len(transactions)), lengths), items, len(transactions))
+
+    def transactions(self):
+        """还原为事务列表（事务按下标顺序，事务内的产品按产品顺序），供FP-Growth建树
+
+        逐个产品只解包非零的字节，临时内存与 (产品, 事务) 对的数量成正比，不展开 产品数×事务数 的稠密矩阵。
+        """
+        row_parts, transaction_parts = [], []
+        for row, row_bits in enumerate(self.bits):
+            byte_idx = np.flatnonzero(row_bits)
+            byte_pos, bit_pos = np.nonzero(np.unpackbits(row_bits[byte_idx][:, None], axis=1))
+            transaction_parts.append(byte_idx[byte_pos] * 8 + bit_pos)
+            row_parts.append(np.full(len(byte_pos), row, dtype=np.int64))
+        item_rows = np.concatenate(row_parts) if row_parts else np.array([], dtype=np.int64)
+        transaction_idx = np.concatenate(transaction_parts) if transaction_parts else np.array([], dtype=np.int64)
+        order = np.argsort(transaction_idx, kind='stable')
+        transactions = [[] for _ in range(self.num_transactions)]
+        for t, item in zip(transaction_idx[order].tolist(), self.items[item_rows[order]].tolist()):
+            transactions[t].append(item)
+        return transactions
+
+    def tidset(self, itemset):
+        """返回包含整个项集的事务位数组，项集中有未出现过的产品时返回None"""
+        rows = [self.item_index.get(item) for item in itemset]
+        if any(row is None for row in rows):
+            return None
+        if not rows:
+            return np.full(self.bits.shape[1], 0xFF, dtype=np.uint8)
+        return np.bitwise_and.reduce(self.bits[rows], axis=0)
+
+    def support_count(self, itemset):
+        """项集的支持数（包含该项集的事务数）"""
+        if not itemset:
+            return self.num_transactions
+        tids = self.tidset(itemset)
+        return 0 if tids is None else int(popcount(tids))
+
+    def support(self, itemset):
+        """项集的支持度"""
+        return self.support_count(itemset) / self.num_transactions if self.num_transactions else 0.0
+
+    def item_counts(self):
+        """所有单个产品的支持数，返回 {产品: 支持数}"""
+        return dict(zip(self.items.tolist(), popcount(self.bits).tolist()))
+
+    def extension_counts(self, itemset, candidates=None):
+        """项集分别加上每个候选产品后的支持数，一次按位与+popcount完成，返回 {产品: 支持数}"""
+        tids = self.tidset(itemset)
+        if candidates is None:
+            candidates = self.items.tolist()
+        rows = [self.item_index[item] for item in candidates if item in self.item_index]
+        if tids is None or not rows:
+            return {}
+        counts = popcount(self.bits[rows] & tids)
+        return dict(zip(self.items[rows].tolist(), counts.tolist()))
+
+    def support_counts(self, itemsets):
+        """批量统计多个项集的支持数，返回与 itemsets 顺序一致的列表
+
+        按"除最后一个产品外的前缀"分组，每个前缀只求一次交集，再与各组的末尾产品一次性按位与+popcount。
+        """
+        counts = [0] * len(itemsets)
+        groups = {}
+        for i, itemset in enumerate(itemsets):
+            items = sorted(itemset)
+            if not items:
+                counts[i] = self.num_transactions
+                continue
+            groups.setdefault(tuple(items[:-1]), []).append((i, items[-1]))
+        for prefix, members in groups.items():
+            tids = self.tidset(prefix)
+            known = [(i, self.item_index[item]) for i, item in members if item in self.item_index]
+            if tids is None or not known:
+                continue
+            rows = [row for _, row in known]
+            for (i, _), count in zip(known, popcount(self.bits[rows] & tids).tolist()):
+                counts[i] = count
+        return counts
+
+    def eclat(self, min_support, max_len=None):
+        """Eclat深度优先挖掘频繁项集，返回 {frozenset(项集): 支持度}"""
+        if self.num_transactions == 0:
+            return {}
+        min_count = max(1, math.ceil(min_support * self.num_transactions - 1e-9))
+        counts = popcount(self.bits)
+        frequent = np.flatnonzero(counts >= min_count)
+        result = {frozenset([self.items[i].item()]): counts[i] / self.num_transactions for i in frequent}
+        if max_len is None or max_len > 1:
+            for pos, row in enumerate(frequent):
+                self._eclat_extend((self.items[row].item(),), self.bits[row], frequent[pos + 1:],
+                                   min_count, max_len, result)
+        return result
+
+    def _eclat_extend(self, prefix, prefix_bits, rest, min_count, max_len, result):
+        """把前缀与其后所有产品一次性求交，频繁的扩展继续向下递归"""
+        if len(rest) == 0:
+            return
+        intersections = self.bits[rest] & prefix_bits
+        counts = popcount(intersections)
+        keep = np.flatnonzero(counts >= min_count)
+        for pos in keep:
+            itemset = prefix + (self.items[rest[pos]].item(),)
+            result[frozenset(itemset)] = counts[pos] / self.num_transactions
+            if max_len is None or len(itemset) < max_len:
+                self._eclat_extend(itemset, intersections[pos], rest[keep[keep > pos]],
+                                   min_count, max_len, result)
+
+    def memory_bytes(self):
+        """位图占用的字节数"""
+        return int(self.bits.nbytes)
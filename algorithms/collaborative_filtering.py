@@ -1,26 +1,274 @@
 try:
     from .database_utils import DatabaseManager
+    from .ann_index import RandomProjectionLSH
+    from .ranking import select_top_n
+    from .model_refresh import BackgroundRefreshModel
 except ImportError:
     from database_utils import DatabaseManager
+    from ann_index import RandomProjectionLSH
+    from ranking import select_top_n
+    from model_refresh import BackgroundRefreshModel
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+# fit() 时为每个用户保存的近邻数量
+DEFAULT_NEIGHBOURS = 20
+# 分块计算近邻时，每块相似度矩阵的最大元素个数（约128MB的float64）
+SIMILARITY_BLOCK_ELEMENTS = 16 * 1024 * 1024
+# 批量推荐时每块的用户数，每块的稠密预测矩阵为 块大小×产品数
+DEFAULT_BATCH_BLOCK_SIZE = 1024
+# 基于物品的协同过滤为每个产品保存的相似产品数量
+DEFAULT_ITEM_NEIGHBOURS = 50
+# 相似度保留的小数位数：数学上相等的相似度可能因计算顺序不同有极小差异，舍入后并列的近邻按下标排序，
+# 保证分块计算、单用户计算和在线更新得到相同的近邻列表
+SIMILARITY_DECIMALS = 12
+# 在线更新模式下，后台更新时新增超过该条数就重新训练，而不是逐条在线应用
+ONLINE_UPDATE_MAX_EVENTS = 1000
+
+
+def build_rating_matrix(db, chunksize=None, return_counts=False, return_version=False):
+    """从行为三元组构建稀疏的用户-产品评分矩阵
+
+    返回 (CSR评分矩阵, 有序用户ID数组, 有序产品ID数组)，矩阵的行/列下标即ID数组中的位置。
+    同一用户对同一产品的多条评分取平均，与 pivot_table 的默认行为一致。
+    return_counts 为True时额外返回每个 (用户, 产品) 的评分次数矩阵，供在线更新平均值使用；
+    return_version 为True时最后再返回读入的行对应的行为表指纹，其最大rowid可直接作为增量水位线。
+    """
+    columns = ['user_id', 'product_id', 'rating']
+    if chunksize is None:
+        behavior, version = db.load_table('user_behavior', columns, compact=True, with_version=True)
+        parts = [behavior]
+    else:
+        # 分批读取按指纹中的最大rowid截断，读取期间追加的行留给下一次增量
+        version = db.table_version('user_behavior')
+        parts = list(db.iter_user_behavior(chunksize=chunksize, columns=columns, where="rowid <= ?",
+                                           params=(version[1] or 0,)))
+    user_col = np.concatenate([part['user_id'].to_numpy() for part in parts]) if parts else np.array([], int)
+    product_col = np.concatenate([part['product_id'].to_numpy() for part in parts]) if parts else np.array([], int)
+    rating_col = np.concatenate([part['rating'].to_numpy(dtype=np.float64) for part in parts]) if parts else np.array([])
+
+    user_ids, user_idx = np.unique(user_col, return_inverse=True)
+    product_ids, product_idx = np.unique(product_col, return_inverse=True)
+    shape = (len(user_ids), len(product_ids))
+
+    # COO转CSR时会把重复的 (用户, 产品) 累加，分别累加评分和次数后相除得到平均评分
+    rating_sum = sparse.coo_matrix((rating_col, (user_idx, product_idx)), shape=shape).tocsr()
+    rating_count = sparse.coo_matrix((np.ones(len(rating_col)), (user_idx, product_idx)), shape=shape).tocsr()
+    rating_sum.sum_duplicates()
+    rating_count.sum_duplicates()
+    rating_matrix = rating_sum.copy()
+    rating_matrix.data = rating_sum.data / rating_count.data
+    result = (rating_matrix, user_ids, product_ids)
+    if return_counts:
+        result += (rating_count,)
+    if return_version:
+        result += (version,)
+    return result
+
+
+def _insert_row(matrix, row):
+    """在CSR矩阵的第row行之前插入一个空行"""
+    indptr = np.insert(matrix.indptr, row, matrix.indptr[row])
+    return sparse.csr_matrix((matrix.data, matrix.indices, indptr), shape=(matrix.shape[0] + 1, matrix.shape[1]))
+
+
+def _insert_column(matrix, col):
+    """在CSR矩阵的第col列之前插入一个空列"""
+    indices = matrix.indices + (matrix.indices >= col)
+    return sparse.csr_matrix((matrix.data, indices, matrix.indptr), shape=(matrix.shape[0], matrix.shape[1] + 1))
+
+
+def _set_entry(matrix, row, col, value):
+    """返回修改了 (row, col) 元素的CSR矩阵副本，新增非零元时只在该行插入一个位置"""
+    start, end = matrix.indptr[row], matrix.indptr[row + 1]
+    offset = start + np.searchsorted(matrix.indices[start:end], col)
+    if offset < end and matrix.indices[offset] == col:
+        data = matrix.data.copy()
+        data[offset] = value
+        return sparse.csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+    data = np.insert(matrix.data, offset, value)
+    indices = np.insert(matrix.indices, offset, col)
+    indptr = matrix.indptr.copy()
+    indptr[row + 1:] += 1
+    return sparse.csr_matrix((data, indices, indptr), shape=matrix.shape)
+
+
+def _sort_neighbour_rows(neighbour_idx, neighbour_sim, rows):
+    """把指定行的近邻重新按相似度降序排列（相同时下标小的在前，下标为-1的填充位排在最后）"""
+    order = np.lexsort((neighbour_idx[rows], -neighbour_sim[rows], neighbour_idx[rows] < 0), axis=-1)
+    neighbour_idx[rows] = np.take_along_axis(neighbour_idx[rows], order, axis=1)
+    neighbour_sim[rows] = np.take_along_axis(neighbour_sim[rows], order, axis=1)
+
+
+def top_k_neighbours(normalized, k, block_elements=SIMILARITY_BLOCK_ELEMENTS):
+    """分块计算每个用户的Top-K近邻
+
+    normalized 为按行L2归一化后的评分矩阵。每次只计算一块用户与全体用户的相似度，
+    块大小由 block_elements 限制，峰值内存与 用户数×块行数 成正比而不是 用户数²。
+    返回 (近邻下标矩阵 U×K, 相似度矩阵 U×K)，每行按相似度降序。
+    """
+    num_users = normalized.shape[0]
+    k = min(k, num_users - 1)
+    neighbour_idx = np.zeros((num_users, max(k, 0)), dtype=np.int32)
+    neighbour_sim = np.zeros((num_users, max(k, 0)), dtype=np.float64)
+    if k <= 0:
+        return neighbour_idx, neighbour_sim
+
+    block_rows = max(1, block_elements // num_users)
+    # 转置只做一次且保持稀疏，不展开稠密的 产品数×用户数 数组；只把每块的乘积展开为稠密数组
+    transposed = normalized.T.tocsr()
+    for start in range(0, num_users, block_rows):
+        end = min(start + block_rows, num_users)
+        similarities = np.round((normalized[start:end] @ transposed).toarray(), SIMILARITY_DECIMALS)
+        rows = np.arange(end - start)
+        similarities[rows, start + rows] = -np.inf  # 排除自己
+
+        neighbour_idx[start:end], neighbour_sim[start:end] = select_top_k_rows(similarities, k)
+    return neighbour_idx, neighbour_sim
+
+
+def select_top_k_rows(similarities, k):
+    """从相似度矩阵的每一行选出Top-K，返回 (下标矩阵, 相似度矩阵)
+
+    每行按相似度降序，相同时下标小的在前；第K名有并列时也取下标小的，结果与并列顺序无关。
+    """
+    candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    candidate_sim = np.take_along_axis(similarities, candidates, axis=1)
+    # argpartition 在第K名并列时任选其一，只对这些行重新按下标补足
+    kth = candidate_sim.min(axis=1, keepdims=True)
+    tied_rows = np.flatnonzero((similarities >= kth).sum(axis=1) > k)
+    if len(tied_rows):
+        tied = similarities[tied_rows]
+        above = tied > kth[tied_rows]
+        ties = tied == kth[tied_rows]
+        selected = above | (ties & (np.cumsum(ties, axis=1) <= k - above.sum(axis=1, keepdims=True)))
+        candidates[tied_rows] = np.nonzero(selected)[1].reshape(len(tied_rows), k)
+        candidate_sim[tied_rows] = np.take_along_axis(tied, candidates[tied_rows], axis=1)
+    order = np.lexsort((candidates, -candidate_sim), axis=-1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_sim, order, axis=1)
+
+
+def item_neighbour_matrix(rating_matrix, m, block_elements=SIMILARITY_BLOCK_ELEMENTS):
+    """预计算截断的产品-产品相似度表：每个产品只保留最相似的m个产品
 
-class CollaborativeFiltering:
-    def __init__(self):
-        self.db = DatabaseManager()
+    返回稀疏矩阵 S (产品数×产品数)，第j行为产品j的近邻及余弦相似度，不保留非正的相似度。
+    """
+    normalized = normalize(rating_matrix.T.tocsr(), norm='l2', axis=1)
+    neighbour_idx, neighbour_sim = top_k_neighbours(normalized, m, block_elements)
+    num_items, m = neighbour_idx.shape
+    similarity = sparse.csr_matrix(
+        (neighbour_sim.ravel(), neighbour_idx.ravel(), np.arange(0, num_items * m + 1, m)),
+        shape=(num_items, num_items)
+    )
+    similarity.data[similarity.data <= 0] = 0
+    similarity.eliminate_zeros()
+    return similarity
+
+
+def score_user_block(rating_matrix, rated_matrix, targets, neighbour_idx, neighbour_sim, top_n):
+    """为一块用户批量预测评分并选出Top-N
+
+    近邻权重组成稀疏矩阵 W (块大小×用户数，每行k个非零)，
+    W @ 评分矩阵 与 W @ 已评分标记矩阵 分别得到加权评分和与相似度和，
+    计算量与 块大小×k×平均评分数 成正比。近邻下标为-1的填充位不参与打分。
+    返回每个用户的 [(产品下标, 预测评分), ...]。
+    """
+    num_rows = neighbour_idx.shape[0]
+    valid = neighbour_idx >= 0
+    weights = sparse.csr_matrix(
+        (neighbour_sim[valid], neighbour_idx[valid], np.concatenate([[0], np.cumsum(valid.sum(axis=1))])),
+        shape=(num_rows, rating_matrix.shape[0])
+    )
+    weighted_sum = (weights @ rating_matrix).toarray()
+    similarity_sum = (weights @ rated_matrix).toarray()
+    candidates = (rating_matrix[targets].toarray() == 0) & (similarity_sum > 0)
+    predicted = np.zeros_like(weighted_sum)
+    np.divide(weighted_sum, similarity_sum, out=predicted, where=candidates)
+    
+    results = []
+    for row in range(num_rows):
+        selected = select_top_n(predicted[row], candidates[row], top_n)
+        results.append([(int(idx), float(predicted[row, idx])) for idx in selected])
+    return results
+
+
+# 进程池中每个工作进程持有的评分矩阵（通过initializer只传输一次）
+_worker_matrices = {}
+
+
+def _init_worker(rating_matrix, rated_matrix):
+    _worker_matrices['rating_matrix'] = rating_matrix
+    _worker_matrices['rated_matrix'] = rated_matrix
+
+
+def _score_block_in_worker(targets, neighbour_idx, neighbour_sim, top_n):
+    return score_user_block(_worker_matrices['rating_matrix'], _worker_matrices['rated_matrix'],
+                            targets, neighbour_idx, neighbour_sim, top_n)
+
+
+class NeighbourhoodRecommender(BackgroundRefreshModel):
+    """协同过滤推荐器的公共部分：读取方式和近邻数，模型生命周期见 BackgroundRefreshModel"""
+
+    def __init__(self, chunksize=None, n_neighbours=DEFAULT_NEIGHBOURS, auto_refit=True):
+        super().__init__(DatabaseManager(), auto_refit=auto_refit)
+        # 设置后按批流式读取行为数据，否则一次性读取（走内存快照）
+        self.chunksize = chunksize
+        self.n_neighbours = n_neighbours
+
+
+class CollaborativeFiltering(NeighbourhoodRecommender):
+    """基于用户的协同过滤：预计算每个用户的Top-K相似用户"""
+
+    def __init__(self, chunksize=None, engine='sparse', n_neighbours=DEFAULT_NEIGHBOURS, auto_refit=True,
+                 neighbour_search='exact', lsh_params=None, online_updates=False):
+        super().__init__(chunksize=chunksize, n_neighbours=n_neighbours, auto_refit=auto_refit)
+        # sparse: 稀疏矩阵 + 预计算近邻，内存随评分数增长；dense: 原始的稠密矩阵实现
+        if engine not in ('sparse', 'dense'):
+            raise ValueError(f"未知的协同过滤引擎: {engine}")
+        self.engine = engine
+        # exact: 分块精确计算近邻；lsh: 用随机投影LSH近似查找，lsh_params 为 RandomProjectionLSH 的参数
+        if neighbour_search not in ('exact', 'lsh'):
+            raise ValueError(f"未知的近邻查找方式: {neighbour_search}")
+        self.neighbour_search = neighbour_search
+        self.lsh_params = lsh_params or {}
+        # 数据变化且只是少量追加时，直接在线应用新增的行为，而不是重新训练
+        self.online_updates = online_updates
+        self._update_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
     
     def create_user_item_matrix(self):
         """创建用户-产品评分矩阵"""
-        behavior_df = self.db.get_user_behavior()
-        
-        # 创建用户-产品评分矩阵
-        rating_matrix = behavior_df.pivot_table(
-            index='user_id', 
-            columns='product_id', 
-            values='rating', 
-            fill_value=0
-        )
+        columns = ['user_id', 'product_id', 'rating']
+        if self.chunksize is None:
+            behavior_df = self.db.get_user_behavior(columns=columns, compact=True)
+            
+            # 创建用户-产品评分矩阵
+            rating_matrix = behavior_df.pivot_table(
+                index='user_id', 
+                columns='product_id', 
+                values='rating', 
+                fill_value=0
+            )
+            return rating_matrix
+        
+        # 流式读取：每批只保留 (用户, 产品) 的评分和与次数，最后求平均（与pivot_table的mean一致）
+        totals = None
+        for chunk in self.db.iter_user_behavior(chunksize=self.chunksize, columns=columns):
+            partial = chunk.groupby(['user_id', 'product_id'])['rating'].agg(['sum', 'count'])
+            totals = partial if totals is None else totals.add(partial, fill_value=0)
+        if totals is None:
+            return pd.DataFrame()
+        
+        mean_ratings = totals['sum'] / totals['count']
+        rating_matrix = mean_ratings.unstack('product_id', fill_value=0)
+        rating_matrix.columns.name = 'product_id'
         return rating_matrix
     
     def calculate_user_similarity(self, rating_matrix):
@@ -33,48 +281,446 @@ class CollaborativeFiltering:
         )
         return user_similarity_df
     
-    def recommend_for_user(self, target_user_id,top_n=5 ,k=2):
-        """为目标用户生成推荐"""
+    def find_similar_users(self, rating_matrix, user_idx, k):
+        """在稀疏评分矩阵中找出与某个用户最相似的k个用户
+
+        只计算目标用户与其他用户的余弦相似度（一次稀疏矩阵-向量乘法），
+        不构建 用户×用户 的完整相似度矩阵。返回 (用户下标数组, 相似度数组)，按相似度降序。
+        """
+        normalized = normalize(rating_matrix, norm='l2', axis=1)
+        similarities = np.round((normalized @ normalized[user_idx].T).toarray().ravel(), SIMILARITY_DECIMALS)
+        similarities[user_idx] = -np.inf  # 排除自己
+        
+        k = min(k, len(similarities) - 1)
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([])
+        neighbours, neighbour_sim = select_top_k_rows(similarities[None, :], k)
+        return neighbours[0], neighbour_sim[0]
+    
+    def fit(self):
+        """训练：构建评分矩阵并预计算每个用户的Top-K近邻及相似度"""
+        start = time.time()
+        # 版本和水位线取自实际读入的行：读取期间追加的行不在模型中，下次增量同步时只应用一次
+        rating_matrix, user_ids, product_ids, rating_count, version = build_rating_matrix(
+            self.db, self.chunksize, return_counts=True, return_version=True)
+        watermark = version[1] or 0
+        normalized = normalize(rating_matrix, norm='l2', axis=1)
+        ann_index = None
+        if self.neighbour_search == 'lsh':
+            ann_index = RandomProjectionLSH(**self.lsh_params).fit(normalized)
+            neighbour_idx, neighbour_sim = ann_index.all_neighbours(self.n_neighbours)
+        else:
+            neighbour_idx, neighbour_sim = top_k_neighbours(normalized, self.n_neighbours)
+        
+        # 整体替换模型引用，请求线程看到的始终是完整的一版模型
+        with self._update_lock:
+            self.model = {
+                'version': version,
+                'rating_matrix': rating_matrix,
+                'user_ids': user_ids,
+                'product_ids': product_ids,
+                'neighbour_idx': neighbour_idx,
+                'neighbour_sim': neighbour_sim,
+                'ann_index': ann_index,
+                'watermark': watermark,
+                'rating_count': rating_count,
+                'sq_norms': np.asarray(rating_matrix.multiply(rating_matrix).sum(axis=1)).ravel(),
+            }
+        summary = {
+            'users': len(user_ids),
+            'products': len(product_ids),
+            'ratings': int(rating_matrix.nnz),
+            'n_neighbours': int(neighbour_idx.shape[1]),
+            'neighbour_search': self.neighbour_search,
+            'fit_seconds': round(time.time() - start, 3),
+        }
+        print(f"协同过滤模型训练完成: {summary}")
+        return summary
+    
+    def _update_model(self):
+        """后台更新模型：开启在线更新且只追加了少量行为时逐条应用增量，否则重新训练
+
+        在后台线程中执行，请求线程在此期间继续使用当前模型，不会因增量同步而阻塞。
+        """
+        version = self.db.table_version('user_behavior')
+        model_version = self.model['version']
+        new_rows = (version[1] or 0) - (model_version[1] or 0)
+        if self.online_updates and self.db._is_append(model_version, version) \
+                and new_rows <= ONLINE_UPDATE_MAX_EVENTS:
+            self.sync_new_behavior()
+        else:
+            self.fit()
+    
+    def apply_event(self, user_id, product_id, rating):
+        """在线应用一条新的评分事件，只修补受影响用户的近邻列表
+
+        维护每个用户评分向量的平方范数；事件只改变该用户的评分向量，因此只有该用户与其他用户的
+        相似度会变化：用一次稀疏矩阵-向量乘法得到该用户与所有用户的点积，重算该用户的近邻，
+        再把它插入/移出其他用户的近邻列表。只有当该用户原本排在某个列表末尾且相似度下降时，
+        才需要重算那个用户的列表。整体开销与评分数成正比，不需要 O(U²) 的重建。
+        新的模型整体替换旧模型，请求线程看到的始终是完整的一版。返回近邻列表发生变化的用户数。
+        """
+        if self.model is None:
+            self.ensure_model()
+        with self._update_lock:
+            model = self.model
+            user_ids, product_ids = model['user_ids'], model['product_ids']
+            rating_matrix, rating_count = model['rating_matrix'], model['rating_count']
+            sq_norms = model['sq_norms'].copy()
+            neighbour_idx, neighbour_sim = model['neighbour_idx'].copy(), model['neighbour_sim'].copy()
+            
+            # 新用户/新产品：插入到有序ID数组中对应的位置，之后的下标整体后移
+            pos = int(np.searchsorted(user_ids, user_id))
+            if pos >= len(user_ids) or user_ids[pos] != user_id:
+                user_ids = np.insert(user_ids, pos, user_id)
+                rating_matrix, rating_count = _insert_row(rating_matrix, pos), _insert_row(rating_count, pos)
+                sq_norms = np.insert(sq_norms, pos, 0.0)
+                neighbour_idx = neighbour_idx + (neighbour_idx >= pos)
+                neighbour_idx = np.insert(neighbour_idx, pos, -1, axis=0)
+                neighbour_sim = np.insert(neighbour_sim, pos, 0.0, axis=0)
+            col = int(np.searchsorted(product_ids, product_id))
+            if col >= len(product_ids) or product_ids[col] != product_id:
+                product_ids = np.insert(product_ids, col, product_id)
+                rating_matrix, rating_count = _insert_column(rating_matrix, col), _insert_column(rating_count, col)
+            
+            # 同一用户对同一产品的多条评分取平均
+            old_rating = rating_matrix[pos, col]
+            old_count = rating_count[pos, col]
+            new_rating = (old_rating * old_count + rating) / (old_count + 1)
+            rating_matrix = _set_entry(rating_matrix, pos, col, new_rating)
+            rating_count = _set_entry(rating_count, pos, col, old_count + 1)
+            sq_norms[pos] += new_rating ** 2 - old_rating ** 2
+            
+            # 该用户与所有用户的新相似度
+            dots = (rating_matrix @ rating_matrix[pos].T).toarray().ravel()
+            norms = np.sqrt(sq_norms)
+            denominator = norms * norms[pos]
+            similarities = np.zeros(len(dots))
+            np.divide(dots, denominator, out=similarities, where=denominator > 0)
+            similarities = np.round(similarities, SIMILARITY_DECIMALS)
+            similarities[pos] = -np.inf
+            
+            k = neighbour_idx.shape[1]
+            changed = {pos}
+            if k > 0:
+                neighbour_idx[pos:pos + 1], neighbour_sim[pos:pos + 1] = select_top_k_rows(similarities[None, :], k)
+                
+                # 原本就在近邻列表中的：更新相似度；若不再高于列表其他成员，列表外可能有更相似的用户，需重算
+                containing = np.flatnonzero((neighbour_idx == pos).any(axis=1))
+                containing = containing[containing != pos]
+                recompute = []
+                for row in containing:
+                    slot = np.flatnonzero(neighbour_idx[row] == pos)[0]
+                    others = np.delete(neighbour_sim[row], slot)
+                    # 列表外用户的相似度不超过原列表末尾，新相似度严格高于其余成员时列表仍然正确
+                    if (len(others) and similarities[row] > others.min()) or \
+                            (not len(others) and similarities[row] >= neighbour_sim[row, slot]):
+                        neighbour_sim[row, slot] = similarities[row]
+                    else:
+                        recompute.append(row)
+                _sort_neighbour_rows(neighbour_idx, neighbour_sim, containing)
+                for row in recompute:
+                    row_dots = (rating_matrix @ rating_matrix[row].T).toarray().ravel()
+                    row_denominator = norms * norms[row]
+                    row_similarities = np.zeros(len(row_dots))
+                    np.divide(row_dots, row_denominator, out=row_similarities, where=row_denominator > 0)
+                    row_similarities = np.round(row_similarities, SIMILARITY_DECIMALS)
+                    row_similarities[row] = -np.inf
+                    neighbour_idx[row:row + 1], neighbour_sim[row:row + 1] = select_top_k_rows(
+                        row_similarities[None, :], k)
+                
+                # 不在列表中的：新相似度超过列表末尾（相同时下标更小）则替换末尾
+                last_idx, last_sim = neighbour_idx[:, -1], neighbour_sim[:, -1]
+                entering = (similarities > last_sim) | ((similarities == last_sim) & (pos < last_idx))
+                entering[containing] = False
+                entering[pos] = False
+                entering = np.flatnonzero(entering)
+                neighbour_idx[entering, -1] = pos
+                neighbour_sim[entering, -1] = similarities[entering]
+                _sort_neighbour_rows(neighbour_idx, neighbour_sim, entering)
+                changed.update(containing.tolist())
+                changed.update(entering.tolist())
+            
+            # LSH索引中的向量已过期，下次训练时重建；期间 k 超过预计算数量时按精确方式计算
+            self.model = dict(model, user_ids=user_ids, product_ids=product_ids, rating_matrix=rating_matrix,
+                              rating_count=rating_count, sq_norms=sq_norms,
+                              neighbour_idx=neighbour_idx, neighbour_sim=neighbour_sim, ann_index=None)
+            return len(changed)
+    
+    def sync_new_behavior(self):
+        """读取上次训练/同步之后新增的行为记录（按rowid水位线），逐条在线应用，返回应用的条数"""
+        if self.model is None:
+            self.ensure_model()
+        # 多个请求线程同时发现数据变化时，只有一个线程读取并应用增量，其余线程等待后直接返回
+        with self._sync_lock:
+            version = self.db.table_version('user_behavior')
+            if version == self.model['version']:
+                return 0
+            new_df, watermark = self.db.get_new_behavior(since=self.model['watermark'],
+                                                         columns=['user_id', 'product_id', 'rating'])
+            for user_id, product_id, rating in zip(new_df['user_id'].tolist(), new_df['product_id'].tolist(),
+                                                   new_df['rating'].tolist()):
+                self.apply_event(user_id, product_id, rating)
+            with self._update_lock:
+                self.model = dict(self.model, watermark=watermark, version=version)
+        print(f"协同过滤模型在线应用了 {len(new_df)} 条新行为")
+        return len(new_df)
+    
+    def _sparse_neighbourhood(self, target_user_id, k):
+        """稀疏引擎：返回 (目标用户评分向量, 近邻评分子矩阵 k×产品数, 近邻相似度, 产品ID数组)"""
+        model = self.ensure_model()
+        rating_matrix, user_ids, product_ids = model['rating_matrix'], model['user_ids'], model['product_ids']
+        
+        pos = np.searchsorted(user_ids, target_user_id)
+        if pos >= len(user_ids) or user_ids[pos] != target_user_id:
+            return None  # 新用户，没有评分数据
+        
+        if k <= model['neighbour_idx'].shape[1]:
+            # 直接读取预计算的近邻列表，去掉LSH候选不足时的填充位
+            neighbours = model['neighbour_idx'][pos, :k]
+            similarities = model['neighbour_sim'][pos, :k][neighbours >= 0]
+            neighbours = neighbours[neighbours >= 0]
+        elif model.get('ann_index') is not None:
+            neighbours, similarities = model['ann_index'].query_row(pos, k)
+        else:
+            # 请求的k超过预计算数量时，临时计算该用户的近邻
+            neighbours, similarities = self.find_similar_users(rating_matrix, pos, k)
+        target_ratings = rating_matrix[pos].toarray().ravel()
+        neighbour_ratings = rating_matrix[neighbours].toarray()
+        return target_ratings, neighbour_ratings, similarities, product_ids
+    
+    def _dense_neighbourhood(self, target_user_id, k):
+        """稠密引擎：同 _sparse_neighbourhood，基于完整的评分矩阵和相似度矩阵"""
         rating_matrix = self.create_user_item_matrix()
         user_similarity = self.calculate_user_similarity(rating_matrix)
         
         # 获取目标用户的评分向量
         if target_user_id not in rating_matrix.index:
-            return []  # 新用户，没有评分数据
-        
-        target_ratings = rating_matrix.loc[target_user_id]
+            return None  # 新用户，没有评分数据
         
         # 找到最相似的k个用户
         similar_users = user_similarity[target_user_id].sort_values(ascending=False)[1:k+1]
+        return (rating_matrix.loc[target_user_id].to_numpy(),
+                rating_matrix.loc[similar_users.index].to_numpy(),
+                similar_users.to_numpy(),
+                rating_matrix.columns.to_numpy())
+    
+    @staticmethod
+    def predict_ratings(target_ratings, neighbour_ratings, similarities):
+        """向量化预测评分：近邻相似度加权平均近邻的评分
+
+        对每个产品，只统计评过分的近邻：预测值 = Σ相似度×评分 / Σ相似度。
+        返回 (预测评分数组, 可推荐掩码)，用户已评分或没有近邻评分的产品不可推荐。
+        """
+        weighted_sum = similarities @ neighbour_ratings
+        similarity_sum = similarities @ (neighbour_ratings > 0)
+        candidates = (target_ratings == 0) & (similarity_sum > 0)
+        predicted = np.zeros(len(target_ratings))
+        predicted[candidates] = weighted_sum[candidates] / similarity_sum[candidates]
+        return predicted, candidates
+    
+    def recommend_for_users(self, user_ids, top_n=5, k=2, block_size=DEFAULT_BATCH_BLOCK_SIZE, n_jobs=1):
+        """批量为多个用户生成推荐，返回 {用户ID: 推荐列表}
+
+        用户按 block_size 分块，每块用一次稀疏矩阵乘法完成打分，内存受块大小限制；
+        n_jobs 大于1时把各块分发到进程池并行计算。没有评分数据的用户返回空列表。
+        """
+        model = self.ensure_model()
+        rating_matrix, model_user_ids, product_ids = model['rating_matrix'], model['user_ids'], model['product_ids']
+        neighbour_idx, neighbour_sim = model['neighbour_idx'], model['neighbour_sim']
+        if k > neighbour_idx.shape[1] and model.get('ann_index') is not None:
+            neighbour_idx, neighbour_sim = model['ann_index'].all_neighbours(k)
+        elif k > neighbour_idx.shape[1]:
+            # 请求的k超过预计算数量，按新的k重新计算近邻
+            neighbour_idx, neighbour_sim = top_k_neighbours(normalize(rating_matrix, norm='l2', axis=1), k)
+        neighbour_idx, neighbour_sim = neighbour_idx[:, :k], neighbour_sim[:, :k]
+        rated_matrix = (rating_matrix > 0).astype(np.float64)
+        
+        user_ids = list(user_ids)
+        positions = np.searchsorted(model_user_ids, user_ids)
+        positions = np.clip(positions, 0, max(len(model_user_ids) - 1, 0))
+        known = np.flatnonzero(model_user_ids[positions] == np.asarray(user_ids)) if len(model_user_ids) else []
+        known_positions = positions[known]
+        blocks = [known_positions[i:i + block_size] for i in range(0, len(known_positions), block_size)]
+        
+        if n_jobs > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(rating_matrix, rated_matrix)) as executor:
+                futures = [executor.submit(_score_block_in_worker, block, neighbour_idx[block],
+                                           neighbour_sim[block], top_n) for block in blocks]
+                block_results = [future.result() for future in futures]
+        else:
+            block_results = [score_user_block(rating_matrix, rated_matrix, block, neighbour_idx[block],
+                                              neighbour_sim[block], top_n) for block in blocks]
+        
+        # 一次性关联所有产品名称
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids).to_numpy()
+        
+        results = {user_id: [] for user_id in user_ids}
+        scored = [row for block in block_results for row in block]
+        neighbour_counts = (neighbour_idx[known_positions] >= 0).sum(axis=1)
+        for i, row, neighbour_count in zip(known, scored, neighbour_counts.tolist()):
+            results[user_ids[i]] = [{
+                'product_id': int(product_ids[idx]),
+                'product_name': product_names[idx],
+                'predicted_rating': predicted,
+                'similar_users_count': neighbour_count
+            } for idx, predicted in row if not pd.isna(product_names[idx])]
+        return results
+    
+    def recommend_for_user(self, target_user_id,top_n=5 ,k=2):
+        """为目标用户生成推荐"""
+        if self.engine == 'sparse':
+            neighbourhood = self._sparse_neighbourhood(target_user_id, k)
+        else:
+            neighbourhood = self._dense_neighbourhood(target_user_id, k)
+        if neighbourhood is None:
+            return []
+        target_ratings, neighbour_ratings, similarities, product_ids = neighbourhood
+        
+        # 计算加权平均评分，并选出前top_n个
+        predicted, candidates = self.predict_ratings(target_ratings, neighbour_ratings, similarities)
+        selected = select_top_n(predicted, candidates, top_n)
+        
+        # 一次性关联选中产品的信息
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids[selected])
         
-        # 计算加权平均评分
-        all_products_df = self.db.get_all_products()
         recommendations = []
+        for idx, product_name in zip(selected, product_names):
+            if pd.isna(product_name):
+                continue  # 产品表中已不存在
+            recommendations.append({
+                'product_id': int(product_ids[idx]),
+                'product_name': product_name,
+                'predicted_rating': float(predicted[idx]),
+                'similar_users_count': len(similarities)
+            })
+        return recommendations
+
+
+class ItemBasedCollaborativeFiltering(NeighbourhoodRecommender):
+    """基于物品的协同过滤：预计算每个产品的Top-M相似产品
+
+    产品数远少于用户数且变化较慢，训练时只计算 产品×产品 的截断相似度表；
+    推荐时对用户历史中每个产品的近邻打分求和，请求开销只与历史长度有关，与用户总数无关。
+    """
+
+    def __init__(self, chunksize=None, n_neighbours=DEFAULT_ITEM_NEIGHBOURS, auto_refit=True):
+        super().__init__(chunksize=chunksize, n_neighbours=n_neighbours, auto_refit=auto_refit)
+    
+    def fit(self):
+        """训练：构建评分矩阵并预计算产品-产品近邻相似度表"""
+        start = time.time()
+        version = self.db.table_version('user_behavior')
+        rating_matrix, user_ids, product_ids = build_rating_matrix(self.db, self.chunksize)
+        item_similarity = item_neighbour_matrix(rating_matrix, self.n_neighbours)
         
-        for product_id in rating_matrix.columns:
-            if target_ratings[product_id] == 0:  # 用户还没评分的产品
-                weighted_sum = 0
-                similarity_sum = 0
-                
-                for similar_user_id, similarity in similar_users.items():
-                    similar_user_rating = rating_matrix.loc[similar_user_id, product_id]
-                    if similar_user_rating > 0:
-                        weighted_sum += similarity * similar_user_rating
-                        similarity_sum += similarity
-                
-                if similarity_sum > 0:
-                    predicted_rating = weighted_sum / similarity_sum
-                    product_info = all_products_df[all_products_df['product_id'] == product_id].iloc[0]
-                    recommendations.append({
-                        'product_id': product_id,
-                        'product_name': product_info['product_name'],
-                        'predicted_rating': predicted_rating,
-                        'similar_users_count': len(similar_users)
-                    })
-        
-        # 按预测评分排序
-        recommendations.sort(key=lambda x: x['predicted_rating'], reverse=True)
-        return recommendations[:top_n]  # 返回前5个推荐
+        self.model = {
+            'version': version,
+            'rating_matrix': rating_matrix,
+            'user_ids': user_ids,
+            'product_ids': product_ids,
+            'item_similarity': item_similarity,
+        }
+        summary = {
+            'users': len(user_ids),
+            'products': len(product_ids),
+            'ratings': int(rating_matrix.nnz),
+            'item_neighbours': int(item_similarity.nnz),
+            'fit_seconds': round(time.time() - start, 3),
+        }
+        print(f"基于物品的协同过滤模型训练完成: {summary}")
+        return summary
+    
+    @staticmethod
+    def score_history(history_ratings, history_similarity, rated):
+        """对用户历史产品的近邻打分求和
+
+        history_similarity 为历史中各产品在相似度表中的行，
+        预测值 = Σ相似度×历史评分 / Σ相似度，返回 (预测评分数组, 可推荐掩码, 每个产品贡献分数的历史产品数)。
+        """
+        weighted_sum = history_similarity.T @ history_ratings
+        similarity_sum = history_similarity.T @ np.ones(len(history_ratings))
+        support = np.diff(history_similarity.tocsc().indptr)
+        candidates = ~rated & (similarity_sum > 0)
+        predicted = np.zeros(len(weighted_sum))
+        predicted[candidates] = weighted_sum[candidates] / similarity_sum[candidates]
+        return predicted, candidates, support
+    
+    def recommend_for_user(self, target_user_id, top_n=5):
+        """为目标用户生成推荐"""
+        model = self.ensure_model()
+        rating_matrix, user_ids, product_ids = model['rating_matrix'], model['user_ids'], model['product_ids']
+        pos = np.searchsorted(user_ids, target_user_id)
+        if pos >= len(user_ids) or user_ids[pos] != target_user_id:
+            return []  # 新用户，没有评分数据
+        
+        # 只取出该用户历史产品对应的几行相似度
+        row = rating_matrix[pos]
+        history, history_ratings = row.indices, row.data
+        rated = np.zeros(len(product_ids), dtype=bool)
+        rated[history] = True
+        predicted, candidates, support = self.score_history(
+            history_ratings, model['item_similarity'][history], rated)
+        selected = select_top_n(predicted, candidates, top_n)
+        
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids[selected])
+        
+        recommendations = []
+        for idx, product_name in zip(selected, product_names):
+            if pd.isna(product_name):
+                continue  # 产品表中已不存在
+            recommendations.append({
+                'product_id': int(product_ids[idx]),
+                'product_name': product_name,
+                'predicted_rating': float(predicted[idx]),
+                'similar_items_count': int(support[idx])
+            })
+        return recommendations
+    
+    def recommend_for_users(self, user_ids, top_n=5, block_size=DEFAULT_BATCH_BLOCK_SIZE):
+        """批量为多个用户生成推荐，返回 {用户ID: 推荐列表}
+
+        每块用户的评分子矩阵与相似度表相乘一次得到全部打分，没有评分数据的用户返回空列表。
+        """
+        model = self.ensure_model()
+        rating_matrix, model_user_ids, product_ids = model['rating_matrix'], model['user_ids'], model['product_ids']
+        item_similarity = model['item_similarity']
+        
+        user_ids = list(user_ids)
+        positions = np.searchsorted(model_user_ids, user_ids)
+        positions = np.clip(positions, 0, max(len(model_user_ids) - 1, 0))
+        known = np.flatnonzero(model_user_ids[positions] == np.asarray(user_ids)) if len(model_user_ids) else []
+        known_positions = positions[known]
+        
+        products = self.db.get_all_products().drop_duplicates('product_id').set_index('product_id')
+        product_names = products['product_name'].reindex(product_ids).to_numpy()
+        
+        results = {user_id: [] for user_id in user_ids}
+        for start in range(0, len(known_positions), block_size):
+            block = known_positions[start:start + block_size]
+            ratings = rating_matrix[block]
+            rated = ratings.copy()
+            rated.data = np.ones_like(rated.data)
+            weighted_sum = (ratings @ item_similarity).toarray()
+            similarity_sum = (rated @ item_similarity).toarray()
+            support = (rated @ (item_similarity > 0).astype(np.float64)).toarray()
+            candidates = (ratings.toarray() == 0) & (similarity_sum > 0)
+            predicted = np.zeros_like(weighted_sum)
+            np.divide(weighted_sum, similarity_sum, out=predicted, where=candidates)
+            
+            for offset, i in enumerate(known[start:start + block_size]):
+                selected = select_top_n(predicted[offset], candidates[offset], top_n)
+                results[user_ids[i]] = [{
+                    'product_id': int(product_ids[idx]),
+                    'product_name': product_names[idx],
+                    'predicted_rating': float(predicted[offset, idx]),
+                    'similar_items_count': int(support[offset, idx])
+                } for idx in selected if not pd.isna(product_names[idx])]
+        return results
 
 # 测试代码
 if __name__ == "__main__":
@@ -84,4 +730,14 @@ if __name__ == "__main__":
     
     print(f"\n为用户 {user_id} 的协同过滤推荐结果:")
     for i, rec in enumerate(recommendations, 1):
-        print(f"{i}. {rec['product_name']} (预测评分: {rec['predicted_rating']:.2f})")
\ No newline at end of file
+        print(f"{i}. {rec['product_name']} (预测评分: {rec['predicted_rating']:.2f})")
+    
+    # 批量推荐示例
+    batch_results = cf.recommend_for_users(cf.ensure_model()['user_ids'], top_n=3)
+    print(f"\n批量推荐完成，共 {len(batch_results)} 个用户")
+    
+    # 基于物品的协同过滤
+    item_cf = ItemBasedCollaborativeFiltering()
+    print(f"\n为用户 {user_id} 的基于物品的协同过滤推荐结果:")
+    for i, rec in enumerate(item_cf.recommend_for_user(user_id), 1):
+        print(f"{i}. {rec['product_name']} (预测评分: {rec['predicted_rating']:.2f})")
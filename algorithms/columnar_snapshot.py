@@ -0,0 +1,172 @@
+# columnar_snapshot.py
+# 列式内存映射快照：把用户、产品、行为表导出为 .npy 列文件，
+# 各个Web进程用 mmap 打开，共享同一份操作系统页缓存，无需各自从SQLite解码
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SNAPSHOT_DIR = './data/snapshot'
+SNAPSHOT_TABLES = ('users', 'products', 'user_behavior')
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _write_column(table_dir, col, series):
+    """把一列写成 .npy 文件，返回该列在清单中的描述"""
+    path = os.path.join(table_dir, f"{col}.npy")
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        np.save(path, series.cat.codes.to_numpy())
+        return {'kind': 'category', 'categories': [str(c) for c in series.cat.categories]}
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        np.save(path, series.to_numpy())
+        return {'kind': 'numeric', 'dtype': str(series.dtype)}
+    # 文本列保存为定长Unicode数组，同样可以mmap
+    np.save(path, series.astype(str).to_numpy(dtype=str))
+    return {'kind': 'string'}
+
+
+def export_snapshot(db, snapshot_dir=DEFAULT_SNAPSHOT_DIR, keep=2):
+    """从数据库导出一个新版本的列式快照，并把 CURRENT 指向它
+
+    每个版本写在独立目录中，写完后再原子替换 CURRENT 文件，
+    正在读取旧版本的进程不受影响；只保留最近 keep 个版本。
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    # 指纹取自实际写入的行：读取按指纹中的最大rowid截断，读取期间追加的行留给之后的增量，
+    # 不会既写进快照又被当作快照水位线之后的增量再读一次
+    frames, fingerprints = {}, {}
+    for table in SNAPSHOT_TABLES:
+        frames[table], fingerprint = db.load_table(table, compact=True, with_version=True)
+        fingerprints[table] = list(fingerprint)
+    digest = hashlib.sha1(json.dumps(fingerprints, sort_keys=True).encode()).hexdigest()[:8]
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{digest}"
+
+    tmp_dir = os.path.join(snapshot_dir, f".tmp-{version}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    manifest = {
+        'version': version,
+        'created_at': time.time(),
+        'fingerprints': fingerprints,
+        'tables': {},
+    }
+
+    for table, df in frames.items():
+        table_dir = os.path.join(tmp_dir, table)
+        os.makedirs(table_dir)
+        manifest['tables'][table] = {
+            'rows': len(df),
+            'columns': {col: _write_column(table_dir, col, df[col]) for col in df.columns},
+        }
+
+    # ID映射：有序的用户/产品ID数组，行为表中保存对应的下标，供矩阵类算法直接使用
+    user_ids = np.sort(frames['users']['user_id'].to_numpy())
+    product_ids = np.sort(frames['products']['product_id'].to_numpy())
+    np.save(os.path.join(tmp_dir, 'user_ids.npy'), user_ids)
+    np.save(os.path.join(tmp_dir, 'product_ids.npy'), product_ids)
+    behavior_dir = os.path.join(tmp_dir, 'user_behavior')
+    behavior = frames['user_behavior']
+    np.save(os.path.join(behavior_dir, 'user_idx.npy'), _encode_ids(behavior['user_id'].to_numpy(), user_ids))
+    np.save(os.path.join(behavior_dir, 'product_idx.npy'),
+            _encode_ids(behavior['product_id'].to_numpy(), product_ids))
+
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    os.replace(tmp_dir, os.path.join(snapshot_dir, version))
+    current_tmp = os.path.join(snapshot_dir, f".{CURRENT_FILE}.tmp")
+    with open(current_tmp, 'w') as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(snapshot_dir, CURRENT_FILE))
+
+    _remove_old_versions(snapshot_dir, keep)
+    print(f"已导出列式快照 {version}: " +
+          ", ".join(f"{t} {manifest['tables'][t]['rows']} 行" for t in SNAPSHOT_TABLES))
+    return version
+
+
+def _encode_ids(ids, sorted_ids):
+    """把ID转换为有序ID数组中的下标，找不到的记为-1"""
+    idx = np.searchsorted(sorted_ids, ids)
+    idx = np.clip(idx, 0, max(len(sorted_ids) - 1, 0))
+    found = (sorted_ids[idx] == ids) if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return np.where(found, idx, -1).astype(np.int32)
+
+
+def _remove_old_versions(snapshot_dir, keep):
+    """删除较旧的快照版本（已mmap打开的文件在Linux上仍可继续读取）"""
+    versions = sorted(name for name in os.listdir(snapshot_dir)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(snapshot_dir, name)))
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+class ColumnarSnapshot:
+    """只读打开某个版本的列式快照，所有列都以 mmap 方式加载"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.fingerprints = {t: tuple(fp) for t, fp in self.manifest['fingerprints'].items()}
+        self._arrays = {}
+
+    @classmethod
+    def open_current(cls, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+        """打开 CURRENT 指向的快照，不存在时返回None"""
+        try:
+            with open(os.path.join(snapshot_dir, CURRENT_FILE)) as f:
+                version = f.read().strip()
+            return cls(os.path.join(snapshot_dir, version))
+        except (OSError, ValueError) as e:
+            print(f"打开列式快照失败: {e}")
+            return None
+
+    def array(self, *parts):
+        """以mmap方式加载一个 .npy 文件（同一文件只打开一次）"""
+        key = os.path.join(*parts)
+        arr = self._arrays.get(key)
+        if arr is None:
+            arr = np.load(os.path.join(self.path, f"{key}.npy"), mmap_mode='r')
+            self._arrays[key] = arr
+        return arr
+
+    def has_table(self, table):
+        return table in self.manifest['tables']
+
+    def table(self, table, columns=None):
+        """构造指向mmap数组的DataFrame（数值列和分类编码不复制）"""
+        spec = self.manifest['tables'][table]['columns']
+        if columns is None:
+            columns = list(spec)
+        data = {}
+        for col in columns:
+            col_spec = spec[col]
+            arr = self.array(table, col)
+            if col_spec['kind'] == 'category':
+                dtype = pd.CategoricalDtype(col_spec['categories'])
+                data[col] = pd.Categorical.from_codes(arr, dtype=dtype, validate=False)
+            else:
+                data[col] = arr
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+    def id_maps(self):
+        """返回 (有序用户ID数组, 有序产品ID数组)"""
+        return self.array('user_ids'), self.array('product_ids')
+
+    def encoded_behavior(self):
+        """返回行为表中用户、产品对应的下标数组"""
+        return self.array('user_behavior', 'user_idx'), self.array('user_behavior', 'product_idx')
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database_utils import DatabaseManager
+
+    export_snapshot(DatabaseManager(), sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SNAPSHOT_DIR)
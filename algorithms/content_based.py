@@ -1,23 +1,54 @@
 import sys
 import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, normalize
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 try:
     from .database_utils import DatabaseManager
+    from .ranking import select_top_n
 except ImportError:
     from database_utils import DatabaseManager
+    from ranking import select_top_n
+
+# 人口统计特征到画像取值的映射，未知取值按中间档处理
+RISK_MAPPING = {'low': 0, 'medium': 1, 'high': 2}
+INCOME_MAPPING = {'low': 0, 'medium': 1, 'high': 2}
+OCCUPATION_MAPPING = {'工程师': 2, '教师': 1, '医生': 2, '自由职业': 1, '企业家': 3}
+
+# 批量计算画像与产品相似度时，每块相似度矩阵的最大元素个数
+PROFILE_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+# 画像预计算表：年龄超过上限后画像不再变化；每个画像保存的推荐数，请求更多时退回实时计算
+PROFILE_MAX_AGE = 80
+PROFILE_TABLE_TOP_N = 20
 
 
 class ContentBasedRecommender:
-    def __init__(self):
+    def __init__(self, use_profile_table=True):
         self.db = DatabaseManager()
         self.label_encoders = {}
+        # 编码、归一化后的产品特征缓存，products表变化时重建
+        self.features = None
+        self._features_lock = threading.Lock()
+        # 人口统计画像的预计算推荐表 {画像键: 推荐列表}，与产品特征缓存使用同一版本指纹
+        self.use_profile_table = use_profile_table
+        self.profile_table = None
+        self._profile_table_lock = threading.Lock()
+        # 用户 -> 已购买产品在特征矩阵中的行号（CSR），行为表或产品表变化时重建
+        self.purchase_index = None
+        self._purchase_index_lock = threading.Lock()
     
-    def prepare_product_features(self):
-        """准备产品特征向量 - 修复版本"""
-        products_df = self.db.get_all_products()
+    def prepare_product_features(self, products_df=None):
+        """准备产品特征向量 - 修复版本（products_df 为None时读取products表）"""
+        if products_df is None:
+            products_df = self.db.get_all_products()
         
         # 对分类特征进行编码
         feature_columns = ['product_type', 'risk_level']
@@ -46,9 +77,104 @@ class ContentBasedRecommender:
         
         return products_df, feature_matrix
     
-    def get_user_profile(self, user_id):
-        """基于用户历史购买构建用户画像 - 修复版本"""
-        behavior_df = self.db.get_user_behavior()
+    def load_product_features(self):
+        """返回缓存的产品特征，products表的版本指纹变化时才重新编码
+
+        返回字典：products_df、feature_matrix（原始特征，用于计算购买产品的平均画像）、
+        normalized（按行L2归一化的float32矩阵，与画像做一次矩阵-向量乘法即得到余弦相似度）。
+        """
+        version = self.db.table_version('products')
+        features = self.features
+        if features is not None and features['version'] == version:
+            return features
+        with self._features_lock:
+            if self.features is None or self.features['version'] != version:
+                self.features = self.build_features(version=version)
+            return self.features
+    
+    def build_features(self, products_df=None, version=None):
+        """编码产品特征并组装成 load_product_features 返回的缓存字典"""
+        products_df, feature_matrix = self.prepare_product_features(products_df)
+        return {
+            'version': version,
+            'products_df': products_df,
+            'feature_matrix': feature_matrix,
+            'normalized': normalize(feature_matrix.astype(np.float64), norm='l2', axis=1).astype(np.float32),
+            # 生成推荐结果时按下标直接取值，避免逐行 iloc
+            'product_ids': products_df['product_id'].to_numpy(),
+            'columns': {col: products_df[col].astype(str).tolist()
+                        for col in ('product_name', 'product_type', 'risk_level')},
+        }
+    
+    @staticmethod
+    def profile_similarities(features, user_profile):
+        """画像与所有产品的余弦相似度（画像为零向量时全部为0）"""
+        norm = np.linalg.norm(user_profile)
+        if norm == 0:
+            return np.zeros(len(features['normalized']), dtype=np.float32)
+        return features['normalized'] @ (np.asarray(user_profile, dtype=np.float64) / norm).astype(np.float32)
+    
+    def format_recommendations(self, features, selected, similarities, reason):
+        """只为选中的产品生成结果字典，reason 为带 {similarity} 占位符的说明模板"""
+        columns = features['columns']
+        return [{
+            'product_id': int(features['product_ids'][idx]),
+            'product_name': columns['product_name'][idx],
+            'product_type': columns['product_type'][idx],
+            'risk_level': columns['risk_level'][idx],
+            'similarity': float(similarities[idx]),
+            'reason': reason.format(similarity=float(similarities[idx]))
+        } for idx in selected.tolist()]
+    
+    def build_purchase_index(self, features, version=None):
+        """构建用户购买索引：user_ids 升序，第i个用户购买过的产品行号为 rows[indptr[i]:indptr[i+1]]
+
+        行号是产品在特征矩阵中的行，每个用户内去重并升序排列；不在产品目录中的产品被忽略。
+        """
+        behavior_df = self.db.get_user_behavior(columns=['user_id', 'product_id', 'behavior_type'], compact=True)
+        purchase_df = behavior_df[behavior_df['behavior_type'] == 'purchase']
+        rows = pd.Index(features['product_ids']).get_indexer(purchase_df['product_id'].to_numpy())
+        known = rows >= 0
+        num_products = max(len(features['product_ids']), 1)
+        # 按 (用户, 行号) 编码后排序去重，一次得到分组有序的CSR
+        pairs = np.unique(purchase_df['user_id'].to_numpy(dtype=np.int64)[known] * num_products + rows[known])
+        user_col, rows = pairs // num_products, pairs % num_products
+        user_ids, starts = np.unique(user_col, return_index=True)
+        return {
+            'behavior_version': version,
+            'products_version': features['version'],
+            'user_ids': user_ids,
+            'indptr': np.append(starts, len(rows)),
+            'rows': rows,
+        }
+    
+    def load_purchase_index(self, features):
+        """返回缓存的用户购买索引，行为表或产品表的版本变化时重建"""
+        version = self.db.table_version('user_behavior')
+        index = self.purchase_index
+        if (index is not None and index['behavior_version'] == version
+                and index['products_version'] == features['version']):
+            return index
+        with self._purchase_index_lock:
+            index = self.purchase_index
+            if (index is None or index['behavior_version'] != version
+                    or index['products_version'] != features['version']):
+                self.purchase_index = self.build_purchase_index(features, version)
+            return self.purchase_index
+    
+    def purchased_rows(self, user_id, features):
+        """用户购买过的产品在特征矩阵中的行号（升序）"""
+        index = self.load_purchase_index(features)
+        pos = np.searchsorted(index['user_ids'], user_id)
+        if pos >= len(index['user_ids']) or index['user_ids'][pos] != user_id:
+            return index['rows'][:0]
+        return index['rows'][index['indptr'][pos]:index['indptr'][pos + 1]]
+    
+    def get_user_profile(self, user_id, purchased_rows=None):
+        """基于用户历史购买构建用户画像 - 修复版本
+
+        purchased_rows 为用户已购产品的行号，None 时从购买索引中读取。
+        """
         user_df = self.db.get_user_by_id(user_id)
         
         if len(user_df) == 0:
@@ -56,52 +182,55 @@ class ContentBasedRecommender:
             
         user_data = user_df.iloc[0]
         
-        # 获取用户购买的产品
-        user_purchases = behavior_df[
-            (behavior_df['user_id'] == user_id) & 
-            (behavior_df['behavior_type'] == 'purchase')
-        ]['product_id'].tolist()
-        
-        products_df, feature_matrix = self.prepare_product_features()
+        features = self.load_product_features()
+        feature_matrix = features['feature_matrix']
         
-        if not user_purchases:
-            # 如果用户没有购买历史，基于用户特征创建画像
-            return self.create_profile_from_demographics(user_data, feature_matrix.shape[1])
-        
-        # 基于购买历史构建画像
-        user_products_df = products_df[products_df['product_id'].isin(user_purchases)]
+        # 获取用户购买的产品
+        if purchased_rows is None:
+            purchased_rows = self.purchased_rows(user_id, features)
         
-        if len(user_products_df) == 0:
+        if len(purchased_rows) == 0:
+            # 如果用户没有购买历史（或购买的产品已不在目录中），基于用户特征创建画像
             return self.create_profile_from_demographics(user_data, feature_matrix.shape[1])
         
         # 计算用户偏好向量（购买产品的平均特征）
-        user_indices = user_products_df.index
-        user_feature_matrix = feature_matrix[user_indices]
-        user_profile = user_feature_matrix.mean(axis=0)
-        
-        return user_profile
+        return feature_matrix[purchased_rows].mean(axis=0)
     
     def create_profile_from_demographics(self, user_data, feature_dim):
         """基于用户人口统计信息创建画像 - 修复版本"""
-        # 创建基于用户特征的简单画像
-        risk_mapping = {'low': 0, 'medium': 1, 'high': 2}
-        income_mapping = {'low': 0, 'medium': 1, 'high': 2}
-        occupation_mapping = {'工程师': 2, '教师': 1, '医生': 2, '自由职业': 1, '企业家': 3}
-        
         # 简化的特征映射
         profile = np.zeros(feature_dim)
         
         # 根据特征维度调整
         if feature_dim >= 2:
-            profile[0] = risk_mapping.get(user_data['risk_tolerance'], 1) / 2.0  # 风险偏好
-            profile[1] = income_mapping.get(user_data['income_level'], 1) / 2.0  # 收入水平
+            profile[0] = RISK_MAPPING.get(user_data['risk_tolerance'], 1) / 2.0  # 风险偏好
+            profile[1] = INCOME_MAPPING.get(user_data['income_level'], 1) / 2.0  # 收入水平
         
         if feature_dim >= 4:
             profile[2] = min(user_data['age'] / 80.0, 1.0)  # 年龄归一化
-            profile[3] = occupation_mapping.get(user_data['occupation'], 1) / 3.0  # 职业
+            profile[3] = OCCUPATION_MAPPING.get(user_data['occupation'], 1) / 3.0  # 职业
         
         return profile
     
+    def profiles_from_demographics(self, profiles, feature_dim):
+        """create_profile_from_demographics 的批量版本，返回 (画像数 × feature_dim) 的矩阵"""
+        profiles_df = pd.DataFrame(list(profiles))
+        matrix = np.zeros((len(profiles_df), feature_dim))
+        if len(profiles_df) == 0:
+            return matrix
+        
+        def mapped(column, mapping):
+            values = profiles_df[column].map(lambda value: mapping.get(value, 1))
+            return values.to_numpy(dtype=np.float64)
+        
+        if feature_dim >= 2:
+            matrix[:, 0] = mapped('risk_tolerance', RISK_MAPPING) / 2.0
+            matrix[:, 1] = mapped('income_level', INCOME_MAPPING) / 2.0
+        if feature_dim >= 4:
+            matrix[:, 2] = np.minimum(profiles_df['age'].to_numpy(dtype=np.float64) / 80.0, 1.0)
+            matrix[:, 3] = mapped('occupation', OCCUPATION_MAPPING) / 3.0
+        return matrix
+    
     def convert_to_serializable(self, obj):
         """将numpy类型转换为Python原生类型，确保JSON可序列化"""
         if isinstance(obj, (np.integer, np.int64)):
@@ -114,84 +243,146 @@ class ContentBasedRecommender:
             return obj
 
     
+    def profile_key(self, user_data):
+        """人口统计画像的键：(风险偏好, 收入水平, min(年龄, 80), 职业) 映射后的取值
+
+        画像向量只由这四个取值决定；年龄不是有限的非负整数（含NaN、inf）时返回None（不在预计算表中）。
+        """
+        age = user_data['age']
+        if isinstance(age, bool) or not isinstance(age, (int, float, np.integer, np.floating)) \
+                or not np.isfinite(age) or age < 0 or age != int(age):
+            return None
+        return (RISK_MAPPING.get(user_data['risk_tolerance'], 1),
+                INCOME_MAPPING.get(user_data['income_level'], 1),
+                min(int(age), PROFILE_MAX_AGE),
+                OCCUPATION_MAPPING.get(user_data['occupation'], 1))
+    
+    def precompute_profile_table(self, top_n=PROFILE_TABLE_TOP_N):
+        """离线预计算：枚举所有可能的画像键，保存每个画像按相似度排序的前 top_n 个推荐"""
+        start = time.time()
+        features = self.load_product_features()
+        keys = [(risk, income, age, occupation)
+                for risk in sorted(set(RISK_MAPPING.values()))
+                for income in sorted(set(INCOME_MAPPING.values()))
+                for age in range(PROFILE_MAX_AGE + 1)
+                for occupation in sorted(set(OCCUPATION_MAPPING.values()))]
+        # 与 create_profile_from_demographics 相同的运算，保证与实时计算的画像逐位相同
+        profile_matrix = np.array([[risk / 2.0, income / 2.0, min(age / 80.0, 1.0), occupation / 3.0]
+                                   for risk, income, age, occupation in keys])
+        ranked = self._rank_profiles(features, profile_matrix, top_n)
+        self.profile_table = {
+            'version': features['version'],
+            'top_n': top_n,
+            'recommendations': dict(zip(keys, ranked)),
+        }
+        print(f"画像推荐表预计算完成: {len(keys)} 个画像, 耗时 {time.time() - start:.2f}s")
+        return self.profile_table
+    
+    def lookup_profile_table(self, user_data, top_n, features):
+        """在预计算表中查找画像的推荐，不在表中（或表已过期、请求数量超过表的深度）时返回None"""
+        if not self.use_profile_table or top_n > PROFILE_TABLE_TOP_N:
+            return None
+        key = self.profile_key(user_data)
+        if key is None:
+            return None
+        table = self.profile_table
+        if table is None or table['version'] != features['version']:
+            with self._profile_table_lock:
+                if self.profile_table is None or self.profile_table['version'] != features['version']:
+                    self.precompute_profile_table()
+                table = self.profile_table
+        ranked = table['recommendations'].get(key)
+        if ranked is None or top_n > table['top_n']:
+            return None
+        return [dict(rec) for rec in ranked[:top_n]]
+    
     def recommend_for_profile(self, user_data, top_n=5):
-        """基于用户画像（年龄/职业等）生成推荐"""
+        """基于用户画像（年龄/职业等）生成推荐，常见画像直接查预计算表，其余实时计算"""
         try:
             print(f"开始基于用户画像生成推荐，top_n={top_n}")
             if user_data is None:
                 print("用户画像数据为空")
                 return []
             
-            products_df, product_features = self.prepare_product_features()
-            feature_dim = product_features.shape[1]
+            features = self.load_product_features()
+            result = self.lookup_profile_table(user_data, top_n, features)
+            if result is not None:
+                print(f"基于内容推荐完成（画像预计算表），返回 {len(result)} 个推荐")
+                return result
+            
+            feature_dim = features['normalized'].shape[1]
             user_profile = self.create_profile_from_demographics(user_data, feature_dim)
             
             # 计算用户画像与所有产品的相似度
-            similarities = cosine_similarity([user_profile], product_features)[0]
-            
-            recommendations = []
-            for idx, similarity in enumerate(similarities):
-                if similarity <= 0:
-                    continue
-                product = products_df.iloc[idx]
-                recommendations.append({
-                    'product_id': self.convert_to_serializable(product['product_id']),
-                    'product_name': str(product['product_name']),
-                    'product_type': str(product['product_type']),
-                    'risk_level': str(product['risk_level']),
-                    'similarity': self.convert_to_serializable(similarity),
-                    'reason': f'画像匹配度 {float(similarity):.3f}'
-                })
+            similarities = self.profile_similarities(features, user_profile)
             
-            recommendations.sort(key=lambda x: x['similarity'], reverse=True)
-            result = recommendations[:top_n]
+            # 只保留相似度为正的产品，取Top-N后再生成结果
+            selected = select_top_n(similarities, similarities > 0, top_n)
+            result = self.format_recommendations(features, selected, similarities, '画像匹配度 {similarity:.3f}')
             print(f"基于内容推荐完成，返回 {len(result)} 个推荐")
             return result
         except Exception as e:
             print(f"基于内容推荐出错: {e}")
             return []
     
+    def _rank_profiles(self, features, profile_matrix, top_n, block_elements=PROFILE_BLOCK_ELEMENTS):
+        """为画像矩阵的每一行生成Top-N推荐，相似度按块做矩阵乘法"""
+        normalized = features['normalized']
+        # 与 profile_similarities 相同：画像除以自身范数，零向量保持为0
+        norms = np.linalg.norm(profile_matrix, axis=1, keepdims=True)
+        profile_matrix = (profile_matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+        results = []
+        block_rows = max(1, block_elements // max(len(normalized), 1))
+        for block_start in range(0, len(profile_matrix), block_rows):
+            similarities = profile_matrix[block_start:block_start + block_rows] @ normalized.T
+            for row_similarities in similarities:
+                selected = select_top_n(row_similarities, row_similarities > 0, top_n)
+                results.append(self.format_recommendations(features, selected, row_similarities,
+                                                           '画像匹配度 {similarity:.3f}'))
+        return results
+    
+    def recommend_for_profiles(self, profiles, top_n=5, block_elements=PROFILE_BLOCK_ELEMENTS):
+        """批量为多个用户画像生成推荐，返回与 profiles 顺序一致的推荐列表
+
+        画像矩阵一次性构建并归一化，相同的画像只计算一次；相似度按块做矩阵乘法，
+        每块的元素个数不超过 block_elements。
+        """
+        start = time.time()
+        features = self.load_product_features()
+        normalized = features['normalized']
+        profile_matrix = self.profiles_from_demographics(profiles, normalized.shape[1])
+        if len(profile_matrix) == 0:
+            return []
+        # 画像只由少数几个离散特征决定，大批量画像中重复很多
+        unique_profiles, inverse = np.unique(profile_matrix, axis=0, return_inverse=True)
+        unique_results = self._rank_profiles(features, unique_profiles, top_n, block_elements)
+        # 每个画像返回独立的结果字典，调用方修改时互不影响
+        results = [[dict(rec) for rec in unique_results[i]] for i in inverse.ravel().tolist()]
+        print(f"批量基于内容推荐完成: {len(results)} 个画像（不同画像 {len(unique_profiles)} 个）, "
+              f"耗时 {time.time() - start:.2f}s")
+        return results
+    
     def recommend_for_user(self, user_id, top_n=5):
         """兼容旧逻辑：继续支持根据用户ID推荐"""
         try:
-            products_df, product_features = self.prepare_product_features()
-            user_profile = self.get_user_profile(user_id)
+            features = self.load_product_features()
+            # 已购产品的行号同时用于构建画像和排除已购产品
+            purchased_rows = self.purchased_rows(user_id, features)
+            user_profile = self.get_user_profile(user_id, purchased_rows)
             
             if user_profile is None:
                 return []
             
-            # 确保维度匹配
-            min_dim = min(len(user_profile), product_features.shape[1])
-            user_profile_adj = user_profile[:min_dim]
-            product_features_adj = product_features[:, :min_dim]
-            
-            # 计算用户画像与所有产品的相似度
-            similarities = cosine_similarity([user_profile_adj], product_features_adj)[0]
-            
-            # 获取用户已购买的产品（避免重复推荐）
-            behavior_df = self.db.get_user_behavior()
-            purchased_products = behavior_df[
-                (behavior_df['user_id'] == user_id) & 
-                (behavior_df['behavior_type'] == 'purchase')
-            ]['product_id'].tolist()
+            # 计算用户画像与所有产品的相似度（画像与产品特征维度相同）
+            similarities = self.profile_similarities(features, user_profile)
             
-            # 生成推荐列表
-            recommendations = []
-            for idx, similarity in enumerate(similarities):
-                product = products_df.iloc[idx]
-                if product['product_id'] not in purchased_products and similarity > 0:
-                    recommendations.append({
-                        'product_id': self.convert_to_serializable(product['product_id']),
-                        'product_name': str(product['product_name']),
-                        'product_type': str(product['product_type']),
-                        'risk_level': str(product['risk_level']),
-                        'similarity': self.convert_to_serializable(similarity),
-                        'reason': f'与您的画像匹配度: {float(similarity):.3f}'
-                    })
+            # 排除用户已购买的产品（避免重复推荐）
+            candidates = similarities > 0
+            candidates[purchased_rows] = False
             
-            # 按相似度排序
-            recommendations.sort(key=lambda x: x['similarity'], reverse=True)
-            return recommendations[:top_n]
+            # 按相似度取Top-N
+            selected = select_top_n(similarities, candidates, top_n)
+            return self.format_recommendations(features, selected, similarities, '与您的画像匹配度: {similarity:.3f}')
             
         except Exception as e:
             print(f"基于内容推荐出错: {e}")
@@ -1,6 +1,10 @@
 # create_database.py
 import sqlite3
 import pandas as pd
+try:
+    from .database_utils import INDEX_STATEMENTS, CHANGE_TRACKING_STATEMENTS
+except ImportError:
+    from database_utils import INDEX_STATEMENTS, CHANGE_TRACKING_STATEMENTS
 
 # 连接到数据库文件（如果不存在则会自动创建）
 conn = sqlite3.connect('./data/financial_data.db')
@@ -42,6 +46,14 @@ c.execute('''
     )
 ''')
 
+# 4. 为用户行为表创建索引 - 按用户查询购买记录、按产品统计行为时使用
+for statement in INDEX_STATEMENTS:
+    c.execute(statement)
+
+# 5. 记录各表的删除/修改次数，供缓存判断数据是否只发生了追加
+for statement in CHANGE_TRACKING_STATEMENTS:
+    c.execute(statement)
+
 # --- 插入模拟数据 ---
 
 # 插入用户数据
@@ -1,48 +1,691 @@
+import os
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
 
+try:
+    from .columnar_snapshot import ColumnarSnapshot, CURRENT_FILE, DEFAULT_SNAPSHOT_DIR
+except ImportError:
+    from columnar_snapshot import ColumnarSnapshot, CURRENT_FILE, DEFAULT_SNAPSHOT_DIR
+
+# 连接池默认参数
+DEFAULT_POOL_SIZE = 16
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',        # 读写并发，读不阻塞写
+    'synchronous': 'NORMAL',      # WAL模式下足够安全，减少fsync
+    'mmap_size': 268435456,       # 256MB 内存映射读取
+    'cache_size': -65536,         # 负数表示KB，即64MB页缓存
+    'temp_store': 'MEMORY',       # 临时表/排序放在内存
+}
+
+# 按用户查询行为所需的索引（create_database.py、generate_large_data.py 建库时也使用这些语句）
+INDEX_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS idx_user_behavior_user_type ON user_behavior (user_id, behavior_type)",
+    "CREATE INDEX IF NOT EXISTS idx_user_behavior_product ON user_behavior (product_id)",
+]
+
+# 各表被删除/修改的行数，由触发器维护，是表指纹的第三个分量。
+# 没有AUTOINCREMENT时删除末尾的行后再插入会复用rowid，(行数, 最大rowid) 可能完全不变，
+# 原地UPDATE也不改变这两个值；有了该计数，指纹只在纯追加时保持可增量合并
+CHANGES_TABLE = 'table_changes'
+TRACKED_TABLES = ('users', 'products', 'user_behavior')
+CHANGE_TRACKING_STATEMENTS = [
+    f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (table_name TEXT PRIMARY KEY, changes INTEGER NOT NULL)",
+] + [
+    f"INSERT OR IGNORE INTO {CHANGES_TABLE} (table_name, changes) VALUES ('{table}', 0)"
+    for table in TRACKED_TABLES
+] + [
+    f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_changes AFTER {event} ON {table} BEGIN "
+    f"UPDATE {CHANGES_TABLE} SET changes = changes + 1 WHERE table_name = '{table}'; END"
+    for table in TRACKED_TABLES for event in ('DELETE', 'UPDATE')
+]
+
+# 单用户查询结果缓存的最大条目数
+DEFAULT_LOOKUP_CACHE_SIZE = 10000
+
+# 流式读取用户行为时每批的行数
+DEFAULT_CHUNK_SIZE = 100000
+
+# 只追加不修改的表，快照过期时按rowid水位线增量合并
+APPEND_ONLY_TABLES = ('user_behavior',)
+
+# 紧凑加载时各列的目标类型，'epoch' 表示在SQL中把时间戳转换为Unix秒(int64)
+COMPACT_SCHEMAS = {
+    'users': {
+        'user_id': 'int32',
+        'age': 'int8',
+        'occupation': 'category',
+        'income_level': 'category',
+        'risk_tolerance': 'category',
+    },
+    'products': {
+        'product_id': 'int32',
+        'product_name': 'object',
+        'product_type': 'category',
+        'risk_level': 'category',
+        'expected_return': 'float64',
+        'min_investment': 'int32',
+    },
+    'user_behavior': {
+        'user_id': 'int32',
+        'product_id': 'int32',
+        'behavior_type': 'category',
+        'rating': 'int8',
+        'timestamp': 'epoch',
+    },
+}
+
+
+class ConnectionPool:
+    """有界的SQLite长连接池：按需借出、用完归还
+
+    空闲连接放在后进先出队列中，最近归还的连接页缓存最热，优先借出；
+    连接总数不超过 max_size，全部借出时后来的请求阻塞等待归还。
+    连接以 check_same_thread=False 打开，可以在不同线程之间传递。
+    同一线程嵌套借用时返回已借出的同一个连接，避免自己等待自己。
+    """
+
+    def __init__(self, db_path, max_size=DEFAULT_POOL_SIZE, pragmas=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()  # 当前线程借出的连接及嵌套层数
+        self._lock = threading.Lock()
+        self._size = 0  # 已打开的连接数（空闲 + 借出）
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _create_connection(self):
+        """新建连接并应用调优参数"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            try:
+                conn.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.OperationalError as e:
+                # 只读文件等情况下WAL无法开启，退回默认设置继续使用
+                print(f"设置 PRAGMA {name} 失败: {e}")
+        return conn
+
+    def acquire(self, timeout=None):
+        """借出一个连接，用完后必须调用 release() 归还
+
+        优先复用空闲连接；没有空闲连接且未达上限时新建；
+        达到上限时等待其他线程归还，timeout 秒内等不到抛出 queue.Empty。
+        """
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except queue.Empty:
+            with self._lock:
+                create = self._size < self.max_size
+                if create:
+                    self._size += 1
+                    self.misses += 1
+                else:
+                    self.waits += 1
+            if create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+            else:
+                conn = self._idle.get(timeout=timeout)
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """归还连接；嵌套借用时只有最外层归还才放回空闲队列"""
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+        if conn.in_transaction:
+            # 调用方没有提交的写入不能带给下一个借用者
+            conn.rollback()
+        self._idle.put(conn)
+
+    def stats(self):
+        """返回连接池统计信息，便于压测时调整池大小"""
+        with self._lock:
+            total = self.hits + self.misses + self.waits
+            return {
+                'db_path': self.db_path,
+                'size': self._size,
+                'idle': self._idle.qsize(),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                # 只有直接取到空闲连接才算命中；等待归还的请求不算
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def close_all(self):
+        """关闭池中所有空闲连接；借出中的连接归还后仍可继续使用"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._size -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, max_size=DEFAULT_POOL_SIZE):
+    """获取（或创建）某个数据库文件对应的全局连接池"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_path, max_size=max_size)
+            _pools[key] = pool
+        return pool
+
+
+def change_count(conn, table):
+    """表被删除/修改过的行数（见 CHANGE_TRACKING_STATEMENTS），未建立计数时返回0"""
+    try:
+        row = conn.execute(f"SELECT changes FROM {CHANGES_TABLE} WHERE table_name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+class TableSnapshotCache:
+    """整表DataFrame快照缓存
+
+    每个快照都记录加载时表的指纹 (行数, 最大rowid, 删除/修改计数)，指纹不变时直接返回内存中的快照。
+    指纹在进程内共享：在一个专用长连接上读取 PRAGMA data_version，
+    没有其他连接提交过写入时直接返回记住的指纹；有写入时先查O(1)的最大rowid和删除/修改计数，
+    只追加表的两者都不变说明写入发生在别的表上，沿用旧指纹，否则重新统计行数。
+    注意：数据库只读、无法建立删除/修改计数时，删除后复用rowid的插入和原地UPDATE无法通过指纹发现，
+    写入方需要调用 invalidate()。
+    """
+
+    def __init__(self, db_path, max_lookups=DEFAULT_LOOKUP_CACHE_SIZE):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._snapshots = {}  # 查询键 -> (指纹, DataFrame)
+        self._lookups = OrderedDict()  # 单用户查询键 -> (指纹, 结果)，LRU淘汰
+        self.max_lookups = max_lookups
+        self._version_lock = threading.Lock()
+        self._version_conn = None  # 只用来读取 data_version 和指纹的长连接
+        self._data_version = None
+        self._fingerprints = {}  # 表名 -> 指纹
+        self._unverified = set()  # data_version变化后尚未重新校验的表
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, table, compute):
+        """返回表的当前指纹，compute(conn, table) 负责在需要时重新统计"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn = self._version_conn
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._unverified = set(self._fingerprints)
+            fingerprint = self._fingerprints.get(table)
+            if fingerprint is not None and table in self._unverified:
+                self._unverified.discard(table)
+                if table not in APPEND_ONLY_TABLES:
+                    fingerprint = None
+                else:
+                    max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+                    if (max_rowid, change_count(conn, table)) != fingerprint[1:]:
+                        fingerprint = None
+            if fingerprint is None:
+                fingerprint = compute(conn, table)
+                self._fingerprints[table] = fingerprint
+            return fingerprint
+
+    def get(self, key, fingerprint):
+        """指纹一致时返回快照，否则返回None"""
+        with self._lock:
+            cached = self._snapshots.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """返回 (指纹, DataFrame)，不校验是否过期，用于增量合并"""
+        with self._lock:
+            return self._snapshots.get(key)
+
+    def put(self, key, fingerprint, df):
+        with self._lock:
+            self._snapshots[key] = (fingerprint, df)
+
+    def get_lookup(self, key, fingerprint):
+        """读取单用户查询结果，指纹不一致视为未命中"""
+        with self._lock:
+            cached = self._lookups.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                self._lookups.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            return None
+
+    def put_lookup(self, key, fingerprint, value):
+        with self._lock:
+            self._lookups[key] = (fingerprint, value)
+            self._lookups.move_to_end(key)
+            while len(self._lookups) > self.max_lookups:
+                self._lookups.popitem(last=False)
+
+    def invalidate(self, table=None):
+        """丢弃快照；table为None时清空全部"""
+        with self._lock:
+            if table is None:
+                self._snapshots.clear()
+                self._lookups.clear()
+            else:
+                for key in [k for k in self._snapshots if k[0] == table]:
+                    del self._snapshots[key]
+                for key in [k for k in self._lookups if k[0] == table]:
+                    del self._lookups[key]
+        with self._version_lock:
+            if table is None:
+                self._fingerprints.clear()
+            else:
+                self._fingerprints.pop(table, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'snapshots': len(self._snapshots),
+                'lookups': len(self._lookups),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_snapshot_caches = {}
+_indexed_paths = set()
+
+
+def get_snapshot_cache(db_path):
+    """获取（或创建）某个数据库文件对应的全局快照缓存"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        cache = _snapshot_caches.get(key)
+        if cache is None:
+            cache = TableSnapshotCache(db_path)
+            _snapshot_caches[key] = cache
+        return cache
+
+
 class DatabaseManager:
-    def __init__(self, db_path='./data/financial_data.db'):
+    TABLES = ('users', 'products', 'user_behavior')
+
+    def __init__(self, db_path='./data/financial_data.db', use_pool=True, pool_size=DEFAULT_POOL_SIZE,
+                 use_cache=True, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
         self.db_path = db_path
-    
+        # 同一数据库文件的所有DatabaseManager共享一个连接池和快照缓存
+        self.pool = get_pool(db_path, pool_size) if use_pool else None
+        self.cache = get_snapshot_cache(db_path) if use_cache else None
+        # 列式快照目录（由 columnar_snapshot.export_snapshot 导出），为None时不使用
+        self.snapshot_dir = snapshot_dir
+        self._columnar = None
+        self._columnar_mtime = None
+        # 索引和删除/修改计数在初始化时创建（每个数据库文件每个进程只执行一次），不放在按用户查询的路径上
+        self.ensure_schema()
+
     def get_connection(self):
         """获取数据库连接"""
         return sqlite3.connect(self.db_path)
-    
-    def get_all_users(self):
-        """获取所有用户数据"""
+
+    @contextmanager
+    def connection(self):
+        """获取连接：连接池模式下借出长连接、用完归还，否则用完即关闭"""
+        if self.pool is not None:
+            conn = self.pool.acquire()
+            try:
+                yield conn
+            finally:
+                self.pool.release(conn)
+            return
         conn = self.get_connection()
-        users_df = pd.read_sql_query("SELECT * FROM users", conn)
-        conn.close()
-        return users_df
-    
-    def get_all_products(self):
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def pool_stats(self):
+        """连接池统计信息（未启用连接池时返回None）"""
+        return self.pool.stats() if self.pool is not None else None
+
+    def cache_stats(self):
+        """快照缓存统计信息（未启用缓存时返回None）"""
+        return self.cache.stats() if self.cache is not None else None
+
+    def _fingerprint(self, conn, table):
+        """计算表指纹：(行数, 最大rowid, 删除/修改计数)"""
+        if table not in self.TABLES:
+            raise ValueError(f"未知的数据表: {table}")
+        count, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone()
+        return count, max_rowid, change_count(conn, table)
+
+    def table_version(self, table, conn=None):
+        """返回表的当前版本指纹，数据库没有新的写入时不再查询"""
+        # 非连接池模式可能用于fork出的子进程，不使用进程内共享的长连接
+        if self.cache is None or self.pool is None:
+            if conn is None:
+                with self.connection() as conn:
+                    return self._fingerprint(conn, table)
+            return self._fingerprint(conn, table)
+        return self.cache.fingerprint(table, self._fingerprint)
+
+    def invalidate(self, table=None):
+        """手动丢弃快照（用于没有删除/修改计数时指纹检测不到的写入）"""
+        if self.cache is not None:
+            self.cache.invalidate(table)
+
+    def _read_table(self, table, query, compact=False, with_version=False):
+        """读取整表，优先返回未过期的内存快照
+
+        with_version 为True时返回 (DataFrame, 指纹)，指纹与返回的行严格对应（读取按指纹中的最大rowid截断）。
+        """
+        with self.connection() as conn:
+            fingerprint = self.table_version(table, conn)
+            if self.cache is None:
+                df = self._query_frame(conn, table, f"{query} WHERE rowid <= ? ORDER BY rowid", compact,
+                                       params=(fingerprint[1] or 0,))
+                return (df, fingerprint) if with_version else df
+            key = (table, query, compact)
+            df = self.cache.get(key, fingerprint)
+            if df is None:
+                stale = self.cache.peek(key)
+                if table in APPEND_ONLY_TABLES and stale is not None and self._is_append(stale[0], fingerprint):
+                    # 只追加了新行：读取两个水位线之间的增量并合并到旧快照
+                    delta = self._query_frame(conn, table, f"{query} WHERE rowid > ? AND rowid <= ? ORDER BY rowid", compact,
+                                              params=(stale[0][1], fingerprint[1]))
+                    if compact:
+                        # 新旧批次的分类取值可能不同，合并时统一类型
+                        df = self.concat_compact(table, [stale[1].copy(deep=False), delta])
+                    else:
+                        df = pd.concat([stale[1], delta], ignore_index=True)
+                else:
+                    # 按指纹中的最大rowid截断，保证快照内容与记录的指纹一致；
+                    # 显式按rowid排序，避免查询走覆盖索引后行顺序改变
+                    df = self._query_frame(conn, table, f"{query} WHERE rowid <= ? ORDER BY rowid", compact,
+                                           params=(fingerprint[1] or 0,))
+                self.cache.put(key, fingerprint, df)
+        # 浅拷贝：调用方新增列不会影响缓存中的快照
+        return (df.copy(deep=False), fingerprint) if with_version else df.copy(deep=False)
+
+    @staticmethod
+    def _is_append(old_fingerprint, new_fingerprint):
+        """判断两次指纹之间是否只发生了追加（没有删除或修改，新增行数等于rowid增量）"""
+        old_count, old_max = old_fingerprint[0], old_fingerprint[1] or 0
+        new_count, new_max = new_fingerprint[0], new_fingerprint[1] or 0
+        return (new_max > old_max and new_count - old_count == new_max - old_max
+                and tuple(old_fingerprint[2:]) == tuple(new_fingerprint[2:]))
+
+    def _query_frame(self, conn, table, query, compact, params=None):
+        """执行查询，compact为True时分批读取并逐批压缩列类型，不在内存中保留未压缩的整表"""
+        if not compact:
+            return pd.read_sql_query(query, conn, params=params)
+        chunks = [self.compact_frame(table, chunk)
+                  for chunk in pd.read_sql_query(query, conn, params=params, chunksize=DEFAULT_CHUNK_SIZE)]
+        return self.concat_compact(table, chunks)
+
+    @staticmethod
+    def compact_frame(table, df):
+        """按 COMPACT_SCHEMAS 压缩DataFrame的列类型
+
+        整数列只有取值范围放得下时才降位，否则保留原类型，避免静默溢出。
+        """
+        schema = COMPACT_SCHEMAS[table]
+        for col in df.columns:
+            dtype = schema.get(col)
+            if dtype is None or dtype in ('object', 'epoch'):
+                continue
+            if dtype.startswith('int'):
+                values = df[col]
+                if len(values) and values.notna().any():
+                    info = np.iinfo(dtype)
+                    if values.min() < info.min or values.max() > info.max:
+                        continue
+                if values.isna().any():
+                    # 含空值的整数列使用可空整数类型
+                    dtype = dtype.capitalize()
+            df[col] = df[col].astype(dtype)
+        return df
+
+    @classmethod
+    def concat_compact(cls, table, frames):
+        """合并逐批压缩过的DataFrame：分类列先统一取值集合，合并后仍为category"""
+        frames = list(frames)
+        if len(frames) == 1:
+            return frames[0]
+        for col in frames[0].columns:
+            if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+                categories = pd.Index(sorted(set().union(*(frame[col].cat.categories for frame in frames))))
+                for frame in frames:
+                    frame[col] = frame[col].cat.set_categories(categories)
+        # 各批次的整数列可能因取值范围或空值得到不同类型，合并后重新统一
+        return cls.compact_frame(table, pd.concat(frames, ignore_index=True))
+
+    def _select_exprs(self, table, columns=None, compact=False):
+        """生成投影列表达式，只读取需要的列"""
+        schema = COMPACT_SCHEMAS[table]
+        if columns is None:
+            columns = list(schema)
+        unknown = [col for col in columns if col not in schema]
+        if unknown:
+            raise ValueError(f"数据表 {table} 不存在列: {unknown}")
+        exprs = []
+        for col in columns:
+            if compact and schema[col] == 'epoch':
+                exprs.append(f"CAST(strftime('%s', {col}) AS INTEGER) AS {col}")
+            else:
+                exprs.append(col)
+        return exprs
+
+    def _select_sql(self, table, columns=None, compact=False):
+        """生成投影查询语句"""
+        return f"SELECT {', '.join(self._select_exprs(table, columns, compact))} FROM {table}"
+
+    def columnar_snapshot(self, table=None):
+        """返回当前的列式快照；指定table时，只有该表指纹与数据库一致才返回"""
+        if self.snapshot_dir is None:
+            return None
+        try:
+            mtime = os.stat(os.path.join(self.snapshot_dir, CURRENT_FILE)).st_mtime_ns
+        except OSError:
+            return None
+        # CURRENT 文件更新说明导出了新版本，重新打开
+        if mtime != self._columnar_mtime:
+            self._columnar = ColumnarSnapshot.open_current(self.snapshot_dir)
+            self._columnar_mtime = mtime
+        snapshot = self._columnar
+        if snapshot is None or table is None:
+            return snapshot
+        if not snapshot.has_table(table) or snapshot.fingerprints.get(table) != self.table_version(table):
+            return None
+        return snapshot
+
+    def load_table(self, table, columns=None, compact=True, with_version=False):
+        """按表结构加载数据：只读取需要的列，并把ID/评分降位、文本列转为category、时间戳转为Unix秒
+
+        存在与数据库一致的列式快照时，直接返回基于mmap的DataFrame；
+        只追加的表在快照导出后又有新行时，以快照为基础只读取快照水位线之后的增量。
+        with_version 为True时返回 (DataFrame, 指纹)，指纹描述的正是返回的这些行，
+        调用方应以它（而不是另外查询的版本）作为数据版本和水位线。
+        """
+        if table not in COMPACT_SCHEMAS:
+            raise ValueError(f"未知的数据表: {table}")
+        query = self._select_sql(table, columns, compact)
+        if compact:
+            snapshot = self.columnar_snapshot()
+            if snapshot is not None and snapshot.has_table(table):
+                snapshot_version = snapshot.fingerprints.get(table)
+                version = self.table_version(table)
+                if snapshot_version == version:
+                    df = snapshot.table(table, columns)
+                    return (df, snapshot_version) if with_version else df
+                if (self.cache is not None and table in APPEND_ONLY_TABLES and snapshot_version is not None
+                        and self._is_append(snapshot_version, version)):
+                    stale = self.cache.peek((table, query, compact))
+                    if stale is None or self._is_append(stale[0], snapshot_version):
+                        # 用快照作为过期的内存快照，_read_table 只会读取并合并之后追加的行
+                        self.cache.put((table, query, compact), snapshot_version, snapshot.table(table, columns))
+        return self._read_table(table, query, compact, with_version)
+
+    def get_all_users(self, columns=None, compact=False):
+        """获取所有用户数据"""
+        if columns is None and not compact:
+            return self._read_table('users', "SELECT * FROM users")
+        return self.load_table('users', columns, compact)
+
+    def get_all_products(self, columns=None, compact=False):
         """获取所有产品数据"""
-        conn = self.get_connection()
-        products_df = pd.read_sql_query("SELECT * FROM products", conn)
-        conn.close()
-        return products_df
-    
-    def get_user_behavior(self):
+        if columns is None and not compact:
+            return self._read_table('products', "SELECT * FROM products")
+        return self.load_table('products', columns, compact)
+
+    def get_user_behavior(self, columns=None, compact=False):
         """获取用户行为数据"""
-        conn = self.get_connection()
-        behavior_df = pd.read_sql_query("SELECT * FROM user_behavior", conn)
-        conn.close()
-        return behavior_df
-    
+        if columns is None and not compact:
+            return self._read_table('user_behavior', "SELECT * FROM user_behavior")
+        return self.load_table('user_behavior', columns, compact)
+
+    def iter_user_behavior(self, chunksize=DEFAULT_CHUNK_SIZE, columns=None, where=None, params=(),
+                           compact=True, as_numpy=False, start_rowid=0):
+        """按rowid顺序分批读取用户行为，避免一次性把整张表读入内存
+
+        where 为附加的SQL过滤条件（可使用 ? 占位符，对应 params），
+        as_numpy 为True时每批返回NumPy记录数组，否则返回DataFrame。
+        使用 rowid > 上一批最大rowid 的方式翻页，每批查询都走主键。
+        """
+        exprs = self._select_exprs('user_behavior', columns, compact)
+        query = f"SELECT rowid AS _rowid, {', '.join(exprs)} FROM user_behavior WHERE rowid > ?"
+        if where:
+            query += f" AND ({where})"
+        query += " ORDER BY rowid LIMIT ?"
+
+        last_rowid = start_rowid
+        while True:
+            with self.connection() as conn:
+                chunk = pd.read_sql_query(query, conn, params=(last_rowid, *params, chunksize))
+            if chunk.empty:
+                return
+            last_rowid = int(chunk['_rowid'].iloc[-1])
+            chunk = chunk.drop(columns='_rowid')
+            if compact:
+                chunk = self.compact_frame('user_behavior', chunk)
+            yield chunk.to_records(index=False) if as_numpy else chunk
+            if len(chunk) < chunksize:
+                return
+
+    def behavior_watermark(self):
+        """行为表当前的水位线（最大rowid）
+
+        行为表只追加，rowid单调递增；时间戳可能补录乱序，因此用rowid做水位线。
+        """
+        with self.connection() as conn:
+            return conn.execute("SELECT MAX(rowid) FROM user_behavior").fetchone()[0] or 0
+
+    def get_new_behavior(self, since=0, columns=None, compact=True, chunksize=DEFAULT_CHUNK_SIZE):
+        """读取水位线之后新增的行为记录，返回 (新增记录DataFrame, 新水位线)
+
+        调用方保存返回的水位线，下次传入 since 即可只处理增量数据。
+        """
+        watermark = max(self.behavior_watermark(), since)
+        chunks = list(self.iter_user_behavior(chunksize=chunksize, columns=columns, where="rowid <= ?",
+                                              params=(watermark,), compact=compact, start_rowid=since))
+        if not chunks:
+            return pd.DataFrame(columns=columns or list(COMPACT_SCHEMAS['user_behavior'])), watermark
+        if compact:
+            return self.concat_compact('user_behavior', chunks), watermark
+        return (pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]), watermark
+
     def get_user_by_id(self, user_id):
         """根据ID获取特定用户"""
-        conn = self.get_connection()
-        user_df = pd.read_sql_query(f"SELECT * FROM users WHERE user_id = {user_id}", conn)
-        conn.close()
-        return user_df
-    
+        with self.connection() as conn:
+            return pd.read_sql_query("SELECT * FROM users WHERE user_id = ?", conn, params=(int(user_id),))
+
     def get_product_by_id(self, product_id):
         """根据ID获取特定产品"""
-        conn = self.get_connection()
-        product_df = pd.read_sql_query(f"SELECT * FROM products WHERE product_id = {product_id}", conn)
-        conn.close()
-        return product_df
+        with self.connection() as conn:
+            return pd.read_sql_query("SELECT * FROM products WHERE product_id = ?", conn,
+                                     params=(int(product_id),))
+
+    def ensure_schema(self):
+        """创建按用户/产品查询行为所需的索引和删除/修改计数触发器（已存在则跳过）"""
+        key = os.path.abspath(self.db_path)
+        if key in _indexed_paths:
+            return
+        with self.connection() as conn:
+            try:
+                for statement in INDEX_STATEMENTS + CHANGE_TRACKING_STATEMENTS:
+                    conn.execute(statement)
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                # 只读数据库无法建索引和触发器，查询仍然可用，只是会退化为全表扫描，
+                # 删除/修改需要写入方调用 invalidate()
+                print(f"创建索引或触发器失败: {e}")
+        _indexed_paths.add(key)
+
+    def _lookup_user(self, kind, user_id, load):
+        """按用户查询行为，结果按行为表版本缓存"""
+        user_id = int(user_id)
+        with self.connection() as conn:
+            if self.cache is None:
+                return load(conn, user_id)
+            key = ('user_behavior', kind, user_id)
+            fingerprint = self.table_version('user_behavior', conn)
+            value = self.cache.get_lookup(key, fingerprint)
+            if value is None:
+                value = load(conn, user_id)
+                self.cache.put_lookup(key, fingerprint, value)
+            return value
+
+    def get_user_purchases(self, user_id):
+        """获取单个用户购买过的产品ID列表（走 user_id, behavior_type 索引）"""
+        # SQL文本固定、参数绑定，sqlite3会在长连接上复用预编译语句
+        def load(conn, uid):
+            rows = conn.execute(
+                "SELECT product_id FROM user_behavior WHERE user_id = ? AND behavior_type = 'purchase'",
+                (uid,)
+            ).fetchall()
+            return [row[0] for row in rows]
+
+        return list(self._lookup_user('purchases', user_id, load))
+
+    def get_user_events(self, user_id):
+        """获取单个用户的全部行为记录"""
+        def load(conn, uid):
+            return pd.read_sql_query("SELECT * FROM user_behavior WHERE user_id = ?", conn, params=(uid,))
+
+        return self._lookup_user('events', user_id, load).copy(deep=False)
 
 # 测试数据库连接
 if __name__ == "__main__":
@@ -50,4 +693,8 @@ if __name__ == "__main__":
     print("用户数据样例:")
     print(db.get_all_users().head())
     print("\n产品数据样例:")
-    print(db.get_all_products().head())
\ No newline at end of file
+    print(db.get_all_products().head())
+    print("\n连接池统计:")
+    print(db.pool_stats())
+    print("\n快照缓存统计:")
+    print(db.cache_stats())
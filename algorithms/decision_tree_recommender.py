@@ -13,16 +13,18 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from config.config import Config
 try:
-    from .database_utils import DatabaseManager
+    from .database_utils import DatabaseManager, DEFAULT_CHUNK_SIZE
 except ImportError:
-    from database_utils import DatabaseManager
+    from database_utils import DatabaseManager, DEFAULT_CHUNK_SIZE
 
 class DecisionTreeRecommender:
-    def __init__(self, min_samples_for_training=10):
+    def __init__(self, min_samples_for_training=10, chunksize=DEFAULT_CHUNK_SIZE):
         self.db = DatabaseManager()
         self.model = None
         self.label_encoders = {}
         self.min_samples_for_training = min_samples_for_training
+        # 训练时按批读取购买记录的行数
+        self.chunksize = chunksize
     
     def prepare_training_data(self):
         """准备训练数据：用户特征 -> 购买偏好"""
@@ -59,21 +61,49 @@ class DecisionTreeRecommender:
         try:
             print("开始训练决策树模型")
             
-            # 从数据库获取数据
-            behavior_df = self.db.get_user_behavior()
-            users_df = self.db.get_all_users()
-            
-            # 只选择有购买行为的记录
-            purchases_df = behavior_df[behavior_df['behavior_type'] == 'purchase']
+            # 参与训练的购买记录截止到当前指纹中的最大rowid，先按记录条数做行级的训练/测试划分，
+            # 与对逐条购买记录调用 train_test_split 的划分完全相同
+            max_rowid = self.db.table_version('user_behavior')[1] or 0
+            with self.db.connection() as conn:
+                total_purchases = conn.execute(
+                    "SELECT COUNT(*) FROM user_behavior WHERE behavior_type = 'purchase' AND rowid <= ?",
+                    (max_rowid,)
+                ).fetchone()[0]
             
-            if len(purchases_df) < self.min_samples_for_training:
-                print(f"数据不足，当前购买记录数: {len(purchases_df)}, 最少需要: {self.min_samples_for_training}")
+            if total_purchases < self.min_samples_for_training:
+                print(f"数据不足，当前购买记录数: {total_purchases}, 最少需要: {self.min_samples_for_training}")
                 return None
             
-            # 合并数据以获取用户特征和产品类型
-            merged_df = pd.merge(purchases_df, users_df, on='user_id', how='left')
-            merged_df = pd.merge(merged_df, self.db.get_all_products()[['product_id', 'product_type']], 
-                                on='product_id', how='left')
+            is_test = np.zeros(total_purchases, dtype=bool)
+            is_test[train_test_split(np.arange(total_purchases), test_size=0.2, random_state=42)[1]] = True
+            
+            # 从数据库获取数据：只流式读取购买记录，浏览记录不进入内存；
+            # 每批到达后立即按划分汇总为 (用户, 产品类型) 的购买次数，不保留原始记录
+            product_types = (self.db.get_all_products().drop_duplicates('product_id')
+                             .set_index('product_id')['product_type'])
+            purchase_counts = None
+            offset = 0
+            for chunk in self.db.iter_user_behavior(
+                chunksize=self.chunksize,
+                columns=['user_id', 'product_id'],
+                where="behavior_type = 'purchase' AND rowid <= ?",
+                params=(max_rowid,)
+            ):
+                chunk_counts = (chunk.assign(product_type=chunk['product_id'].map(product_types),
+                                             is_test=is_test[offset:offset + len(chunk)])
+                                .groupby(['is_test', 'user_id', 'product_type']).size())
+                offset += len(chunk)
+                purchase_counts = (chunk_counts if purchase_counts is None
+                                   else purchase_counts.add(chunk_counts, fill_value=0))
+            users_df = self.db.get_all_users()
+            
+            if purchase_counts is None:
+                purchase_counts = pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays(
+                    [[], [], []], names=['is_test', 'user_id', 'product_type']))
+            purchase_counts = purchase_counts.astype('int64').rename('purchase_count').reset_index()
+            
+            # 合并用户特征；同一划分中同一用户对同一产品类型的多次购买是完全相同的样本，用购买次数作为样本权重
+            merged_df = pd.merge(purchase_counts, users_df, on='user_id', how='left')
             
             # 检查是否有足够的产品类型用于分类
             preferred_types = merged_df['product_type'].value_counts()
@@ -94,6 +124,8 @@ class DecisionTreeRecommender:
             # 准备特征和标签
             X = merged_df[feature_columns]
             y = merged_df['product_type']
+            weights = merged_df['purchase_count']
+            test_mask = merged_df['is_test'].to_numpy(dtype=bool)
             
             # 对分类特征进行编码
             categorical_columns = ['income_level', 'risk_tolerance']
@@ -104,13 +136,15 @@ class DecisionTreeRecommender:
                     self.label_encoders[col] = le
             
             # 训练模型
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+            X_train, X_test = X[~test_mask], X[test_mask]
+            y_train, y_test = y[~test_mask], y[test_mask]
+            w_train, w_test = weights[~test_mask], weights[test_mask]
             self.model = DecisionTreeClassifier(random_state=42, max_depth=10)
-            self.model.fit(X_train, y_train)
+            self.model.fit(X_train, y_train, sample_weight=w_train)
             
             # 评估模型
-            train_score = self.model.score(X_train, y_train)
-            test_score = self.model.score(X_test, y_test)
+            train_score = self.model.score(X_train, y_train, sample_weight=w_train)
+            test_score = self.model.score(X_test, y_test, sample_weight=w_test)
             
             print(f"模型训练完成！训练集准确率: {train_score:.3f}, 测试集准确率: {test_score:.3f}")
             
@@ -123,7 +157,7 @@ class DecisionTreeRecommender:
                 feature_importances[col] = float(self.model.feature_importances_[i])
             
             summary = {
-                'samples': len(purchases_df),
+                'samples': total_purchases,
                 'preferred_type_count': len(preferred_types),
                 'feature_importances': feature_importances,
                 'train_accuracy': train_score,
@@ -193,7 +227,7 @@ class DecisionTreeRecommender:
         
         return X_input[self.feature_columns]
     
-    def recommend_for_profile(self, user_profile, top_n=5):
+    def recommend_for_profile(self, user_profile, top_n=5, exclude_product_ids=None):
         """基于用户画像进行推荐"""
         if self.model is None:
             print("模型未训练，请先训练模型")
@@ -214,6 +248,9 @@ class DecisionTreeRecommender:
             # 获取该类型下的产品
             products_df = self.db.get_all_products()
             type_products = products_df[products_df['product_type'] == predicted_type]
+            if exclude_product_ids:
+                # 排除用户已购买的产品
+                type_products = type_products[~type_products['product_id'].isin(exclude_product_ids)]
             
             # 按预期收益率排序
             type_products = type_products.sort_values('expected_return', ascending=False)
@@ -243,11 +280,7 @@ class DecisionTreeRecommender:
         
         user_data = user_df.iloc[0].to_dict()
         
-        behavior_df = self.db.get_user_behavior()
-        purchased_products = behavior_df[
-            (behavior_df['user_id'] == user_id) & 
-            (behavior_df['behavior_type'] == 'purchase')
-        ]['product_id'].tolist()
+        purchased_products = self.db.get_user_purchases(user_id)
         
         return self.recommend_for_profile(
             user_data,
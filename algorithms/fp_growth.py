@@ -0,0 +1,231 @@
+# fp_growth.py
+# FP-Growth频繁项集挖掘与关联规则生成
+# 事务先压缩进FP树（共享前缀的事务共用节点），之后只在树上递归挖掘，不再扫描原始事务
+import math
+from itertools import combinations
+
+
+class FPNode:
+    """FP树节点：同一前缀路径上的事务共用一个节点，count为经过该节点的事务数"""
+    __slots__ = ('item', 'count', 'parent', 'children', 'link')
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = {}
+        # 指向树中下一个相同项的节点，构成项头表的链表
+        self.link = None
+
+
+class FPTree:
+    """FP树：事务中的项按全局频数降序插入，项头表记录每个项的总频数和节点链表"""
+
+    def __init__(self, weighted_transactions, min_count):
+        # 统计各项频数，只保留频繁项
+        counts = {}
+        for items, weight in weighted_transactions:
+            for item in items:
+                counts[item] = counts.get(item, 0) + weight
+        self.counts = {item: count for item, count in counts.items() if count >= min_count}
+        # 频数降序，相同时按项排序，保证插入顺序确定
+        self.rank = {item: i for i, item in enumerate(
+            sorted(self.counts, key=lambda item: (-self.counts[item], item)))}
+        self.root = FPNode(None, None)
+        self.heads = {}
+        self._tails = {}
+        for items, weight in weighted_transactions:
+            path = sorted((item for item in items if item in self.rank), key=self.rank.__getitem__)
+            if path:
+                self._insert(path, weight)
+
+    def _insert(self, path, weight):
+        node = self.root
+        for item in path:
+            child = node.children.get(item)
+            if child is None:
+                child = FPNode(item, node)
+                node.children[item] = child
+                if item in self._tails:
+                    self._tails[item].link = child
+                else:
+                    self.heads[item] = child
+                self._tails[item] = child
+            child.count += weight
+            node = child
+
+    def prefix_paths(self, item):
+        """返回某项的条件模式基：[(前缀路径上的项, 该路径的次数), ...]"""
+        paths = []
+        node = self.heads.get(item)
+        while node is not None:
+            path = []
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                paths.append((path, node.count))
+            node = node.link
+        return paths
+
+    def single_path(self):
+        """树只有一条路径时返回该路径上的 [(项, 次数), ...]，否则返回None"""
+        path = []
+        node = self.root
+        while node.children:
+            if len(node.children) > 1:
+                return None
+            node = next(iter(node.children.values()))
+            path.append((node.item, node.count))
+        return path
+
+
+def fp_growth(transactions, min_support, max_len=None):
+    """挖掘频繁项集，返回 {frozenset(项集): 支持度}
+
+    transactions 为事务列表（每个事务是项的可迭代对象，重复项只计一次）；
+    min_support 为最小支持度（比例）；max_len 限制项集的最大长度。
+    """
+    transactions = [frozenset(t) for t in transactions]
+    num_transactions = len(transactions)
+    if num_transactions == 0:
+        return {}
+    min_count = max(1, math.ceil(min_support * num_transactions - 1e-9))
+
+    # 相同的事务合并为一条带权事务，减少建树时的插入次数
+    weights = {}
+    for t in transactions:
+        if t:
+            weights[t] = weights.get(t, 0) + 1
+    tree = FPTree(list(weights.items()), min_count)
+
+    counts = {}
+    _mine(tree, (), min_count, max_len, counts)
+    return {itemset: count / num_transactions for itemset, count in counts.items()}
+
+
+def _mine(tree, suffix, min_count, max_len, counts):
+    """在(条件)FP树上递归挖掘以 suffix 结尾的频繁项集，结果写入 counts（绝对次数）"""
+    path = tree.single_path()
+    if path is not None:
+        # 单路径树：路径上项的任意组合都是频繁项集，支持数为组合中最深节点的次数
+        limit = len(path) if max_len is None else max_len - len(suffix)
+        for size in range(1, min(limit, len(path)) + 1):
+            for combo in combinations(path, size):
+                counts[frozenset(suffix + tuple(item for item, _ in combo))] = min(c for _, c in combo)
+        return
+
+    # 从频数最低的项开始，逐个构建条件FP树
+    for item in sorted(tree.counts, key=tree.rank.__getitem__, reverse=True):
+        itemset = suffix + (item,)
+        counts[frozenset(itemset)] = tree.counts[item]
+        if max_len is not None and len(itemset) >= max_len:
+            continue
+        conditional = FPTree(tree.prefix_paths(item), min_count)
+        if conditional.counts:
+            _mine(conditional, itemset, min_count, max_len, counts)
+
+
+def negative_border(frequent_itemsets, items, max_len=None):
+    """频繁项集的负边界：自身不频繁、但所有真子集都频繁的项集（包括不频繁的单个项）
+
+    增量维护时只要负边界中没有项集变为频繁、频繁项集也没有跌出阈值，频繁项集的集合就不会改变。
+    """
+    frequent = set(frequent_itemsets)
+    border = {frozenset([item]) for item in items} - frequent
+    # 与Apriori的候选生成相同：共享前k-1项的两个频繁k项集合并为一个k+1项集
+    by_prefix = {}
+    for itemset in frequent:
+        if max_len is not None and len(itemset) >= max_len:
+            continue
+        ordered = tuple(sorted(itemset))
+        by_prefix.setdefault(ordered[:-1], []).append(ordered[-1])
+    for prefix, lasts in by_prefix.items():
+        lasts.sort()
+        for i, first in enumerate(lasts):
+            for second in lasts[i + 1:]:
+                candidate = frozenset(prefix + (first, second))
+                # 去掉first或second的子集就是参与合并的两个频繁项集，只需检查去掉前缀中各项的子集
+                if candidate not in frequent and all(candidate - {item} in frequent for item in prefix):
+                    border.add(candidate)
+    return border
+
+
+def _subsets_frequent(itemset, frequent):
+    """项集去掉任意一项后的子集是否都频繁（单项集视为满足）"""
+    return len(itemset) == 1 or all(itemset - {item} in frequent for item in itemset)
+
+
+def update_border(frequent_counts, border_counts, min_count, count_itemsets, max_len=None):
+    """在支持数更新后重新划分频繁项集和负边界（FUP）
+
+    frequent_counts/border_counts 为更新后的支持数，min_count 为新的最小支持数；
+    count_itemsets(项集列表) 返回这些项集在全量数据上的支持数，只在有负边界项集变为频繁、
+    需要统计新候选（此前未跟踪的超集）时才调用。
+    返回 (频繁项集支持数, 负边界支持数, 是否扫描了全量数据)。
+    """
+    counts = dict(frequent_counts)
+    counts.update(border_counts)
+    # 子集的支持数不小于超集，跌出阈值的频繁项集的超集也一定跌出，过滤后仍满足向下封闭
+    frequent = {itemset for itemset, count in counts.items() if count >= min_count}
+    promoted = [itemset for itemset in frequent if itemset not in frequent_counts]
+    scanned = False
+    while promoted:
+        # 新候选至少有一个刚变为频繁的直接子集，因此只需在新频繁项集上各加一个频繁项
+        frequent_items = {item for itemset in frequent if len(itemset) == 1 for item in itemset}
+        candidates = set()
+        for itemset in promoted:
+            if max_len is not None and len(itemset) >= max_len:
+                continue
+            for item in frequent_items - itemset:
+                candidate = itemset | {item}
+                if candidate not in counts and _subsets_frequent(candidate, frequent):
+                    candidates.add(candidate)
+        if not candidates:
+            break
+        candidates = list(candidates)
+        scanned = True
+        promoted = []
+        for candidate, count in zip(candidates, count_itemsets(candidates)):
+            counts[candidate] = count
+            if count >= min_count:
+                frequent.add(candidate)
+                promoted.append(candidate)
+    frequent_counts = {itemset: counts[itemset] for itemset in frequent}
+    border_counts = {itemset: count for itemset, count in counts.items()
+                     if itemset not in frequent and _subsets_frequent(itemset, frequent)}
+    return frequent_counts, border_counts, scanned
+
+
+def association_rules(frequent_itemsets, min_confidence=0.5, min_lift=None):
+    """由频繁项集生成关联规则
+
+    返回按置信度、提升度降序排列的规则列表，每条规则为
+    {'antecedent', 'consequent', 'support', 'confidence', 'lift'}，前件/后件为frozenset。
+    频繁项集的所有子集也是频繁的，因此前件和后件的支持度都可以直接查表。
+    """
+    rules = []
+    for itemset, support in frequent_itemsets.items():
+        if len(itemset) < 2:
+            continue
+        for size in range(1, len(itemset)):
+            for antecedent in combinations(sorted(itemset), size):
+                antecedent = frozenset(antecedent)
+                consequent = itemset - antecedent
+                confidence = support / frequent_itemsets[antecedent]
+                if confidence < min_confidence:
+                    continue
+                lift = confidence / frequent_itemsets[consequent]
+                if min_lift is not None and lift < min_lift:
+                    continue
+                rules.append({
+                    'antecedent': antecedent,
+                    'consequent': consequent,
+                    'support': support,
+                    'confidence': confidence,
+                    'lift': lift,
+                })
+    rules.sort(key=lambda rule: (-rule['confidence'], -rule['lift'], sorted(rule['antecedent']),
+                                 sorted(rule['consequent'])))
+    return rules
@@ -0,0 +1,52 @@
+# model_refresh.py
+# 推荐模型的公共生命周期：首次使用时同步训练，之后行为数据变化时在后台线程更新，期间继续使用旧模型
+import threading
+
+
+class BackgroundRefreshModel:
+    """基于用户行为训练的模型的生命周期
+
+    子类实现 fit()，把训练结果整体赋给 self.model（其中 'version' 为训练时行为表的版本指纹）；
+    能增量更新的子类覆盖 _update_model()。
+    """
+
+    def __init__(self, db, auto_refit=True):
+        self.db = db
+        # 数据变化后是否在后台线程更新模型（期间继续使用旧模型）
+        self.auto_refit = auto_refit
+        self.model = None
+        self._fit_lock = threading.Lock()
+        self._refit_thread = None
+
+    def fit(self):
+        raise NotImplementedError
+
+    def _update_model(self):
+        """数据变化后更新模型，默认重新训练"""
+        self.fit()
+
+    def _refit(self):
+        """后台线程中更新模型"""
+        try:
+            with self._fit_lock:
+                self._update_model()
+        except Exception as e:
+            print(f"{type(self).__name__} 模型后台训练失败: {e}")
+
+    def _start_refit(self):
+        """启动后台训练线程（已有训练在进行时不重复启动）"""
+        if self._refit_thread is None or not self._refit_thread.is_alive():
+            self._refit_thread = threading.Thread(target=self._refit, daemon=True)
+            self._refit_thread.start()
+
+    def ensure_model(self):
+        """返回可用的模型：首次使用时同步训练；数据变化时在后台更新，先继续用旧模型"""
+        if self.model is None:
+            with self._fit_lock:
+                if self.model is None:
+                    self.fit()
+            return self.model
+
+        if self.auto_refit and self.db.table_version('user_behavior') != self.model['version']:
+            self._start_refit()
+        return self.model
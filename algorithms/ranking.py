@@ -0,0 +1,25 @@
+# ranking.py
+# 推荐结果的Top-N选择：协同过滤、ALS和基于内容的推荐共用同一套选取与并列规则
+import numpy as np
+
+# 排序前分数保留的小数位数：数学上相等的分数可能因浮点求和顺序不同有极小差异，
+# 舍入后按并列处理（下标小的在前），保证不同计算路径得到相同的推荐顺序
+SCORE_DECIMALS = 9
+
+
+def select_top_n(scores, candidates, top_n, decimals=SCORE_DECIMALS):
+    """从候选（布尔掩码）中选出得分最高的top_n个下标（分数相同时下标小的在前）
+
+    只对候选的分数转换为float64后舍入，float32的分数舍入后不会把不同的值并为一档。
+    """
+    idx = np.flatnonzero(candidates)
+    if top_n <= 0 or len(idx) == 0:
+        return idx[:0]
+    values = np.round(np.asarray(scores)[idx].astype(np.float64), decimals)
+    if len(idx) > top_n:
+        # argpartition 找到第top_n大的分数，保留所有不低于它的候选（含并列），只对这部分排序
+        kth = values[np.argpartition(-values, top_n - 1)[top_n - 1]]
+        keep = values >= kth
+        idx, values = idx[keep], values[keep]
+    order = np.lexsort((idx, -values))
+    return idx[order][:top_n]
@@ -0,0 +1,156 @@
+# rule_store.py
+# 关联规则表：离线挖掘出的规则写入SQLite并按前件建索引，
+# 在线推荐只按用户已购产品的组合查表，耗时与总交易数无关
+import json
+import time
+from itertools import combinations
+
+RULES_TABLE = 'association_rules'
+ITEM_SUPPORT_TABLE = 'association_item_support'
+META_TABLE = 'association_rules_meta'
+# 增量维护的持久状态：频繁项集及其负边界的支持数
+ITEMSET_COUNTS_TABLE = 'association_itemset_counts'
+
+SCHEMA_STATEMENTS = [
+    f"""CREATE TABLE IF NOT EXISTS {RULES_TABLE} (
+        antecedent TEXT NOT NULL,
+        antecedent_size INTEGER NOT NULL,
+        consequent TEXT NOT NULL,
+        support REAL NOT NULL,
+        confidence REAL NOT NULL,
+        lift REAL NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_{RULES_TABLE}_antecedent ON {RULES_TABLE} (antecedent)",
+    f"""CREATE TABLE IF NOT EXISTS {ITEM_SUPPORT_TABLE} (
+        product_id INTEGER PRIMARY KEY,
+        support REAL NOT NULL
+    )""",
+    f"CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    f"""CREATE TABLE IF NOT EXISTS {ITEMSET_COUNTS_TABLE} (
+        itemset TEXT PRIMARY KEY,
+        support_count INTEGER NOT NULL,
+        frequent INTEGER NOT NULL
+    )""",
+]
+
+# 单条 IN (...) 查询的最大参数个数，低于SQLite的变量数上限
+LOOKUP_BATCH_SIZE = 500
+
+
+def itemset_key(items):
+    """项集的规范化键：产品ID升序后用逗号连接"""
+    return ','.join(str(item) for item in sorted(items))
+
+
+def parse_itemset(key):
+    return frozenset(int(item) for item in key.split(','))
+
+
+class RuleStore:
+    """SQLite中的关联规则表，规则按前件的规范化键建索引"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def exists(self):
+        """规则表是否已经构建过"""
+        return self.meta() is not None
+
+    def meta(self):
+        """返回构建信息（行为表版本、事务数、最大前件长度等），未构建时返回None"""
+        with self.db.connection() as conn:
+            found = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (META_TABLE,)).fetchone()
+            if found is None:
+                return None
+            rows = conn.execute(f"SELECT key, value FROM {META_TABLE}").fetchall()
+        return {key: json.loads(value) for key, value in rows} or None
+
+    def save(self, rules, item_support, meta, itemset_counts=None):
+        """整体替换规则表，在一个事务中完成，读者不会看到写了一半的表
+
+        itemset_counts 为 (频繁项集支持数, 负边界支持数) 两个字典，保存后可在重启后继续增量维护。
+        """
+        start = time.time()
+        meta = dict(meta, built_at=time.strftime('%Y-%m-%d %H:%M:%S'),
+                    max_antecedent_size=max((len(rule['antecedent']) for rule in rules), default=0))
+        with self.db.connection() as conn:
+            try:
+                for statement in SCHEMA_STATEMENTS:
+                    conn.execute(statement)
+                conn.execute(f"DELETE FROM {RULES_TABLE}")
+                conn.execute(f"DELETE FROM {ITEM_SUPPORT_TABLE}")
+                conn.execute(f"DELETE FROM {META_TABLE}")
+                conn.execute(f"DELETE FROM {ITEMSET_COUNTS_TABLE}")
+                conn.executemany(
+                    f"INSERT INTO {RULES_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                    ((itemset_key(rule['antecedent']), len(rule['antecedent']), itemset_key(rule['consequent']),
+                      rule['support'], rule['confidence'], rule['lift']) for rule in rules))
+                conn.executemany(f"INSERT INTO {ITEM_SUPPORT_TABLE} VALUES (?, ?)",
+                                 ((int(item), float(support)) for item, support in item_support.items()))
+                conn.executemany(f"INSERT INTO {META_TABLE} VALUES (?, ?)",
+                                 ((key, json.dumps(value)) for key, value in meta.items()))
+                if itemset_counts is not None:
+                    conn.executemany(
+                        f"INSERT INTO {ITEMSET_COUNTS_TABLE} VALUES (?, ?, ?)",
+                        ((itemset_key(itemset), int(count), int(frequent))
+                         for frequent, counts in zip((1, 0), itemset_counts)
+                         for itemset, count in counts.items()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        print(f"关联规则表写入完成: {len(rules)} 条规则, 耗时 {time.time() - start:.2f}s")
+        return meta
+
+    def lookup(self, purchased, max_antecedent_size=None):
+        """查出前件被 purchased 覆盖的全部规则，返回规则字典列表
+
+        枚举已购产品的组合（长度不超过最大前件长度）作为键查索引，不扫描整张规则表。
+        """
+        if max_antecedent_size is None:
+            meta = self.meta() or {}
+            max_antecedent_size = meta.get('max_antecedent_size', 0)
+        keys = [itemset_key(antecedent)
+                for size in range(1, min(max_antecedent_size, len(purchased)) + 1)
+                for antecedent in combinations(sorted(purchased), size)]
+        rules = []
+        with self.db.connection() as conn:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                rows = conn.execute(
+                    f"SELECT antecedent, consequent, support, confidence, lift FROM {RULES_TABLE} "
+                    f"WHERE antecedent IN ({', '.join('?' * len(batch))})", batch).fetchall()
+                rules.extend({
+                    'antecedent': parse_itemset(antecedent),
+                    'consequent': parse_itemset(consequent),
+                    'support': support,
+                    'confidence': confidence,
+                    'lift': lift,
+                } for antecedent, consequent, support, confidence, lift in rows)
+        return rules
+
+    def popular_items(self, limit=None):
+        """按支持度降序返回 [(产品ID, 支持度), ...]"""
+        query = f"SELECT product_id, support FROM {ITEM_SUPPORT_TABLE} ORDER BY support DESC, product_id"
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (int(limit),)
+        with self.db.connection() as conn:
+            return [tuple(row) for row in conn.execute(query, params).fetchall()]
+
+    def load_itemset_counts(self):
+        """读取保存的 (频繁项集支持数, 负边界支持数)，没有保存过时返回None"""
+        with self.db.connection() as conn:
+            found = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (ITEMSET_COUNTS_TABLE,)).fetchone()
+            if found is None:
+                return None
+            rows = conn.execute(f"SELECT itemset, support_count, frequent FROM {ITEMSET_COUNTS_TABLE}").fetchall()
+        if not rows:
+            return None
+        frequent_counts, border_counts = {}, {}
+        for key, count, frequent in rows:
+            (frequent_counts if frequent else border_counts)[parse_itemset(key)] = count
+        return frequent_counts, border_counts
@@ -0,0 +1,122 @@
+# son_mining.py
+# SON两阶段分区挖掘：按用户ID区间把事务切成若干分区，在多个进程中并行挖掘
+# 阶段一：各分区以相同的支持度比例挖掘局部频繁项集，取并集作为候选
+#         （全局频繁的项集至少在一个分区中局部频繁，因此不会漏掉）；
+# 阶段二：各分区并行统计全部候选的精确支持数，汇总后按全局最小支持数过滤
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .database_utils import DatabaseManager
+    from .fp_growth import fp_growth
+    from .bitset_index import VerticalBitsets
+except ImportError:
+    from database_utils import DatabaseManager
+    from fp_growth import fp_growth
+    from bitset_index import VerticalBitsets
+
+# 流式读取每个分区时每批的行数
+DEFAULT_PARTITION_CHUNK_SIZE = 100000
+# 每个分区的局部最小支持数不低于该值。分区太小时局部最小支持数会降到1，
+# 每个事务的所有子集都成为候选，候选数量爆炸
+MIN_LOCAL_SUPPORT_COUNT = 5
+
+
+def _purchase_filter(max_rowid):
+    """购买记录的过滤条件及参数，max_rowid 给定时只保留该rowid（含）之前的记录"""
+    if max_rowid is None:
+        return "behavior_type = 'purchase'", ()
+    return "behavior_type = 'purchase' AND rowid <= ?", (max_rowid,)
+
+
+def partition_user_ranges(db, n_partitions, min_size=1, max_rowid=None):
+    """把有购买记录的用户按ID排序后均分，返回 [(起始用户ID, 结束用户ID), ...]（闭区间）
+
+    每个分区至少包含 min_size 个用户，用户不足时减少分区数。
+    """
+    where, params = _purchase_filter(max_rowid)
+    with db.connection() as conn:
+        rows = conn.execute(f"SELECT DISTINCT user_id FROM user_behavior "
+                            f"WHERE {where} ORDER BY user_id", params).fetchall()
+    user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    if len(user_ids) == 0:
+        return []
+    return [(int(part[0]), int(part[-1]))
+            for part in np.array_split(user_ids, max(1, min(n_partitions, len(user_ids) // min_size)))]
+
+
+def read_partition(db_path, user_range, chunksize=DEFAULT_PARTITION_CHUNK_SIZE, max_rowid=None):
+    """用分批读取器读取一个用户区间（max_rowid 给定时截止到该rowid）的购买记录，构建该分区的垂直位图
+
+    在子进程中执行：子进程由fork创建，会继承父进程连接池中已打开的SQLite连接，
+    而SQLite连接不能跨fork使用，因此这里不使用连接池，每批查询单独建立连接。
+    """
+    db = DatabaseManager(db_path, use_pool=False, use_cache=False)
+    where, params = _purchase_filter(max_rowid)
+    user_parts, product_parts = [], []
+    for chunk in db.iter_user_behavior(chunksize=chunksize, columns=['user_id', 'product_id'],
+                                       where=f"{where} AND user_id BETWEEN ? AND ?",
+                                       params=(*params, *user_range)):
+        user_parts.append(chunk['user_id'].to_numpy())
+        product_parts.append(chunk['product_id'].to_numpy())
+    if not user_parts:
+        return VerticalBitsets.from_pairs([], [], 0)
+    users, transaction_idx = np.unique(np.concatenate(user_parts), return_inverse=True)
+    return VerticalBitsets.from_pairs(transaction_idx, np.concatenate(product_parts), len(users))
+
+
+def _local_candidates(db_path, user_range, min_support, max_len, chunksize, max_rowid):
+    """阶段一（在子进程中执行）：挖掘分区内的局部频繁项集"""
+    bitsets = read_partition(db_path, user_range, chunksize, max_rowid)
+    local = fp_growth(bitsets.transactions(), min_support, max_len)
+    return set(local), bitsets.num_transactions
+
+
+def _count_candidates(db_path, user_range, candidates, chunksize, max_rowid):
+    """阶段二（在子进程中执行）：统计全部候选项集在分区内的支持数"""
+    bitsets = read_partition(db_path, user_range, chunksize, max_rowid)
+    return bitsets.support_counts(candidates)
+
+
+def son_frequent_itemsets(db_path, min_support, max_len=None, n_partitions=None, max_workers=None,
+                          chunksize=DEFAULT_PARTITION_CHUNK_SIZE, max_rowid=None):
+    """SON分区并行挖掘，返回与 fp_growth 相同格式的 {frozenset(项集): 支持度}
+
+    n_partitions 默认等于进程数，max_workers 默认等于CPU核数；
+    分区数会被限制在每个分区至少有 MIN_LOCAL_SUPPORT_COUNT / min_support 个事务。
+    max_rowid 给定时划分分区和两个阶段的读取都截止到该rowid，挖掘结果与同一水位线下的单次读取一致。
+    """
+    start = time.time()
+    max_workers = max_workers or os.cpu_count() or 1
+    n_partitions = n_partitions or max_workers
+    min_size = math.ceil(MIN_LOCAL_SUPPORT_COUNT / min_support) if min_support > 0 else 1
+    # 不从连接池取连接：紧接着就会fork子进程，避免在fork前新建池化连接
+    ranges = partition_user_ranges(DatabaseManager(db_path, use_pool=False, use_cache=False),
+                                   n_partitions, min_size, max_rowid)
+    if not ranges:
+        return {}
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+        phase_one = list(executor.map(_local_candidates, [db_path] * len(ranges), ranges,
+                                      [min_support] * len(ranges), [max_len] * len(ranges),
+                                      [chunksize] * len(ranges), [max_rowid] * len(ranges)))
+        candidates = sorted(set().union(*(local for local, _ in phase_one)), key=lambda s: (len(s), sorted(s)))
+        num_transactions = sum(n for _, n in phase_one)
+        phase_one_seconds = time.time() - start
+
+        counts = np.zeros(len(candidates), dtype=np.int64)
+        for partition_counts in executor.map(_count_candidates, [db_path] * len(ranges), ranges,
+                                             [candidates] * len(ranges), [chunksize] * len(ranges),
+                                             [max_rowid] * len(ranges)):
+            counts += np.asarray(partition_counts, dtype=np.int64)
+
+    min_count = max(1, math.ceil(min_support * num_transactions - 1e-9))
+    frequent = {itemset: int(count) / num_transactions
+                for itemset, count in zip(candidates, counts) if count >= min_count}
+    print(f"SON分区挖掘: {len(ranges)} 个分区, 候选 {len(candidates)} 个, 频繁 {len(frequent)} 个, "
+          f"阶段一 {phase_one_seconds:.2f}s, 总耗时 {time.time() - start:.2f}s")
+    return frequent
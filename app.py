@@ -14,6 +14,7 @@ from decision_tree_recommender import DecisionTreeRecommender
 from large_model_recommender import LargeModelRecommender
 from apriori_recommender import AprioriRecommender
 from collaborative_filtering import CollaborativeFiltering
+from als_recommender import ALSRecommender
 import numpy as np
 
 app = Flask(__name__)
@@ -24,13 +25,15 @@ content_recommender = ContentBasedRecommender()
 large_model_recommender = LargeModelRecommender()
 apriori_recommender = AprioriRecommender()
 collaborative_filtering = CollaborativeFiltering()
+als_recommender = ALSRecommender()
 
 profile_recommenders = {
     'decision_tree': ('决策树推荐', decision_tree_recommender),
     'content': ('基于内容推荐', content_recommender),
     'large_model': ('大模型推荐', large_model_recommender),
     'apriori': ('关联规则推荐', apriori_recommender),
-    'collaborative': ('协同过滤推荐', collaborative_filtering)
+    'collaborative': ('协同过滤推荐', collaborative_filtering),
+    'als': ('矩阵分解推荐', als_recommender)
 }
 
 model_trained = False
@@ -41,6 +44,14 @@ def index():
     """首页"""
     return render_template('index.html')
 
+@app.route('/db-stats')
+def db_stats():
+    """数据库连接池统计，用于压测时评估池大小"""
+    return jsonify({
+        'success': True,
+        'pool': collaborative_filtering.db.pool_stats()
+    })
+
 @app.route('/train-model', methods=['POST'])
 def train_model():
     """训练决策树模型"""
@@ -105,12 +116,12 @@ def run_recommender(algo_key, user_profile, top_n):
     if algo_key == 'large_model':
         result = recommender.recommend_with_advice(user_profile, top_n=top_n)
         return algo_name, serialize_recommendations(result['recommendations']), result.get('advice', '')
-    # 特殊处理关联规则推荐器和协同过滤推荐器
-    elif algo_key in ['apriori', 'collaborative']:
+    # 特殊处理关联规则、协同过滤和矩阵分解推荐器
+    elif algo_key in ['apriori', 'collaborative', 'als']:
         # 对于关联规则和协同过滤，需要用户ID，而不是用户画像
         # 使用默认用户ID或从用户画像中获取ID
         user_id = user_profile.get('user_id', 1)  # 默认使用用户ID 1
-        if algo_key == 'apriori':
+        if algo_key in ['apriori', 'als']:
             recommendations = recommender.recommend_for_user(user_id, top_n=top_n)
         else:  # collaborative
             recommendations = recommender.recommend_for_user(user_id, top_n=top_n, k=2)  # k参数只对协同过滤有效
@@ -0,0 +1,105 @@
+# ann_benchmark.py
+# 对比随机投影LSH近似近邻(algorithms/ann_index.py)与精确余弦相似度的召回率和查询延迟
+#
+# 用法: python benchmarks/ann_benchmark.py [用户规模 ...]
+# 默认测试 10000、100000、1000000 个合成用户，1000000 规模约需 2GB 内存
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'algorithms'))
+
+from ann_index import RandomProjectionLSH
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+NUM_PRODUCTS = 200
+NUM_SEGMENTS = 100
+RATINGS_PER_USER = (10, 30)
+NUM_QUERIES = 200
+K = 20
+# (n_tables, n_bits, n_probes)，n_bits 为 None 时按索引默认规则自动选择
+SETTINGS = [
+    (4, None, 1),
+    (8, None, 4),
+    (16, None, 8),
+    (32, None, 8),
+]
+
+
+def synthetic_ratings(num_users, seed=0):
+    """生成合成的用户-产品评分矩阵
+
+    用户分属若干偏好群体，每个群体集中偏好少数产品；用户80%的行为来自所属群体的偏好，
+    其余随机，评分为1-5。这样近邻关系和真实数据一样主要由偏好群体决定。
+    """
+    rng = np.random.default_rng(seed)
+    preferences = rng.dirichlet(np.full(NUM_PRODUCTS, 0.05), size=NUM_SEGMENTS)
+    cumulative = np.cumsum(preferences, axis=1)
+    cumulative[:, -1] = 1.0
+
+    segments = rng.integers(0, NUM_SEGMENTS, num_users)
+    counts = rng.integers(RATINGS_PER_USER[0], RATINGS_PER_USER[1] + 1, num_users)
+    rows = np.repeat(np.arange(num_users), counts)
+    entry_segments = segments[rows]
+    draws = rng.random(len(rows))
+    # 按所属群体的累积分布抽样：把各群体的累积分布平移到互不重叠的区间后一次 searchsorted
+    products = np.searchsorted((cumulative + np.arange(NUM_SEGMENTS)[:, None]).ravel(),
+                               draws + entry_segments) - entry_segments * NUM_PRODUCTS
+    random_entries = rng.random(len(rows)) < 0.2
+    products[random_entries] = rng.integers(0, NUM_PRODUCTS, random_entries.sum())
+    ratings = rng.integers(1, 6, len(rows)).astype(np.float64)
+
+    matrix = sparse.csr_matrix((ratings, (rows, np.minimum(products, NUM_PRODUCTS - 1))),
+                               shape=(num_users, NUM_PRODUCTS))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def exact_neighbours(normalized, row, k):
+    """精确计算：与全部用户做一次稀疏矩阵-向量乘法"""
+    similarities = (normalized @ normalized[row].T).toarray().ravel()
+    similarities[row] = -np.inf
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top, similarities[top]
+
+
+def run_scale(num_users):
+    start = time.perf_counter()
+    matrix = synthetic_ratings(num_users)
+    normalized = normalize(matrix, norm='l2', axis=1)
+    print(f"\n用户数 {num_users}: 评分 {matrix.nnz} 条, 生成耗时 {time.perf_counter() - start:.1f}s")
+
+    queries = np.random.default_rng(1).choice(num_users, NUM_QUERIES, replace=False)
+    exact = {}
+    start = time.perf_counter()
+    for row in queries:
+        exact[row] = exact_neighbours(normalized, row, K)
+    exact_latency = (time.perf_counter() - start) / NUM_QUERIES
+    print(f"{'方法':<24}{'建索引':>10}{'候选数':>10}{'Recall@' + str(K):>12}{'查询延迟':>12}")
+    print(f"{'精确(全量)':<24}{'-':>10}{num_users:>10}{1.0:>12.3f}{exact_latency * 1000:>10.2f}ms")
+
+    for n_tables, n_bits, n_probes in SETTINGS:
+        index = RandomProjectionLSH(n_tables=n_tables, n_bits=n_bits, n_probes=n_probes).fit(matrix)
+        recalls, candidate_counts = [], []
+        start = time.perf_counter()
+        for row in queries:
+            neighbours, similarities = index.query_row(row, K)
+            # 与第K个精确相似度并列的结果也算命中
+            kth = np.min(exact[row][1])
+            recalls.append(min(np.sum(similarities >= kth - 1e-12), K) / K)
+        latency = (time.perf_counter() - start) / NUM_QUERIES
+        for row in queries[:20]:
+            candidate_counts.append(len(index.candidates(index.vectors[row])))
+        name = f"LSH t={n_tables} b={index.n_bits_} p={n_probes}"
+        print(f"{name:<24}{index.build_seconds:>9.1f}s{int(np.mean(candidate_counts)):>10}"
+              f"{np.mean(recalls):>12.3f}{latency * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    scales = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SCALES
+    for scale in scales:
+        run_scale(scale)
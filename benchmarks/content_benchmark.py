@@ -0,0 +1,95 @@
+# content_benchmark.py
+# 基于内容推荐的单次请求延迟随产品目录规模的变化：
+# 逐个产品生成结果字典再全量排序（原实现） vs 掩码 + argpartition 取Top-N后只生成选中的结果
+#
+# 用法: python benchmarks/content_benchmark.py [产品数 ...]
+# 默认测试 1000、10000、100000、1000000 个合成产品；原实现在超过 LEGACY_MAX_PRODUCTS 时跳过
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'algorithms'))
+
+from content_based import ContentBasedRecommender
+from ranking import select_top_n
+
+DEFAULT_SCALES = [1000, 10000, 100000, 1000000]
+LEGACY_MAX_PRODUCTS = 100000
+PRODUCT_TYPES = ['股票型', '债券型', '混合型', '货币型', '指数型', '理财产品']
+RISK_LEVELS = ['low', 'medium', 'high']
+TOP_N = 5
+PROFILE = {'risk_tolerance': 'medium', 'income_level': 'high', 'age': 35, 'occupation': '工程师'}
+
+
+def synthetic_products(num_products, seed=0):
+    """生成合成产品目录，列与products表一致"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'product_id': np.arange(1, num_products + 1),
+        'product_name': [f'产品{i}' for i in range(1, num_products + 1)],
+        'product_type': rng.choice(PRODUCT_TYPES, num_products),
+        'risk_level': rng.choice(RISK_LEVELS, num_products),
+        'expected_return': np.round(rng.uniform(0.01, 0.15, num_products), 4),
+        'min_investment': rng.choice([1000, 5000, 10000, 50000, 100000], num_products),
+    })
+
+
+def legacy_recommend(recommender, features, similarities, top_n):
+    """原实现：为每个相似度为正的产品用 iloc 生成字典，再对完整列表排序"""
+    products_df = features['products_df']
+    recommendations = []
+    for idx, similarity in enumerate(similarities):
+        if similarity <= 0:
+            continue
+        product = products_df.iloc[idx]
+        recommendations.append({
+            'product_id': recommender.convert_to_serializable(product['product_id']),
+            'product_name': str(product['product_name']),
+            'product_type': str(product['product_type']),
+            'risk_level': str(product['risk_level']),
+            'similarity': recommender.convert_to_serializable(similarity),
+            'reason': f'画像匹配度 {float(similarity):.3f}'
+        })
+    recommendations.sort(key=lambda x: x['similarity'], reverse=True)
+    return recommendations[:top_n]
+
+
+def vectorized_recommend(recommender, features, similarities, top_n):
+    selected = select_top_n(similarities, similarities > 0, top_n)
+    return recommender.format_recommendations(features, selected, similarities, '画像匹配度 {similarity:.3f}')
+
+
+def timed(func, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def run_scale(recommender, num_products):
+    features = recommender.build_features(synthetic_products(num_products))
+    profile = recommender.create_profile_from_demographics(PROFILE, features['normalized'].shape[1])
+    repeats = max(3, 200000 // num_products)
+
+    score_latency, similarities = timed(lambda: recommender.profile_similarities(features, profile), repeats)
+    new_latency, new_result = timed(lambda: vectorized_recommend(recommender, features, similarities, TOP_N),
+                                    repeats)
+    if num_products <= LEGACY_MAX_PRODUCTS:
+        legacy_latency, legacy_result = timed(
+            lambda: legacy_recommend(recommender, features, similarities, TOP_N), max(1, repeats // 20))
+        same = [r['product_id'] for r in legacy_result] == [r['product_id'] for r in new_result]
+        legacy = f"{legacy_latency * 1000:>12.2f}ms"
+    else:
+        same, legacy = '-', f"{'-':>14}"
+    print(f"{num_products:>10}{score_latency * 1000:>12.3f}ms{legacy}{new_latency * 1000:>12.3f}ms{str(same):>8}")
+
+
+if __name__ == "__main__":
+    scales = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SCALES
+    recommender = ContentBasedRecommender()
+    print(f"{'产品数':>8}{'相似度计算':>10}{'原实现取Top-N':>12}{'向量化取Top-N':>12}{'结果一致':>6}")
+    for scale in scales:
+        run_scale(recommender, scale)
@@ -0,0 +1,69 @@
+# memory_report.py
+# 对比默认加载与紧凑加载(DatabaseManager.load_table)的内存占用
+#
+# 用法: python benchmarks/memory_report.py [数据库路径]
+# 建议先运行 generate_large_data.py 生成大规模数据后再测试
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'algorithms'))
+
+from database_utils import DatabaseManager
+
+# 各算法实际用到的列
+PROJECTIONS = {
+    'users': None,
+    'products': None,
+    'user_behavior': ['user_id', 'product_id', 'behavior_type', 'rating', 'timestamp'],
+}
+
+
+def frame_memory(df):
+    """DataFrame实际占用的字节数（包含Python字符串对象）"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def format_size(num_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+
+
+def run_report(db_path):
+    # 关闭快照缓存，保证每次都真实从数据库加载
+    db = DatabaseManager(db_path, use_cache=False)
+    print(f"数据库: {db_path}")
+    print(f"{'表':<15}{'行数':>10}{'默认加载':>12}{'紧凑加载':>12}{'压缩比':>8}{'默认耗时':>10}{'紧凑耗时':>10}")
+
+    total_before = total_after = 0
+    for table, columns in PROJECTIONS.items():
+        start = time.perf_counter()
+        with db.connection() as conn:
+            before_df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+        before_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        after_df = db.load_table(table, columns=columns, compact=True)
+        after_time = time.perf_counter() - start
+
+        before, after = frame_memory(before_df), frame_memory(after_df)
+        total_before += before
+        total_after += after
+        ratio = before / after if after else 0
+        print(f"{table:<15}{len(before_df):>10}{format_size(before):>12}{format_size(after):>12}"
+              f"{ratio:>7.1f}x{before_time:>9.3f}s{after_time:>9.3f}s")
+
+        for col in after_df.columns:
+            print(f"    {col:<18}{str(before_df[col].dtype):>10} -> {str(after_df[col].dtype):<10}"
+                  f"{format_size(frame_memory(before_df[[col]])):>10} -> {format_size(frame_memory(after_df[[col]]))}")
+
+    print(f"{'合计':<15}{'':>10}{format_size(total_before):>12}{format_size(total_after):>12}"
+          f"{total_before / total_after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run_report(sys.argv[1] if len(sys.argv) > 1 else './data/financial_data.db')
@@ -5,6 +5,11 @@ from faker import Faker
 import random
 from datetime import datetime, timedelta
 import os
+import sys
+
+# 直接从algorithms目录导入，避免加载整个算法包（大模型依赖等）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'algorithms'))
+from database_utils import INDEX_STATEMENTS, CHANGE_TRACKING_STATEMENTS
 
 # 确保数据目录存在
 os.makedirs('data', exist_ok=True)
@@ -417,6 +422,14 @@ class DataGenerator:
         
         return behavior_data
     
+    def create_indexes(self):
+        """为用户行为表创建索引，支持按用户/产品的快速查询；并建立各表的删除/修改计数"""
+        cursor = self.conn.cursor()
+        for statement in INDEX_STATEMENTS + CHANGE_TRACKING_STATEMENTS:
+            cursor.execute(statement)
+        self.conn.commit()
+        print("已创建用户行为表索引和删除/修改计数触发器")
+    
     def analyze_data_distribution(self):
         """分析数据分布"""
         print("\n=== 数据分布分析 ===")
@@ -477,6 +490,9 @@ class DataGenerator:
         # 生成用户行为数据（使用真实模式）
         self.generate_realistic_behavior_patterns(num_users, num_products)
         
+        # 创建索引
+        self.create_indexes()
+        
         # 分析数据分布
         self.analyze_data_distribution()
         
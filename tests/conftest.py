@@ -0,0 +1,36 @@
+# conftest.py
+# 测试都在示例数据库的临时副本上运行，不会修改 data/financial_data.db
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与 benchmarks 相同，直接导入 algorithms 目录下的模块
+sys.path.insert(0, os.path.join(ROOT, 'algorithms'))
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """复制示例数据库并切换工作目录，推荐器默认的 ./data/financial_data.db 即指向副本"""
+    (tmp_path / 'data').mkdir()
+    path = tmp_path / 'data' / 'financial_data.db'
+    shutil.copyfile(os.path.join(ROOT, 'data', 'financial_data.db'), path)
+    monkeypatch.chdir(tmp_path)
+    return str(path)
+
+
+@pytest.fixture
+def append_behavior(db_path):
+    """向副本追加行为记录，rows 为 [(用户ID, 产品ID, 行为类型, 评分), ...]"""
+    def append(rows):
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.executemany("INSERT INTO user_behavior (user_id, product_id, behavior_type, rating) "
+                             "VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+    return append
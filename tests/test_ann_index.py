@@ -0,0 +1,51 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from ann_index import RandomProjectionLSH
+from collaborative_filtering import top_k_neighbours
+
+K = 10
+
+
+def clustered_ratings(num_rows=1500, dim=100, num_clusters=15, seed=0):
+    """聚成若干簇的非负稀疏评分向量，每个向量都有一批真正相似的近邻"""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((num_clusters, dim)) * (rng.random((num_clusters, dim)) < 0.2)
+    rows = centers[rng.integers(0, num_clusters, num_rows)] * (rng.random((num_rows, dim)) < 0.7)
+    noise = rng.random((num_rows, dim)) * (rng.random((num_rows, dim)) < 0.03)
+    return sparse.csr_matrix(np.round((rows + noise) * 5))
+
+
+def recall(approx_idx, exact_idx):
+    return np.mean([len(set(a[a >= 0].tolist()) & set(e.tolist())) / len(e)
+                    for a, e in zip(approx_idx, exact_idx)])
+
+
+def test_lsh_recall_against_exact_top_k():
+    ratings = clustered_ratings()
+    exact_idx, _ = top_k_neighbours(normalize(ratings, norm='l2', axis=1), K)
+
+    lsh = RandomProjectionLSH().fit(ratings)
+    approx_idx, approx_sim = lsh.all_neighbours(K)
+    assert recall(approx_idx, exact_idx) >= 0.95
+    # 更少的哈希表、不做多探测时候选更少，召回明显下降
+    sparse_lsh = RandomProjectionLSH(n_tables=4, n_probes=1).fit(ratings)
+    assert recall(sparse_lsh.all_neighbours(K)[0], exact_idx) < recall(approx_idx, exact_idx)
+
+    # 候选用精确余弦相似度重排，返回的相似度就是真实值
+    normalized = normalize(ratings, norm='l2', axis=1)
+    rows = np.repeat(np.arange(ratings.shape[0]), K)
+    found = approx_idx.ravel() >= 0
+    exact_sim = np.asarray(normalized[rows[found]].multiply(normalized[approx_idx.ravel()[found]]).sum(axis=1)).ravel()
+    np.testing.assert_allclose(approx_sim.ravel()[found], exact_sim)
+
+
+def test_query_row_matches_batch_neighbours():
+    ratings = clustered_ratings(num_rows=300)
+    lsh = RandomProjectionLSH().fit(ratings)
+    batch_idx, batch_sim = lsh.all_neighbours(K)
+    for row in range(0, 300, 7):
+        idx, sim = lsh.query_row(row, K)
+        np.testing.assert_array_equal(idx, batch_idx[row][:len(idx)])
+        np.testing.assert_allclose(sim, batch_sim[row][:len(sim)])
@@ -0,0 +1,84 @@
+import pytest
+
+import son_mining
+from apriori_recommender import AprioriRecommender
+
+# 示例数据中单个产品的支持度只有几个百分点，使用较低的阈值才能挖出多项集和规则
+THRESHOLDS = {'min_support': 0.01, 'min_confidence': 0.2}
+
+
+def make_recommender(**options):
+    return AprioriRecommender(use_rule_table=False, **THRESHOLDS, **options)
+
+
+def rule_keys(rules):
+    return {(rule['antecedent'], rule['consequent']): (rule['support'], rule['confidence'], rule['lift'])
+            for rule in rules}
+
+
+def assert_matches_full_mine(recommender):
+    full = make_recommender()
+    full.fit()
+    assert recommender.model['num_transactions'] == full.model['num_transactions']
+    assert recommender.model['frequent_counts'] == full.model['frequent_counts']
+    assert recommender.model['border_counts'] == full.model['border_counts']
+    assert any(len(itemset) > 1 for itemset in full.model['frequent_counts'])
+    assert rule_keys(recommender.model['rules']) == rule_keys(full.model['rules'])
+
+
+def test_small_append_matches_full_mine(db_path, append_behavior):
+    recommender = make_recommender()
+    recommender.fit()
+    append_behavior([
+        (1, 7, 'purchase', 5),
+        (2, 8, 'purchase', 4),
+        (999999, 7, 'purchase', 5),  # 新用户即新事务
+        (999999, 8, 'purchase', 3),
+        (3, 9, 'view', 4),           # 浏览记录不是购买，不影响事务
+    ])
+
+    recommender.update_incremental()
+    assert_matches_full_mine(recommender)
+
+
+def test_border_growth_matches_full_mine(db_path, append_behavior):
+    recommender = make_recommender()
+    recommender.fit()
+    # 多个用户同时购买同一组产品，原本不频繁的组合越过阈值，负边界向外移动
+    append_behavior([(user_id, product_id, 'purchase', 5)
+                     for user_id in range(1, 21) for product_id in (7, 8, 9, 10)])
+
+    assert recommender.update_incremental()
+    assert_matches_full_mine(recommender)
+
+
+@pytest.mark.parametrize('options', [{}, {'chunksize': 1000}, {'miner': 'son', 'n_partitions': 3, 'n_workers': 2}])
+def test_purchases_appended_during_fit_are_applied_once(db_path, append_behavior, monkeypatch, options):
+    monkeypatch.setattr(son_mining, 'MIN_LOCAL_SUPPORT_COUNT', 1)
+    recommender = make_recommender(**options)
+    table_version = recommender.db.table_version
+    pending = [[(1, 5, 'purchase', 5), (999999, 5, 'purchase', 4)]]
+
+    def racing_table_version(table, conn=None):
+        # 在取得指纹之后、读取数据之前插入新购买
+        version = table_version(table, conn)
+        if pending:
+            append_behavior(pending.pop())
+        return version
+
+    recommender.db.table_version = racing_table_version
+    recommender.fit()
+    recommender.update_incremental()
+    assert_matches_full_mine(recommender)
+
+
+def test_ensure_model_updates_in_background(db_path, append_behavior):
+    recommender = make_recommender()
+    old_model = recommender.ensure_model()
+    append_behavior([(1, 7, 'purchase', 5), (999999, 8, 'purchase', 3)])
+
+    # 推荐请求不等待增量更新（此处持有训练锁让后台线程先等着），继续拿到当前模型
+    with recommender._fit_lock:
+        assert recommender.ensure_model() is old_model
+    recommender._refit_thread.join()
+    assert_matches_full_mine(recommender)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from collaborative_filtering import CollaborativeFiltering
+
+NEW_BEHAVIOR = [
+    (1, 5, 'view', 4),
+    (2, 5, 'purchase', 2),
+    (1, 5, 'view', 5),           # 同一 (用户, 产品) 的重复评分取平均
+    (999999, 3, 'purchase', 5),  # 新用户
+    (3, 99999, 'view', 4),       # 新产品
+]
+
+
+def assert_same_model(model, expected):
+    np.testing.assert_array_equal(model['user_ids'], expected['user_ids'])
+    np.testing.assert_array_equal(model['product_ids'], expected['product_ids'])
+    np.testing.assert_allclose(model['rating_matrix'].toarray(), expected['rating_matrix'].toarray())
+    np.testing.assert_array_equal(model['rating_count'].toarray(), expected['rating_count'].toarray())
+    np.testing.assert_array_equal(model['neighbour_idx'], expected['neighbour_idx'])
+    np.testing.assert_allclose(model['neighbour_sim'], expected['neighbour_sim'])
+    assert model['version'] == expected['version']
+
+
+def test_online_updates_match_refit(db_path, append_behavior):
+    cf = CollaborativeFiltering(online_updates=True, auto_refit=False)
+    cf.fit()
+    append_behavior(NEW_BEHAVIOR)
+
+    assert cf.sync_new_behavior() == len(NEW_BEHAVIOR)
+
+    refit = CollaborativeFiltering()
+    refit.fit()
+    assert_same_model(cf.model, refit.model)
+
+
+def test_ensure_model_syncs_in_background(db_path, append_behavior):
+    cf = CollaborativeFiltering(online_updates=True)
+    old_model = cf.ensure_model()
+    append_behavior(NEW_BEHAVIOR)
+
+    # 请求线程不等待后台更新（此处持有训练锁让后台线程先等着），继续拿到当前模型
+    with cf._fit_lock:
+        assert cf.ensure_model() is old_model
+    cf._refit_thread.join()
+
+    refit = CollaborativeFiltering()
+    refit.fit()
+    assert_same_model(cf.model, refit.model)
+
+
+@pytest.mark.parametrize('chunksize', [None, 1000])
+def test_rows_appended_during_fit_are_applied_once(db_path, append_behavior, chunksize):
+    cf = CollaborativeFiltering(chunksize=chunksize, online_updates=True, auto_refit=False)
+    table_version = cf.db.table_version
+    pending = [NEW_BEHAVIOR[:2]]
+
+    def racing_table_version(table, conn=None):
+        # 在取得指纹之后、读取数据之前插入新行
+        version = table_version(table, conn)
+        if pending:
+            append_behavior(pending.pop())
+        return version
+
+    cf.db.table_version = racing_table_version
+    cf.fit()
+    assert cf.sync_new_behavior() == 2
+
+    refit = CollaborativeFiltering()
+    refit.fit()
+    assert_same_model(cf.model, refit.model)
+
+
+@pytest.mark.parametrize('k', [2, 25])  # 25 超过预计算的近邻数，批量路径会重新计算近邻
+def test_batch_recommendations_match_single_user(db_path, k):
+    cf = CollaborativeFiltering(auto_refit=False)
+    user_ids = cf.ensure_model()['user_ids'].tolist() + [999999]  # 末尾为没有评分数据的用户
+    # 块数大于1且 n_jobs 大于1 时各块在进程池中计算
+    batch = cf.recommend_for_users(user_ids, top_n=5, k=k, block_size=64, n_jobs=2)
+
+    assert batch.keys() == set(user_ids)
+    for user_id in user_ids:
+        single = cf.recommend_for_user(user_id, top_n=5, k=k)
+        assert [rec['product_id'] for rec in batch[user_id]] == [rec['product_id'] for rec in single]
+        np.testing.assert_allclose([rec['predicted_rating'] for rec in batch[user_id]],
+                                   [rec['predicted_rating'] for rec in single])
+        assert [rec['similar_users_count'] for rec in batch[user_id]] == \
+            [rec['similar_users_count'] for rec in single]
@@ -0,0 +1,33 @@
+import sqlite3
+
+import pandas as pd
+
+from columnar_snapshot import export_snapshot
+from database_utils import DatabaseManager
+
+
+def test_rows_appended_during_export_are_read_once(db_path, append_behavior):
+    db = DatabaseManager(db_path)
+    table_version = db.table_version
+    pending = [[(1, 5, 'purchase', 5), (999999, 3, 'view', 4)]]
+
+    def racing_table_version(table, conn=None):
+        # 在取得行为表指纹之后、读取数据之前追加新行
+        version = table_version(table, conn)
+        if table == 'user_behavior' and pending:
+            append_behavior(pending.pop())
+        return version
+
+    db.table_version = racing_table_version
+    export_snapshot(db)
+
+    # 模拟另一个进程：没有内存快照，以列式快照为基础读取之后追加的增量
+    reader = DatabaseManager(db_path)
+    reader.invalidate()
+    columns = ['user_id', 'product_id', 'behavior_type', 'rating']
+    loaded = reader.load_table('user_behavior', columns)
+    with sqlite3.connect(db_path) as conn:
+        expected = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM user_behavior ORDER BY rowid", conn)
+    assert loaded['user_id'].tolist() == expected['user_id'].tolist()
+    assert loaded['product_id'].tolist() == expected['product_id'].tolist()
+    assert loaded['behavior_type'].astype(str).tolist() == expected['behavior_type'].tolist()
@@ -0,0 +1,119 @@
+import threading
+
+from database_utils import ConnectionPool
+
+
+def hold_connection(pool, release):
+    """在线程中借出连接并保持，直到 release 被设置后归还，返回线程和借到的连接"""
+    result = {}
+    acquired = threading.Event()
+
+    def run():
+        conn = pool.acquire()
+        result['conn'] = conn
+        acquired.set()
+        release.wait()
+        pool.release(conn)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    acquired.wait()
+    return thread, result
+
+
+def test_pragmas_are_applied(db_path):
+    pool = ConnectionPool(db_path, max_size=1)
+    conn = pool.acquire()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2   # MEMORY
+    finally:
+        pool.release(conn)
+
+
+def test_nested_acquire_returns_the_same_connection(db_path):
+    pool = ConnectionPool(db_path, max_size=1)
+    outer = pool.acquire()
+    inner = pool.acquire(timeout=1)
+    assert inner is outer
+    pool.release(inner)
+    assert pool.stats()['idle'] == 0
+    pool.release(outer)
+    assert pool.stats()['idle'] == 1
+
+
+def test_most_recently_returned_connection_is_reused(db_path):
+    pool = ConnectionPool(db_path, max_size=2)
+    first_release, second_release = threading.Event(), threading.Event()
+    first, first_conn = hold_connection(pool, first_release)
+    second, second_conn = hold_connection(pool, second_release)
+    assert first_conn['conn'] is not second_conn['conn']
+
+    first_release.set()
+    first.join()
+    second_release.set()
+    second.join()
+
+    conn = pool.acquire()
+    assert conn is second_conn['conn']
+    pool.release(conn)
+    stats = pool.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['waits']) == (2, 1, 2, 0)
+    assert stats['hit_rate'] == 1 / 3
+
+
+def test_waiting_for_a_returned_connection_is_not_a_hit(db_path):
+    pool = ConnectionPool(db_path, max_size=1)
+    release = threading.Event()
+    holder, held = hold_connection(pool, release)
+    waited = {}
+
+    def wait_for_connection():
+        waited['conn'] = pool.acquire(timeout=5)
+        pool.release(waited['conn'])
+
+    waiter = threading.Thread(target=wait_for_connection)
+    waiter.start()
+    while pool.stats()['waits'] == 0:
+        waiter.join(0.01)
+    release.set()
+    holder.join()
+    waiter.join()
+
+    assert waited['conn'] is held['conn']
+    stats = pool.stats()
+    assert (stats['misses'], stats['waits'], stats['hits']) == (1, 1, 0)
+    assert stats['hit_rate'] == 0.0
+
+
+def test_concurrent_checkouts_never_share_a_connection(db_path):
+    pool = ConnectionPool(db_path, max_size=2)
+    in_use, lock, errors = set(), threading.Lock(), []
+    start = threading.Barrier(6)
+
+    def worker():
+        start.wait()
+        for _ in range(20):
+            conn = pool.acquire(timeout=5)
+            with lock:
+                if id(conn) in in_use:
+                    errors.append(conn)
+                in_use.add(id(conn))
+            conn.execute("SELECT COUNT(*) FROM user_behavior").fetchone()
+            with lock:
+                in_use.discard(id(conn))
+            pool.release(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats()
+    assert not errors
+    assert stats['size'] == stats['idle'] <= 2
+    assert stats['hits'] + stats['misses'] + stats['waits'] == 6 * 20
+    # 等待归还的请求不算命中
+    assert stats['hit_rate'] == stats['hits'] / (6 * 20)
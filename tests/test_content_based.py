@@ -0,0 +1,33 @@
+import itertools
+
+from content_based import ContentBasedRecommender, OCCUPATION_MAPPING
+
+PROFILES = [
+    {'risk_tolerance': risk, 'income_level': income, 'age': age, 'occupation': occupation}
+    for risk, income, age, occupation in itertools.product(
+        ['low', 'medium', 'high', '未知'],
+        ['low', 'high', '未知'],
+        [0, 18, 35, 35.0, 80, 95],   # 超过上限的年龄与上限共用同一个画像
+        list(OCCUPATION_MAPPING) + ['其他'])
+]
+
+
+def test_profile_table_matches_exact_scoring(db_path):
+    cached = ContentBasedRecommender()
+    exact = ContentBasedRecommender(use_profile_table=False)
+    features = cached.load_product_features()
+
+    for profile in PROFILES:
+        for top_n in (1, 5, 20):
+            # 确认结果来自预计算表，而不是退回了实时计算
+            assert cached.lookup_profile_table(profile, top_n, features) is not None
+            assert cached.recommend_for_profile(profile, top_n) == exact.recommend_for_profile(profile, top_n)
+
+
+def test_profiles_outside_the_table_fall_back(db_path):
+    recommender = ContentBasedRecommender()
+    features = recommender.load_product_features()
+    for age in (float('nan'), float('inf'), -1, 35.5):
+        profile = {'risk_tolerance': 'low', 'income_level': 'high', 'age': age, 'occupation': '教师'}
+        assert recommender.profile_key(profile) is None
+        assert recommender.lookup_profile_table(profile, 5, features) is None
@@ -0,0 +1,64 @@
+import random
+from itertools import combinations
+
+import pytest
+
+from bitset_index import VerticalBitsets
+from fp_growth import fp_growth, association_rules
+
+
+def random_baskets(seed, num_transactions=40, num_items=7):
+    rng = random.Random(seed)
+    return [rng.sample(range(num_items), rng.randint(0, 5)) for _ in range(num_transactions)]
+
+
+def brute_force_itemsets(transactions, min_support, max_len=None):
+    """枚举所有出现过的项的组合，逐个统计支持度"""
+    transactions = [frozenset(t) for t in transactions]
+    items = sorted(set().union(*transactions))
+    result = {}
+    for size in range(1, (max_len or len(items)) + 1):
+        for itemset in combinations(items, size):
+            count = sum(1 for t in transactions if t.issuperset(itemset))
+            if count and count / len(transactions) >= min_support - 1e-9:
+                result[frozenset(itemset)] = count / len(transactions)
+    return result
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('min_support', [0.05, 0.1, 0.25])
+@pytest.mark.parametrize('max_len', [None, 1, 2])
+def test_frequent_itemsets_match_brute_force(seed, min_support, max_len):
+    transactions = random_baskets(seed)
+    expected = brute_force_itemsets(transactions, min_support, max_len)
+
+    assert fp_growth(transactions, min_support, max_len) == pytest.approx(expected)
+    eclat = VerticalBitsets.from_transactions(transactions).eclat(min_support, max_len)
+    assert eclat.keys() == expected.keys()
+    assert eclat == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rule_confidences_match_brute_force(seed):
+    transactions = [frozenset(t) for t in random_baskets(seed)]
+    frequent = fp_growth(transactions, 0.05)
+    rules = association_rules(frequent, min_confidence=0.3)
+
+    expected = {}
+    for itemset in brute_force_itemsets(transactions, 0.05):
+        for size in range(1, len(itemset)):
+            for antecedent in map(frozenset, combinations(sorted(itemset), size)):
+                covered = [t for t in transactions if t >= antecedent]
+                confidence = sum(1 for t in covered if t >= itemset) / len(covered)
+                if confidence >= 0.3:
+                    expected[(antecedent, itemset - antecedent)] = confidence
+
+    assert any(len(rule['antecedent']) > 1 for rule in rules)
+    assert {(rule['antecedent'], rule['consequent']): rule['confidence'] for rule in rules} == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitsets_restore_transactions(seed):
+    # 事务数不是8的倍数时最后一个字节只用到一部分位
+    transactions = [sorted(basket) for basket in random_baskets(seed, num_transactions=37)]
+    assert VerticalBitsets.from_transactions(transactions).transactions() == transactions
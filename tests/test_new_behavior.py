@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from database_utils import DatabaseManager
+
+NEW_ROWS = [
+    (1, 5, 'purchase', 5),
+    (999999, 3, 'view', 2),
+    (2, 7, 'purchase', 4),
+]
+
+
+def rows(df):
+    return list(zip(df['user_id'].tolist(), df['product_id'].tolist(),
+                    df['behavior_type'].astype(str).tolist(), df['rating'].tolist()))
+
+
+@pytest.mark.parametrize('chunksize', [2, 1000])
+def test_new_behavior_since_watermark(db_path, append_behavior, chunksize):
+    db = DatabaseManager(db_path)
+    columns = ['user_id', 'product_id', 'behavior_type', 'rating']
+    everything, watermark = db.get_new_behavior(since=0, columns=columns)
+    with sqlite3.connect(db_path) as conn:
+        assert len(everything) == conn.execute("SELECT COUNT(*) FROM user_behavior").fetchone()[0]
+
+    append_behavior(NEW_ROWS[:1])
+    append_behavior(NEW_ROWS[1:])
+    new, new_watermark = db.get_new_behavior(since=watermark, columns=columns, chunksize=chunksize)
+    assert rows(new) == NEW_ROWS
+    assert new_watermark == watermark + len(NEW_ROWS)
+
+    # 没有新数据时返回空结果，水位线不变
+    empty, same_watermark = db.get_new_behavior(since=new_watermark, columns=columns, chunksize=chunksize)
+    assert empty.empty
+    assert same_watermark == new_watermark
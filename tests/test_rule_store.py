@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from apriori_recommender import AprioriRecommender
+from database_utils import DatabaseManager
+from rule_store import RuleStore
+
+THRESHOLDS = {'min_support': 0.01, 'min_confidence': 0.2}
+
+
+def rule_keys(rules):
+    return {(rule['antecedent'], rule['consequent']): (rule['support'], rule['confidence'], rule['lift'])
+            for rule in rules}
+
+
+@pytest.fixture
+def built(db_path):
+    recommender = AprioriRecommender(**THRESHOLDS)
+    recommender.build_rule_table()
+    return recommender, RuleStore(DatabaseManager(db_path))
+
+
+def test_save_load_round_trip(built):
+    recommender, store = built
+    model = recommender.model
+
+    meta = store.meta()
+    assert tuple(meta['behavior_version']) == model['version']
+    assert meta['watermark'] == model['watermark']
+    assert meta['num_transactions'] == model['num_transactions']
+    assert meta['max_antecedent_size'] == max(len(rule['antecedent']) for rule in model['rules'])
+    assert store.load_itemset_counts() == (model['frequent_counts'], model['border_counts'])
+    assert store.popular_items() == sorted(model['item_support'].items(), key=lambda x: (-x[1], x[0]))
+
+    # 从规则表恢复的状态可以直接继续增量维护
+    restored = AprioriRecommender(**THRESHOLDS)
+    assert restored.load_state()
+    assert rule_keys(restored.model['rules']) == rule_keys(model['rules'])
+
+
+def test_lookup_by_antecedent(built):
+    recommender, store = built
+    rules = recommender.model['rules']
+    products = sorted(recommender.model['item_support'])
+    rng = random.Random(0)
+    baskets = [set(rule['antecedent']) for rule in rules[:20]]
+    baskets += [set(rng.sample(products, rng.randint(0, 6))) for _ in range(50)]
+
+    assert any(len(rule['antecedent']) > 1 for rule in rules)
+    for purchased in baskets:
+        expected = [rule for rule in rules if rule['antecedent'] <= purchased]
+        assert rule_keys(store.lookup(purchased)) == rule_keys(expected)
+        # 推荐时查表与内存中匹配规则选出的结果一致
+        assert recommender.best_rules(purchased, store.lookup(purchased)) == \
+            recommender.match_rules(purchased, recommender.model['rules_by_antecedent'])
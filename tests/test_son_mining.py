@@ -0,0 +1,26 @@
+import pytest
+
+import son_mining
+from apriori_recommender import AprioriRecommender
+from database_utils import DatabaseManager
+from fp_growth import fp_growth
+
+MIN_SUPPORT = 0.02
+N_PARTITIONS = 3
+
+
+def test_son_matches_fp_growth(db_path, monkeypatch):
+    # 示例数据库只有约500个事务，按默认的局部最小支持数下限只能分出一个分区；
+    # 下限只影响性能，不影响结果，测试中放开以覆盖跨分区的情况
+    monkeypatch.setattr(son_mining, 'MIN_LOCAL_SUPPORT_COUNT', 1)
+    ranges = son_mining.partition_user_ranges(DatabaseManager(db_path, use_pool=False, use_cache=False),
+                                              N_PARTITIONS, min_size=int(1 / MIN_SUPPORT))
+    assert len(ranges) == N_PARTITIONS
+
+    expected = fp_growth(AprioriRecommender(use_rule_table=False).build_bitsets().transactions(), MIN_SUPPORT)
+    result = son_mining.son_frequent_itemsets(db_path, MIN_SUPPORT, n_partitions=N_PARTITIONS, max_workers=2)
+
+    assert any(len(itemset) > 1 for itemset in expected)
+    assert result.keys() == expected.keys()
+    for itemset, support in expected.items():
+        assert result[itemset] == pytest.approx(support)
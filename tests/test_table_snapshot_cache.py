@@ -0,0 +1,71 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from database_utils import DatabaseManager
+
+COLUMNS = ['user_id', 'product_id', 'behavior_type', 'rating']
+
+
+def execute(db_path, *statements):
+    """在另一个连接上执行写入，模拟其他进程"""
+    conn = sqlite3.connect(db_path)
+    try:
+        for sql, params in statements:
+            conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def read_behavior(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM user_behavior ORDER BY rowid", conn)
+
+
+def assert_loaded_matches_database(db, db_path):
+    loaded = db.load_table('user_behavior', COLUMNS)
+    expected = read_behavior(db_path)
+    assert len(loaded) == len(expected)
+    for col in COLUMNS:
+        assert loaded[col].astype(str).tolist() == expected[col].astype(str).tolist()
+
+
+INSERT = ("INSERT INTO user_behavior (user_id, product_id, behavior_type, rating) VALUES (?, ?, ?, ?)",
+          (1, 5, 'purchase', 5))
+LAST_ROWID = "(SELECT MAX(rowid) FROM user_behavior)"
+
+WRITES = {
+    'append': [INSERT],
+    'delete_middle': [("DELETE FROM user_behavior WHERE rowid = 10", ())],
+    'update_in_place': [(f"UPDATE user_behavior SET rating = 1 - rating WHERE rowid = {LAST_ROWID}", ())],
+    # 没有AUTOINCREMENT时新行复用被删除的最大rowid，行数和最大rowid都不变
+    'delete_last_then_insert': [(f"DELETE FROM user_behavior WHERE rowid = {LAST_ROWID}", ()), INSERT],
+    'delete_middle_then_append': [("DELETE FROM user_behavior WHERE rowid = 10", ()), INSERT, INSERT],
+}
+
+
+@pytest.mark.parametrize('write', list(WRITES))
+def test_fingerprint_and_snapshot_follow_writes(db_path, write):
+    db = DatabaseManager(db_path)
+    before = db.table_version('user_behavior')
+    assert_loaded_matches_database(db, db_path)
+
+    execute(db_path, *WRITES[write])
+
+    after = db.table_version('user_behavior')
+    assert after != before
+    assert db._is_append(before, after) == (write == 'append')
+    assert_loaded_matches_database(db, db_path)
+
+
+def test_writes_to_other_tables_keep_the_fingerprint(db_path):
+    db = DatabaseManager(db_path)
+    before = db.table_version('user_behavior')
+    users_before = db.table_version('users')
+
+    execute(db_path, ("UPDATE users SET age = age + 1 WHERE user_id = 1", ()))
+
+    assert db.table_version('user_behavior') == before
+    assert db.table_version('users') != users_before